@@ -0,0 +1,234 @@
+"""
+探测引擎和页面生成的负载测试
+
+在回环地址上启动成百上千个桩服务器，通过伪造的 Shodan 客户端喂给
+get_activation_servers，再完整走一遍探测和 HTML 生成，不需要网络和 API 密钥。
+
+用法:
+    python benchmarks/bench_probe.py --hosts 1000
+    python benchmarks/bench_probe.py --hosts 2000 --engine stream --json bench.json
+    python benchmarks/bench_probe.py --hosts 1000 --backend requests,asyncio
+
+报告内容: 每秒探测数、探测耗时 p50/p99、峰值内存（RSS）、HTML 生成耗时，
+以及按桩服务器行为统计的判定结果，便于发现性能回退和比较不同探测引擎。
+指定多个探测后端时每个后端在单独的子进程中运行（各自启动同样的桩服务器、使用空的状态和输出目录），
+峰值内存互不影响，各自输出一份报告。
+aiohttp 后端需要先 pip install aiohttp，--backend all 只包含已安装的后端。
+"""
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+# 缓存和探测历史写到临时目录，不污染仓库里的 .state
+STATE_DIR = tempfile.mkdtemp(prefix='jetbrains-bench-')
+atexit.register(shutil.rmtree, STATE_DIR, True)
+os.environ['JETBRAINS_SERVERS_STATE_DIR'] = STATE_DIR
+
+import jetbrains_servers_updater as updater  # noqa: E402
+from stub_servers import BEHAVIORS, FakeShodan, StubPopulation, raise_fd_limit  # noqa: E402
+
+ENGINES = ('phased', 'stream')
+
+def percentile(values, pct):
+    """
+    最近秩法计算百分位数
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def peak_rss_mb():
+    """
+    当前进程的峰值常驻内存（MB），Linux 上 ru_maxrss 的单位为 KB，macOS 上为字节
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+def run_benchmark(args):
+    """
+    启动桩服务器，用 args.backends 中唯一的探测后端运行一遍
+
+    Returns:
+        dict: 报告
+    """
+    raise_fd_limit()
+    with StubPopulation(args.hosts) as population:
+        return run_backend(args, population, args.backends[0])
+
+def run_isolated(args, backend):
+    """
+    在子进程中用一个探测后端运行负载测试，子进程直接打印报告
+
+    峰值内存（ru_maxrss）按进程统计，HTML 生成会按内容哈希跳过已有的页面，
+    多个后端在同一进程、同一输出目录中运行时后面的报告会受前面的影响。
+
+    Returns:
+        dict: 子进程的报告
+    """
+    report_path = os.path.join(STATE_DIR, f'report-{backend}.json')
+    command = [sys.executable, os.path.abspath(__file__), '--backend', backend, '--json', report_path,
+               '--hosts', str(args.hosts), '--engine', args.engine,
+               '--concurrency', str(args.concurrency), '--connect-concurrency', str(args.connect_concurrency),
+               '--rate-limit', str(args.rate_limit), '--subnet-concurrency', str(args.subnet_concurrency),
+               '--asn-concurrency', str(args.asn_concurrency), '--max-sockets', str(args.max_sockets),
+               '--shodan-latency', str(args.shodan_latency)]
+    subprocess.run(command, check=True)
+    with open(report_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def run_backend(args, population, backend):
+    """
+    用一个探测后端完整走一遍获取、探测和 HTML 生成，返回报告
+    """
+    api = FakeShodan(population.endpoints, latency=args.shodan_latency)
+    max_pages = len(api.matches) // api.page_size + 1
+    log = io.StringIO()
+    limiter = updater.ProbeLimiter(args.rate_limit, args.subnet_concurrency, args.asn_concurrency,
+                                   args.max_sockets)
+
+    start = time.perf_counter()
+    # 探测过程中逐个服务器的输出量很大，收集起来不打印
+    with contextlib.redirect_stdout(log):
+        if args.engine == 'stream':
+            servers, results = updater.stream_probe_servers(
+                max_pages=max_pages, cache_ttl=0, concurrency=args.concurrency,
+                connect_concurrency=args.connect_concurrency, api=api, limiter=limiter, backend=backend)
+            discovery_time = None
+        else:
+            servers = updater.get_activation_servers(max_pages=max_pages, cache_ttl=0, api=api)
+            discovery_time = time.perf_counter() - start
+            results = updater.probe_all_servers(
+                servers, concurrency=args.concurrency, connect_concurrency=args.connect_concurrency,
+                limiter=limiter, backend=backend)
+    wall_time = time.perf_counter() - start
+
+    valid_results = updater.sort_by_latency([r for r in results if r.valid])
+    valid_servers = [r.url for r in valid_results]
+    invalid_servers = [r.url for r in results if not r.valid]
+    latencies = {r.url: r.latency for r in valid_results}
+
+    # HTML 生成写到空的临时目录，不会因为已有相同内容的页面而跳过
+    render_dir = tempfile.mkdtemp(prefix='render-', dir=STATE_DIR)
+    cwd = os.getcwd()
+    os.chdir(render_dir)
+    try:
+        render_start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            updater.generate_html(valid_servers, invalid_servers, latencies)
+        render_time = time.perf_counter() - render_start
+        html_size = os.path.getsize(os.path.join(render_dir, 'index.html'))
+    finally:
+        os.chdir(cwd)
+
+    outcomes = {behavior: {'valid': 0, 'invalid': 0} for behavior in BEHAVIORS}
+    for result in results:
+        behavior = population.behavior_of(result.url)
+        outcomes[behavior]['valid' if result.valid else 'invalid'] += 1
+
+    probe_times = [r.total_time for r in results if r.total_time is not None]
+    return {
+        'engine': args.engine,
+        'backend': backend,
+        'hosts': args.hosts,
+        'candidates': len(servers),
+        'shodan_calls': api.calls,
+        'concurrency': args.concurrency,
+        'connect_concurrency': args.connect_concurrency,
+        'rate_limit': args.rate_limit,
+        'subnet_concurrency': args.subnet_concurrency,
+        'max_sockets': args.max_sockets,
+        'throttled': dict(limiter.throttled),
+        'wall_time_s': round(wall_time, 3),
+        'discovery_time_s': None if discovery_time is None else round(discovery_time, 3),
+        'probes_per_second': round(len(results) / wall_time, 1) if wall_time else None,
+        'probe_p50_ms': round(percentile(probe_times, 50) * 1000, 1),
+        'probe_p99_ms': round(percentile(probe_times, 99) * 1000, 1),
+        'valid': len(valid_servers),
+        'invalid': len(invalid_servers),
+        'outcomes_by_behavior': outcomes,
+        'html_render_ms': round(render_time * 1000, 1),
+        'html_bytes': html_size,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+def print_report(report):
+    print(f"探测引擎: {report['engine']}  探测后端: {report['backend']}  桩服务器: {report['hosts']}  候选服务器: {report['candidates']}")
+    print(f"并发: HTTP {report['concurrency']} / 建连 {report['connect_concurrency']}")
+    print(f"调度限制: 速率 {report['rate_limit']:g} 次/秒  每网段 {report['subnet_concurrency']}  "
+          f"套接字 {report['max_sockets']}  等待次数 {report['throttled']}")
+    print(f"总耗时: {report['wall_time_s']:.2f} 秒  吞吐量: {report['probes_per_second']} 次/秒")
+    print(f"单次探测耗时: p50 {report['probe_p50_ms']} ms  p99 {report['probe_p99_ms']} ms")
+    print(f"有效: {report['valid']}  无效: {report['invalid']}")
+    for behavior, counts in report['outcomes_by_behavior'].items():
+        print(f"  {behavior:<10} 有效 {counts['valid']:>5}  无效 {counts['invalid']:>5}")
+    print(f"HTML 生成: {report['html_render_ms']} ms，{report['html_bytes']} 字节")
+    print(f"峰值内存: {report['peak_rss_mb']} MB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="探测引擎和页面生成的负载测试")
+    parser.add_argument('--hosts', type=int, default=500, help="桩服务器数量（默认: 500）")
+    parser.add_argument('--engine', choices=ENGINES, default='phased',
+                        help="phased 为先获取后探测，stream 为边获取边探测（默认: phased）")
+    parser.add_argument('--backend', default=updater.DEFAULT_PROBE_BACKEND,
+                        help=f"探测后端，多个后端用逗号分隔，all 表示所有已安装的后端"
+                             f"（可选: {', '.join(updater.PROBE_BACKENDS)}；默认: {updater.DEFAULT_PROBE_BACKEND}）")
+    parser.add_argument('--concurrency', type=int, default=updater.DEFAULT_CONCURRENCY,
+                        help=f"HTTP 验证阶段并发数（默认: {updater.DEFAULT_CONCURRENCY}）")
+    parser.add_argument('--connect-concurrency', type=int, default=updater.DEFAULT_CONNECT_CONCURRENCY,
+                        help=f"TCP 建连预筛阶段并发数（默认: {updater.DEFAULT_CONNECT_CONCURRENCY}）")
+    parser.add_argument('--rate-limit', type=float, default=updater.DEFAULT_RATE_LIMIT,
+                        help=f"每秒最多发起的探测数，0 表示不限制（默认: {updater.DEFAULT_RATE_LIMIT:g}）")
+    # 桩服务器都在 127.0.0.1 上，属于同一个 /24，默认不限制网段并发，否则测的只是这一项限制
+    parser.add_argument('--subnet-concurrency', type=int, default=0,
+                        help="同一网段同时探测的最大数量，0 表示不限制（默认: 0）")
+    parser.add_argument('--asn-concurrency', type=int, default=updater.DEFAULT_ASN_CONCURRENCY,
+                        help=f"同一 ASN 同时探测的最大数量（默认: {updater.DEFAULT_ASN_CONCURRENCY}）")
+    parser.add_argument('--max-sockets', type=int, default=updater.DEFAULT_MAX_SOCKETS,
+                        help=f"同时打开的最大套接字数量，0 表示不限制（默认: {updater.DEFAULT_MAX_SOCKETS}）")
+    parser.add_argument('--shodan-latency', type=float, default=0.0,
+                        help="伪造的 Shodan 每页响应延迟，单位秒（默认: 0）")
+    parser.add_argument('--json', metavar='PATH', help="把报告以 JSON 格式写入文件")
+    args = parser.parse_args(argv)
+    if args.backend == 'all':
+        args.backends = [name for name, backend in updater.PROBE_BACKENDS.items() if backend.available()]
+    else:
+        args.backends = args.backend.split(',')
+    for name in args.backends:
+        if name not in updater.PROBE_BACKENDS:
+            parser.error(f"未知的探测后端: {name}")
+        if not updater.PROBE_BACKENDS[name].available():
+            parser.error(f"探测后端 {name} 需要安装 {name}")
+
+    if len(args.backends) == 1:
+        reports = [run_benchmark(args)]
+        print_report(reports[0])
+    else:
+        reports = []
+        for i, backend in enumerate(args.backends):
+            if i:
+                print(flush=True)
+            reports.append(run_isolated(args, backend))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            # 只有一个后端时保持原来的格式，写入单个报告
+            json.dump(reports[0] if len(reports) == 1 else reports, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+启动耗时测试
+
+本工具常由大量短时任务调用，启动开销会直接累加到每次任务上。这里在独立的子进程中
+反复执行几种典型调用，统计从进程启动到退出的耗时，并检查每种调用实际加载了哪些重量级依赖。
+
+用法:
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 30 --json startup.json
+
+测试的调用方式:
+
+- import:       只导入模块
+- help:         python jetbrains_servers_updater.py --help
+- render-only:  python jetbrains_servers_updater.py --render-only（在临时目录中，用预先写好的数据文件）
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SCRIPT = os.path.join(REPO_DIR, 'jetbrains_servers_updater.py')
+
+# 只在访问 Shodan 或探测时才需要的依赖，其他调用方式不应加载
+HEAVY_MODULES = ('shodan', 'requests', 'pytz')
+
+# 子进程中执行调用后打印已加载的重量级依赖
+_CHECK_MODULES = f"""
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+sys.stdout = sys.__stdout__
+print('LOADED', ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))
+"""
+
+def scenarios():
+    """
+    各调用方式的命令行（不含 Python 解释器）
+    """
+    return {
+        'import': ['-c', f"import sys; sys.path.insert(0, {REPO_DIR!r}); import jetbrains_servers_updater"],
+        'help': [SCRIPT, '--help'],
+        'render-only': [SCRIPT, '--render-only'],
+    }
+
+def seed_outputs(directory, count=1000):
+    """
+    在临时目录中写入一份数据文件，供 --render-only 读取
+    """
+    records = [{'url': f'http://10.0.{i // 256}.{i % 256}:8080', 'valid': i % 3 == 0,
+                'latency': 0.05 + i % 100 / 1000 if i % 3 == 0 else None,
+                'last_checked': '2026-01-01T00:00:00+00:00',
+                'source': {'provider': 'shodan', 'queries': ['fls-auth']}} for i in range(count)]
+    document = {'version': 2, 'generated_at': '2026-01-01T00:00:00+00:00', 'content_hash': '',
+                'total': len(records), 'valid': sum(r['valid'] for r in records), 'servers': records}
+    with open(os.path.join(directory, 'jetbrains_servers.json'), 'w', encoding='utf-8') as f:
+        json.dump(document, f)
+
+def time_run(argv, cwd):
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + argv, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                   check=True)
+    return time.perf_counter() - start
+
+def loaded_modules(argv, cwd):
+    """
+    执行一次调用，返回其中加载了的重量级依赖
+    """
+    if argv[0] == '-c':
+        code = argv[1] + f"; print('LOADED', ','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+        command = [sys.executable, '-c', code]
+    else:
+        command = [sys.executable, '-c', _CHECK_MODULES] + argv
+    output = subprocess.run(command, cwd=cwd, capture_output=True, text=True, check=True).stdout
+    line = next(line for line in output.splitlines() if line.startswith('LOADED'))
+    return [name for name in line[len('LOADED '):].split(',') if name]
+
+def run_benchmark(args):
+    work_dir = tempfile.mkdtemp(prefix='jetbrains-startup-')
+    try:
+        seed_outputs(work_dir)
+        report = {'python': sys.version.split()[0], 'runs': args.runs, 'scenarios': {}}
+        for name, argv in scenarios().items():
+            # 第一次运行预热文件系统缓存和字节码缓存，不计入结果
+            time_run(argv, work_dir)
+            times = sorted(time_run(argv, work_dir) for _ in range(args.runs))
+            report['scenarios'][name] = {
+                'min_ms': round(times[0] * 1000, 1),
+                'median_ms': round(times[len(times) // 2] * 1000, 1),
+                'max_ms': round(times[-1] * 1000, 1),
+                'heavy_modules': loaded_modules(argv, work_dir),
+            }
+        return report
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def print_report(report):
+    print(f"Python {report['python']}，每种调用运行 {report['runs']} 次")
+    for name, stats in report['scenarios'].items():
+        modules = ', '.join(stats['heavy_modules']) or '无'
+        print(f"  {name:<12} 最短 {stats['min_ms']:>7} ms  中位数 {stats['median_ms']:>7} ms  "
+              f"最长 {stats['max_ms']:>7} ms  加载的重量级依赖: {modules}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="启动耗时测试")
+    parser.add_argument('--runs', type=int, default=10, help="每种调用的运行次数（默认: 10）")
+    parser.add_argument('--json', metavar='PATH', help="把报告以 JSON 格式写入文件")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+本地桩服务器和伪造的 Shodan 客户端，供性能测试使用
+
+桩服务器全部监听在回环地址上，按比例模拟真实候选服务器的几类行为:
+
+- ok:        返回 200
+- redirect:  302 重定向到 https://account.jetbrains.com/fls-auth（真实激活服务器的特征）
+- drip:      返回 200 后以每秒 1 字节的速度无限输出响应体
+- reset:     接受连接后立即发送 RST
+- blackhole: 接受队列已满，SYN 被丢弃，建连一直挂起直到超时
+- refused:   端口没有监听，建连被拒绝
+
+所有桩服务器运行在独立的子进程中，不与被测的探测引擎争抢事件循环。
+"""
+import asyncio
+import multiprocessing
+import resource
+import socket
+import struct
+import time
+
+BEHAVIORS = ('ok', 'redirect', 'drip', 'reset', 'blackhole', 'refused')
+
+# 默认行为比例，大致对应 Shodan 候选服务器中死地址占多数的实际情况
+DEFAULT_MIX = {
+    'ok': 0.10,
+    'redirect': 0.15,
+    'drip': 0.05,
+    'reset': 0.10,
+    'blackhole': 0.30,
+    'refused': 0.30,
+}
+
+FLS_AUTH_URL = 'https://account.jetbrains.com/fls-auth'
+
+def raise_fd_limit():
+    """
+    把文件描述符软限制提高到硬限制，成百上千个监听端口和并发连接都需要
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def plan_population(count, mix=None):
+    """
+    按比例生成每个桩服务器的行为列表
+
+    Returns:
+        list: 长度为 count 的行为名称列表
+    """
+    mix = mix or DEFAULT_MIX
+    total_weight = sum(mix.values())
+    plan = []
+    for behavior in BEHAVIORS:
+        plan.extend([behavior] * int(count * mix.get(behavior, 0) / total_weight))
+    # 取整后不足的部分补为 ok
+    plan.extend(['ok'] * (count - len(plan)))
+    return plan
+
+async def _read_request(reader):
+    try:
+        await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+        return True
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        return False
+
+async def _close(writer):
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+
+async def _handle_ok(reader, writer):
+    if await _read_request(reader):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok')
+        await writer.drain()
+    await _close(writer)
+
+async def _handle_redirect(reader, writer):
+    if await _read_request(reader):
+        writer.write(f'HTTP/1.1 302 Found\r\nLocation: {FLS_AUTH_URL}\r\n'
+                     f'Content-Length: 0\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
+    await _close(writer)
+
+async def _handle_drip(reader, writer):
+    if await _read_request(reader):
+        try:
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 100000000\r\n\r\n')
+            while True:
+                writer.write(b'x')
+                await writer.drain()
+                await asyncio.sleep(1)
+        except (ConnectionError, asyncio.CancelledError):
+            # 客户端断开，或桩服务器进程退出时被取消
+            pass
+    await _close(writer)
+
+async def _handle_reset(reader, writer):
+    sock = writer.get_extra_info('socket')
+    # SO_LINGER 为 0 时关闭连接会直接发送 RST
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    writer.transport.abort()
+
+HANDLERS = {
+    'ok': _handle_ok,
+    'redirect': _handle_redirect,
+    'drip': _handle_drip,
+    'reset': _handle_reset,
+}
+
+def _open_blackhole():
+    """
+    创建一个接受队列已满的监听端口，之后的 SYN 都会被内核丢弃
+    """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(0)
+    port = listener.getsockname()[1]
+    fillers = []
+    # backlog 为 0 时内核仍允许少量排队连接，多填几个直到新连接建不上
+    for _ in range(4):
+        filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        filler.setblocking(False)
+        try:
+            filler.connect(('127.0.0.1', port))
+        except BlockingIOError:
+            pass
+        fillers.append(filler)
+    return port, [listener] + fillers
+
+def _reserve_refused_port():
+    """
+    占用一个只绑定不监听的端口，连接会被拒绝，且端口不会被其他桩服务器复用
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    return sock.getsockname()[1], sock
+
+async def _serve(plan, conn):
+    servers = []
+    keep_alive = []
+    endpoints = []
+    for behavior in plan:
+        if behavior == 'blackhole':
+            port, sockets = _open_blackhole()
+            keep_alive.extend(sockets)
+        elif behavior == 'refused':
+            port, sock = _reserve_refused_port()
+            keep_alive.append(sock)
+        else:
+            server = await asyncio.start_server(HANDLERS[behavior], '127.0.0.1', 0, backlog=64)
+            servers.append(server)
+            port = server.sockets[0].getsockname()[1]
+        endpoints.append((port, behavior))
+
+    conn.send(endpoints)
+    # 等待父进程通知退出
+    await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    for server in servers:
+        server.close()
+    for sock in keep_alive:
+        sock.close()
+
+def _run_stub_process(plan, conn):
+    raise_fd_limit()
+    asyncio.run(_serve(plan, conn))
+
+class StubPopulation:
+    """
+    在子进程中启动一批桩服务器，通过 with 语句管理生命周期
+
+    Attributes:
+        endpoints: (端口, 行为) 列表
+    """
+
+    def __init__(self, count, mix=None):
+        self.plan = plan_population(count, mix)
+        self.endpoints = []
+        self._conn = None
+        self._process = None
+
+    def __enter__(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_run_stub_process, args=(self.plan, child_conn), daemon=True)
+        self._process.start()
+        self._conn = parent_conn
+        self.endpoints = parent_conn.recv()
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self._conn.send('stop')
+        except OSError:
+            pass
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+
+    def behavior_of(self, url):
+        """
+        根据服务器URL查找对应桩服务器的行为
+        """
+        port = int(url.rsplit(':', 1)[1])
+        return dict(self.endpoints).get(port)
+
+class FakeShodan:
+    """
+    伪造的 Shodan 客户端，把桩服务器按页返回给 get_activation_servers
+
+    可选地重复返回部分匹配项，用于检验按 ip:port 去重的逻辑。
+    """
+
+    def __init__(self, endpoints, page_size=100, duplicate_ratio=0.1, latency=0.0):
+        matches = [{'ip_str': '127.0.0.1', 'port': port} for port, _ in endpoints]
+        step = int(1 / duplicate_ratio) if duplicate_ratio else 0
+        if step:
+            matches.extend(matches[::step])
+        self.matches = matches
+        self.page_size = page_size
+        self.latency = latency
+        self.calls = 0
+
+    def search(self, query, page=1):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        start = (page - 1) * self.page_size
+        return {
+            'total': len(self.matches),
+            'matches': self.matches[start:start + self.page_size],
+        }
@@ -1,9 +1,57 @@
-import shodan
 import os
-from datetime import datetime
-import pytz
-from typing import List
-import requests
+import abc
+import argparse
+import asyncio
+import cProfile
+import gzip
+import hashlib
+import heapq
+import importlib.util
+import ipaddress
+import re
+import json
+import math
+import queue
+import signal
+import socket
+import sqlite3
+import ssl
+import string
+import struct
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager, nullcontext
+from dataclasses import dataclass
+from functools import lru_cache, partial
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin, urlsplit
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Type, Union
+
+__all__ = [
+    # 供其他程序使用的接口
+    'discover', 'probe', 'probe_async', 'render',
+    'ProbeResult', 'ProbeHistory', 'ProbeLimiter', 'ProbePipeline', 'ShodanQuery', 'load_queries',
+    'UptimeLog', 'load_uptime',
+    'ProbeBackend', 'RequestsBackend', 'AiohttpBackend', 'StreamsBackend', 'PROBE_BACKENDS', 'make_backend',
+    # 分步骤使用的底层函数
+    'get_activation_servers', 'iter_activation_servers', 'probe_all_servers', 'stream_probe_servers',
+    'probe_server', 'test_server', 'sort_by_latency', 'sort_servers', 'update_servers_file', 'generate_html',
+    'render_html', 'render_feeds', 'write_feeds', 'main',
+]
+
+# shodan 和 requests 导入较慢，分别在第一次访问 Shodan API 和第一次探测时才导入，
+# 只生成页面或离线运行时不会加载
+
+try:
+    import brotli
+except ImportError:
+    # 可选依赖，未安装时不生成 .br 压缩文件
+    brotli = None
 
 # 从环境变量获取 Shodan API 密钥
 SHODAN_API_KEY = os.getenv('SHODAN_API_KEY')
@@ -13,920 +61,3603 @@ SHODAN_API_KEY = os.getenv('SHODAN_API_KEY')
 
 # 输出文件路径
 OUTPUT_FILE = "jetbrains_servers.txt"
+HTML_OUTPUT_FILE = "index.html"
+
+# 输出文件中嵌入的内容哈希，只在文件开头查找
+CONTENT_HASH_PATTERN = re.compile(r'(?:# 内容哈希: |<meta name="content-hash" content=")([0-9a-f]{64})')
+CONTENT_HASH_SCAN_BYTES = 4096
+
+# 机器可读的服务器数据，每个文件旁边会生成预压缩的 .gz 和 .br 版本
+FEED_JSON_FILE = "jetbrains_servers.json"
+FEED_NDJSON_FILE = "jetbrains_servers.ndjson"
+# 版本 2: source 中的 query 字符串改为找到该服务器的搜索语句名称列表 queries
+FEED_VERSION = 2
+# 数据文件只在服务器集合、来源或延迟档位变化时重写，内容没有实质变化时最多这么久（秒）重写一次，
+# 刷新其中的探测时间，同时避免每次定时运行都产生提交和页面重新部署
+FEED_MAX_AGE = 7 * 24 * 3600
+
+# 页面模板和静态资源目录（相对脚本所在位置），静态资源按内容哈希发布到 ASSETS_DIR
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+ASSETS_DIR = 'assets'
+ASSET_HASH_LENGTH = 10
+
+# Shodan 搜索语句
+SHODAN_QUERY = 'Location: https://account.jetbrains.com/fls-auth'
+
+# 搜索语句配置文件，不存在时只使用 SHODAN_QUERY
+DEFAULT_QUERIES_FILE = "shodan_queries.json"
+
+# Shodan 每页返回的匹配项数量
+SHODAN_PAGE_SIZE = 100
+
+# 默认最多获取的页数（第 2 页起每页消耗 1 个查询额度）
+DEFAULT_MAX_PAGES = 10
+
+# 本地状态目录（Shodan 缓存、探测历史等），可通过环境变量覆盖
+STATE_DIR = os.getenv('JETBRAINS_SERVERS_STATE_DIR', '.state')
+
+# Shodan 响应缓存目录、默认有效期（秒）和容量上限（字节）
+SHODAN_CACHE_DIR = os.path.join(STATE_DIR, 'shodan_cache')
+DEFAULT_CACHE_TTL = 6 * 3600
+SHODAN_CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+# 缓存中保留的匹配项字段，完整的 banner 数据体积太大且用不到
+SHODAN_MATCH_FIELDS = ('ip_str', 'port', 'asn', 'org', 'isp', 'hostnames', 'location', 'timestamp', 'transport')
+
+# 探测历史数据库路径
+PROBE_HISTORY_DB = os.path.join(STATE_DIR, 'probe_history.sqlite3')
+
+# 增量模式下探测结果的默认有效期（秒），未过期的服务器不再重新探测
+DEFAULT_FRESHNESS = 6 * 3600
+
+# 隔离: 连续失败 QUARANTINE_THRESHOLD 次的服务器进入隔离期，隔离期内不再探测、按最近一次的结果
+# 视为无效。隔离期从 QUARANTINE_BASE 秒开始，之后每多失败一次翻倍，最长 QUARANTINE_MAX 秒；
+# 隔离期结束后重新探测一次，成功即解除隔离
+QUARANTINE_THRESHOLD = 3
+QUARANTINE_BASE = 24 * 3600
+QUARANTINE_MAX = 30 * 24 * 3600
+# 单次运行判断隔离期时的提前量: 定时任务的间隔和隔离期等长（每天一次对 24 小时），每次启动时间又略有
+# 偏差，隔离期恰好在下一次运行之后几分钟才结束时会被整整推迟一个周期，实际隔离时间翻倍
+QUARANTINE_SLACK = QUARANTINE_BASE // 10
+
+# 在线率历史: 每次探测追加一条定长记录，再汇总为按小时和按天的记录，各自按保留期压缩
+UPTIME_DIR = os.path.join(STATE_DIR, 'uptime')
+UPTIME_RAW_RETENTION = 2 * 24 * 3600
+UPTIME_HOURLY_RETENTION = 2 * 24 * 3600
+UPTIME_DAILY_RETENTION = 90 * 24 * 3600
+UPTIME_COMPACT_INTERVAL = 3600
+# 显示的在线率时间窗口: (名称, 汇总粒度（秒）, 桶数)，按小时或按天对齐（UTC）
+UPTIME_WINDOWS = (('24h', 3600, 24), ('7d', 24 * 3600, 7), ('30d', 24 * 3600, 30))
+
+# 有效服务器的排序方式
+SORT_LABELS = {
+    'latency': '延迟从低到高',
+    'uptime-24h': '24 小时在线率从高到低',
+    'uptime-7d': '7 天在线率从高到低',
+    'uptime-30d': '30 天在线率从高到低',
+}
+DEFAULT_SORT = 'latency'
+
+# 流式模式下候选服务器队列的默认容量，队列满时暂停获取 Shodan 结果
+DEFAULT_QUEUE_SIZE = 2 * SHODAN_PAGE_SIZE
+
+# 内置 HTTP 服务默认监听的地址
+DEFAULT_SERVE_HOST = '127.0.0.1'
+
+# 守护进程模式: 有效服务器的重新探测间隔、全局探测速率（次/秒）和获取新候选服务器的间隔，
+# 连续失败的服务器重新探测间隔按 2 的幂次退避，最多退避到 2^DAEMON_MAX_BACKOFF_EXPONENT 倍
+DEFAULT_REPROBE_INTERVAL = 600
+DEFAULT_PROBE_RATE = 2.0
+DEFAULT_DISCOVERY_INTERVAL = 3600
+DAEMON_MAX_BACKOFF_EXPONENT = 6
+# 服务器集合变化后最短间隔多久重新生成输出文件（秒），避免频繁变化时反复写文件
+DAEMON_RENDER_INTERVAL = 30
+
+# 探测失败原因分类
+ERROR_CLASSES = ('timeout', 'refused', 'reset', 'tls', 'dns', 'http_status', 'redirect', 'other')
+
+# 延迟直方图的桶上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus 指标名前缀
+METRICS_PREFIX = 'jetbrains_servers'
+# 计数中表示服务器数量的项，其余（probed、reused、throttled_* 等）为事件次数
+SERVER_COUNTERS = ('candidates', 'quarantined')
+
+# --profile 模式: 未指定目录时的输出目录，以及采样线程抓取调用栈的间隔（秒）
+DEFAULT_PROFILE_DIR = 'profile'
+PROFILE_SAMPLE_INTERVAL = 0.01
+# 最多保留的耗时区间数量，守护进程长时间剖析时只保留最近的区间，内存和 trace.json 不会无限增长
+PROFILE_MAX_SPANS = 200000
+
+# 默认并发探测数量（HTTP 验证阶段）
+DEFAULT_CONCURRENCY = 50
+
+# TCP 建连预筛阶段的默认并发数，建连只占用一个套接字，可以远高于 HTTP 阶段
+DEFAULT_CONNECT_CONCURRENCY = 500
+
+# 探测调度层的默认限制，0 表示不限制:
+# - 全局每秒最多发起的探测数（令牌桶，允许一秒的突发）
+# - 同一 /24 网段（IPv6 为 /64）和同一 ASN 同时进行的探测数，候选服务器常集中在少数托管商
+# - 同时打开的探测套接字总数，低于常见的 1024 文件描述符软限制并留出余量
+DEFAULT_RATE_LIMIT = 200.0
+DEFAULT_SUBNET_CONCURRENCY = 8
+DEFAULT_ASN_CONCURRENCY = 32
+DEFAULT_MAX_SOCKETS = 768
+
+# 自适应超时: 首次探测的服务器使用较紧的默认值，之后根据历史延迟的
+# 平滑均值和波动（与 TCP 重传超时的算法相同）计算，并限制在上下限之间
+DEFAULT_CONNECT_TIMEOUT = 2.0
+DEFAULT_READ_TIMEOUT = 4.0
+PROBE_TIMEOUT_FLOOR = 1.0
+PROBE_TIMEOUT_CEILING = 10.0
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+
+# 探测方式: get 为流式 GET（只读取状态行和响应头），head 为 HEAD 请求
+PROBE_METHODS = ('get', 'head')
+DEFAULT_PROBE_METHOD = 'get'
+
+# 探测后端: HTTP 验证阶段发出请求的方式，可选值见 PROBE_BACKENDS
+DEFAULT_PROBE_BACKEND = 'requests'
+# 会被跟随的重定向状态码，与 requests 的判断一致
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# asyncio 后端最多读取的响应头长度，超出时判定无效
+PROBE_MAX_HEADER_BYTES = 64 * 1024
+
+# 非 80/443 端口同时尝试 HTTP 和 HTTPS，探测成功的协议按 ip:port 缓存在探测历史数据库中，
+# 缓存过期后重新检测，服务器更换协议后也能被重新发现
+SCHEME_CACHE_TTL = 7 * 24 * 3600
+# 与 Happy Eyeballs 相同，先用 HTTP 探测，这段时间（秒）内没有判定有效才同时发起 HTTPS 探测，
+# 响应快的 HTTP 服务器不会多一次 HTTPS 请求
+SCHEME_DETECT_DELAY = 0.25
+
+# 单次探测最多跟随的重定向次数
+PROBE_MAX_REDIRECTS = 5
+
+# 激活服务器会重定向到该地址，命中即可判定有效，无需再请求 JetBrains
+FLS_AUTH_URL = 'https://account.jetbrains.com/fls-auth'
+
+@lru_cache(maxsize=None)
+def _beijing_tz():
+    """
+    北京时区，只解析一次；系统没有时区数据库时（如未安装 tzdata 的 Windows）
+    使用固定的 UTC+8，北京时间没有夏令时，两者结果相同
+    """
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo('Asia/Shanghai')
+    except Exception:
+        return timezone(timedelta(hours=8), 'CST')
+
+def get_beijing_time(timestamp: Optional[float] = None):
+    """
+    获取北京时间
+
+    Args:
+        timestamp: Unix 时间戳，默认为当前时间；同一次运行的各处输出应传入同一个时间戳
+    
+    Returns:
+        str: 格式化的北京时间字符串
+    """
+    moment = datetime.fromtimestamp(time.time() if timestamp is None else timestamp, _beijing_tz())
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def _escape_label(value) -> str:
+    """
+    转义 Prometheus 标签值中的反斜杠、双引号和换行
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    """
+    累计分桶直方图，与 Prometheus histogram 的语义一致
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                return
+        self.counts[-1] += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        Returns:
+            List[tuple]: (桶上限, 累计数量) 列表，最后一项为 '+Inf'
+        """
+        total = 0
+        result = []
+        for upper, count in zip([str(b) for b in self.buckets] + ['+Inf'], self.counts):
+            total += count
+            result.append((upper, total))
+        return result
+
+    def to_dict(self) -> dict:
+        return {'buckets': dict(self.cumulative()), 'sum': round(self.sum, 6), 'count': self.count}
+
+class Profiler:
+    """
+    --profile 模式下的性能剖析
+
+    - 每个阶段（RunMetrics.phase）用 cProfile 对主线程做确定性剖析，同名阶段累加，
+      嵌套的阶段只计入最内层；
+    - 采样线程定期抓取所有线程的调用栈，按当前阶段汇总成 flamegraph.pl / speedscope
+      可读取的折叠栈格式，覆盖线程池中的 requests 调用和 Shodan 翻页线程；
+    - 探测等热点路径上的耗时区间记录为 Chrome trace 事件，可在 Perfetto 中查看。
+
+    输出文件: <阶段>.pstats、<阶段>.collapsed 和 trace.json。
+    耗时区间保存在长度为 max_spans 的环形缓冲区中，超出后丢弃最早的区间。
+    """
+
+    def __init__(self, directory: str, interval: float = PROFILE_SAMPLE_INTERVAL,
+                 max_spans: int = PROFILE_MAX_SPANS):
+        self.directory = directory
+        self.interval = interval
+        self.profiles = {}
+        self.stacks = {}
+        self.active = []
+        self.spans = deque(maxlen=max_spans)
+        self.span_count = 0
+        self.origin = time.perf_counter()
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        # 代码对象到栈帧名称的缓存，避免每次采样重复格式化
+        self.labels = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        # 同一线程同时只能有一个 cProfile 生效，进入嵌套阶段时先暂停外层
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        if self.active:
+            self.profiles[self.active[-1]].disable()
+        self.active.append(name)
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.active.pop()
+            if self.active:
+                self.profiles[self.active[-1]].enable()
+
+    @contextmanager
+    def span(self, name: str, track: Optional[str] = None, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.span_count += 1
+            self.spans.append((name, track, threading.get_ident(), start, time.perf_counter(), args))
+
+    def _label(self, code) -> str:
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(';', ',')
+            self.labels[code] = label
+        return label
+
+    def _sample(self) -> None:
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            phase = self.active[-1] if self.active else 'other'
+            stacks = self.stacks.setdefault(phase, Counter())
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                # 线程池中的线程按池名汇总，不按编号拆开
+                frames.append(re.sub(r'_\d+$', '', names.get(ident, str(ident))))
+                stacks[';'.join(reversed(frames))] += 1
+
+    def start(self) -> None:
+        self.sampler.start()
+
+    def stop(self) -> List[str]:
+        """
+        停止采样并写入所有剖析结果
+
+        Returns:
+            List[str]: 写入的文件路径
+        """
+        self.stopped.set()
+        self.sampler.join()
+        os.makedirs(self.directory, exist_ok=True)
+        written = []
+        for name, profile in self.profiles.items():
+            path = os.path.join(self.directory, f'{name}.pstats')
+            profile.dump_stats(path)
+            written.append(path)
+        for name, stacks in self.stacks.items():
+            path = os.path.join(self.directory, f'{name}.collapsed')
+            _write_atomic(path, ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common()))
+            written.append(path)
+        path = os.path.join(self.directory, 'trace.json')
+        dropped = self.span_count - len(self.spans)
+        _write_atomic(path, json.dumps({'traceEvents': self._trace_events(), 'otherData': {'dropped_spans': dropped}}))
+        written.append(path)
+        if dropped:
+            print(f"耗时区间超过 {self.spans.maxlen} 个，trace.json 只包含最近的区间（丢弃了 {dropped} 个）")
+        return written
+
+    def _trace_events(self) -> List[dict]:
+        """
+        把耗时区间转换为 Chrome trace 事件: 有 track 的区间（如按服务器区分的探测）在协程中交错执行，
+        记录为按 track 分组的异步事件；其他区间记录为所在线程上的完整事件
+        """
+        events = []
+        tracks = {}
+        for name, track, thread, start, end, args in self.spans:
+            ts = (start - self.origin) * 1e6
+            if track is None:
+                events.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': thread, 'ts': ts,
+                               'dur': (end - start) * 1e6, 'args': args})
+            else:
+                track_id = tracks.setdefault(track, len(tracks) + 1)
+                base = {'name': name, 'cat': 'probe', 'pid': 1, 'tid': thread, 'id': track_id}
+                events.append({**base, 'ph': 'b', 'ts': ts, 'args': {'track': track, **args}})
+                events.append({**base, 'ph': 'e', 'ts': (end - self.origin) * 1e6})
+        return events
+
+# 当前生效的剖析器，未开启 --profile 时为 None，下面的钩子直接返回空的上下文管理器
+_profiler: Optional[Profiler] = None
+_NO_PROFILE = nullcontext()
+
+def profile_phase(name: str):
+    """
+    剖析一个阶段，未开启剖析时不做任何事
+    """
+    if _profiler is None:
+        return _NO_PROFILE
+    return _profiler.phase(name)
+
+def profile_span(name: str, track: Optional[str] = None, **args):
+    """
+    记录一个耗时区间，未开启剖析时不做任何事
+
+    Args:
+        name: 区间名称
+        track: 在协程中交错执行的区间按 track 分组显示（如服务器URL），为 None 时显示在所在线程上
+        args: 附加在 trace 事件上的参数
+    """
+    if _profiler is None:
+        return _NO_PROFILE
+    return _profiler.span(name, track, **args)
+
+def start_profiling(directory: str) -> Profiler:
+    """
+    开启剖析，之后的阶段和耗时区间都会被记录
+    """
+    global _profiler
+    _profiler = Profiler(directory)
+    _profiler.start()
+    return _profiler
+
+def stop_profiling() -> List[str]:
+    """
+    关闭剖析并写入结果文件，返回写入的文件路径
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler.stop() if profiler is not None else []
+
+class RunMetrics:
+    """
+    单次运行的指标: 各阶段耗时、候选和结果计数、失败原因分类和延迟直方图
+
+    可输出为 JSON 运行报告，或 node_exporter textfile 收集器使用的 Prometheus 文本格式。
+    cumulative 为 True 时（守护进程模式）计数和耗时从进程启动起累积，按 Prometheus 计数器导出；
+    有效和无效服务器数量等当前状态用 set 记录，始终按 gauge 导出。
+    """
+
+    def __init__(self, cumulative: bool = False):
+        self.cumulative = cumulative
+        self.started_at = time.time()
+        self.phases = {}
+        self.counters = Counter()
+        self.gauges = {}
+        self.error_classes = Counter()
+        self.stages = {}
+        self.queries = {}
+        self.probe_duration = Histogram()
+        self.server_latency = Histogram()
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        统计一个阶段的耗时，同名阶段的耗时会累加；开启 --profile 时同时剖析该阶段
+        """
+        start = time.perf_counter()
+        try:
+            with profile_phase(name):
+                yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+
+    def set(self, name: str, value: int) -> None:
+        """
+        记录一个当前值，如有效服务器数量，后一次覆盖前一次
+        """
+        self.gauges[name] = value
+
+    def observe_probe(self, result) -> None:
+        """
+        记录一次实际发起的探测
+        """
+        self.count('probed')
+        if result.total_time is not None:
+            self.probe_duration.observe(result.total_time)
+        if result.valid:
+            if result.latency is not None:
+                self.server_latency.observe(result.latency)
+        else:
+            self.error_classes[result.error_class or 'other'] += 1
+
+    def record_stage(self, stats) -> None:
+        """
+        记录探测流水线某个阶段的统计信息
+        """
+        self.stages[stats.key] = {'passed': stats.passed, 'failed': stats.failed,
+                                   'elapsed_seconds': round(stats.elapsed, 6)}
+
+    def record_queries(self, queries, sources: Dict[str, List[str]], results) -> None:
+        """
+        按搜索语句统计找到的服务器数量和其中有效服务器的比例
+
+        Args:
+            queries: 本次使用的搜索语句列表
+            sources: 服务器URL到找到它的搜索语句名称列表的映射
+            results: 探测结果列表
+        """
+        valid = {result.url for result in results if result.valid}
+        for query in queries:
+            found = [url for url, names in sources.items() if query.name in names]
+            valid_count = sum(1 for url in found if url in valid)
+            self.queries[query.name] = {
+                'query': query.query,
+                'found': len(found),
+                # 最先由该语句找到的服务器数量
+                'first_found': sum(1 for url in found if sources[url][0] == query.name),
+                # 只有该语句能找到的服务器数量
+                'exclusive': sum(1 for url in found if len(sources[url]) == 1),
+                'valid': valid_count,
+                'valid_rate': round(valid_count / len(found), 4) if found else 0.0,
+            }
+
+    def to_dict(self) -> dict:
+        return {
+            'version': 1,
+            'cumulative': self.cumulative,
+            'started_at': self.started_at,
+            'duration_seconds': round(time.time() - self.started_at, 6),
+            'phases': {name: round(seconds, 6) for name, seconds in self.phases.items()},
+            'counters': dict(self.counters),
+            'gauges': dict(self.gauges),
+            'errors_by_class': {name: self.error_classes.get(name, 0) for name in ERROR_CLASSES},
+            'stages': self.stages,
+            'queries': self.queries,
+            'probe_duration_seconds': self.probe_duration.to_dict(),
+            'server_latency_seconds': self.server_latency.to_dict(),
+        }
+
+    def to_prometheus(self) -> str:
+        """
+        生成 Prometheus 文本格式的指标
+        """
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            full_name = f"{METRICS_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+                suffix = f"{{{label_text}}}" if label_text else ''
+                lines.append(f"{full_name}{suffix} {value}")
+
+        def histogram(name, help_text, hist):
+            full_name = f"{METRICS_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} histogram")
+            for upper, count in hist.cumulative():
+                lines.append(f'{full_name}_bucket{{le="{upper}"}} {count}')
+            lines.append(f"{full_name}_sum {hist.sum}")
+            lines.append(f"{full_name}_count {hist.count}")
+
+        metric('last_run_timestamp_seconds', 'gauge', 'Start time of the last run.', [({}, self.started_at)])
+        phases = [({'phase': name}, seconds) for name, seconds in self.phases.items()]
+        errors = [({'class': name}, self.error_classes.get(name, 0)) for name in ERROR_CLASSES]
+        if self.cumulative:
+            metric('phase_seconds_total', 'counter', 'Time spent in each phase since the daemon started.', phases)
+            metric('servers', 'gauge', 'Current server counts.',
+                   [({'kind': name}, value) for name, value in sorted(self.gauges.items())])
+            metric('events_total', 'counter', 'Candidate and probe counts since the daemon started.',
+                   [({'kind': name}, value) for name, value in sorted(self.counters.items())])
+            metric('probe_errors_total', 'counter', 'Failed probes by error class since the daemon started.', errors)
+        else:
+            metric('phase_duration_seconds', 'gauge', 'Duration of each run phase.', phases)
+            servers = {name: value for name, value in self.counters.items() if name in SERVER_COUNTERS}
+            metric('servers', 'gauge', 'Server counts of the last run.',
+                   [({'kind': name}, value) for name, value in sorted({**servers, **self.gauges}.items())])
+            metric('events', 'gauge', 'Probe and scheduling event counts of the last run.',
+                   [({'kind': name}, value) for name, value in sorted(self.counters.items())
+                    if name not in SERVER_COUNTERS])
+            metric('probe_errors', 'gauge', 'Failed probes by error class.', errors)
+        metric('stage_passed', 'gauge', 'Candidates passing each pipeline stage.',
+               [({'stage': name}, stats['passed']) for name, stats in self.stages.items()])
+        metric('stage_failed', 'gauge', 'Candidates dropped by each pipeline stage.',
+               [({'stage': name}, stats['failed']) for name, stats in self.stages.items()])
+        metric('query_found', 'gauge', 'Servers found by each Shodan query.',
+               [({'query': name}, stats['found']) for name, stats in self.queries.items()])
+        metric('query_valid', 'gauge', 'Valid servers found by each Shodan query.',
+               [({'query': name}, stats['valid']) for name, stats in self.queries.items()])
+        histogram('probe_duration_seconds', 'Wall time of each probe.', self.probe_duration)
+        histogram('server_latency_seconds', 'Time to first byte of valid servers.', self.server_latency)
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path: str) -> None:
+        _write_atomic(path, json.dumps(self.to_dict(), ensure_ascii=False, indent=2))
+
+    def write_prometheus(self, path: str) -> None:
+        _write_atomic(path, self.to_prometheus())
+
+def _write_atomic(path: str, content) -> None:
+    """
+    先写临时文件再重命名，读取方不会看到写了一半的文件
+
+    Args:
+        path: 目标文件路径
+        content: 文本（按 UTF-8 写入）或字节串
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    if isinstance(content, bytes):
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+    else:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+    os.replace(tmp_path, path)
+
+def _build_server_url(ip: str, port: int) -> str:
+    """
+    根据 IP 和端口构建服务器URL
+    """
+    if port == 443:
+        return f"https://{ip}"
+    return f"http://{ip}:{port}"
+
+def _split_endpoint(url: str) -> Tuple[str, str, int]:
+    """
+    把服务器URL拆分为 (协议, 主机, 端口)，没有协议时按 http 处理，没有端口时取协议的默认端口
+    """
+    if not url.startswith(('http://', 'https://')):
+        url = f'http://{url}'
+    parts = urlsplit(url)
+    return parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+
+def _with_scheme(url: str, scheme: str) -> str:
+    """
+    把服务器URL换成指定协议，主机和端口不变
+    """
+    _, host, port = _split_endpoint(url)
+    if scheme == 'https' and port == 443:
+        return f"https://{host}"
+    return f"{scheme}://{host}:{port}"
+
+def _needs_scheme_detection(url: str) -> bool:
+    """
+    没有显式指定 https 且端口不是 80/443 的服务器，无法从端口判断协议
+    """
+    scheme, _, port = _split_endpoint(url)
+    return scheme == 'http' and port not in (80, 443)
+
+def _shodan_cache_path(query: str, page: int) -> str:
+    """
+    获取某个查询某一页对应的缓存文件路径
+    """
+    key = hashlib.sha256(f"{query}\n{page}".encode('utf-8')).hexdigest()
+    return os.path.join(SHODAN_CACHE_DIR, f"{key}.json")
+
+def _read_shodan_cache(query: str, page: int, ttl: Optional[float]) -> Optional[dict]:
+    """
+    读取缓存的 Shodan 搜索结果
+
+    Args:
+        query: 搜索语句
+        page: 页码
+        ttl: 缓存有效期（秒），为 None 时忽略有效期（离线模式）
+
+    Returns:
+        dict: 缓存的搜索结果，未命中或已过期时返回 None
+    """
+    path = _shodan_cache_path(query, page)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if ttl is not None and time.time() - entry.get('fetched_at', 0) > ttl:
+        return None
+
+    # 更新访问时间，淘汰时按最近使用排序
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return entry.get('results')
+
+def _evict_shodan_cache(max_bytes: int = SHODAN_CACHE_MAX_BYTES) -> None:
+    """
+    缓存总大小超过上限时，按最近使用时间淘汰最旧的条目
+    """
+    entries = []
+    with os.scandir(SHODAN_CACHE_DIR) as it:
+        for entry in it:
+            if entry.is_file() and entry.name.endswith('.json'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+def _write_shodan_cache(query: str, page: int, results: dict) -> dict:
+    """
+    精简搜索结果后原子写入缓存
+
+    Returns:
+        dict: 精简后的搜索结果
+    """
+    results = {
+        'total': results.get('total', 0),
+        'matches': [
+            {field: match[field] for field in SHODAN_MATCH_FIELDS if field in match}
+            for match in results.get('matches', [])
+        ],
+    }
+    entry = {'query': query, 'page': page, 'fetched_at': time.time(), 'results': results}
+
+    try:
+        os.makedirs(SHODAN_CACHE_DIR, exist_ok=True)
+        path = _shodan_cache_path(query, page)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        _evict_shodan_cache()
+    except OSError as e:
+        print(f"写入 Shodan 缓存时出错: {str(e)}")
+    return results
+
+def _search_shodan(api, query: str, page: int, cache_ttl: float, offline: bool) -> Optional[dict]:
+    """
+    带缓存的 Shodan 搜索
+
+    Args:
+        api: Shodan 客户端，离线模式下为 None
+        query: 搜索语句
+        page: 页码
+        cache_ttl: 缓存有效期（秒），为 0 时总是请求 API
+        offline: 离线模式，只读取缓存
+
+    Returns:
+        dict: 搜索结果，离线模式下缓存未命中时返回 None
+    """
+    results = _read_shodan_cache(query, page, None if offline else cache_ttl)
+    if results is not None:
+        print(f"第 {page} 页命中本地缓存")
+        return results
+    if offline:
+        return None
+    with profile_span('shodan_search', query=query, page=page):
+        results = api.search(query, page=page)
+    return _write_shodan_cache(query, page, results)
+
+class _SharedShodanClient:
+    """
+    所有搜索语句线程共用的 Shodan 客户端
+
+    shodan 库按客户端限速（每秒 1 次请求），记录上次请求时间的 _api_query_time 也不是线程安全的。
+    各语句共用一个客户端并用锁串行化请求，同一个 API 密钥的总请求速率不超过限制，不会因限流报错而丢页。
+    """
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.lock = threading.Lock()
+        self._client = None
+
+    def search(self, query: str, page: int = 1) -> dict:
+        with self.lock:
+            if self._client is None:
+                import shodan
+                self._client = shodan.Shodan(self.api_key)
+            return self._client.search(query, page=page)
+
+@dataclass
+class ShodanQuery:
+    """
+    一条 Shodan 搜索语句
+
+    Attributes:
+        name: 用于标记服务器来源和统计的名称
+        query: 搜索语句
+        max_pages: 该语句最多获取的页数，为 None 时使用命令行的 --max-pages
+    """
+    name: str
+    query: str
+    max_pages: Optional[int] = None
+
+DEFAULT_QUERIES = [ShodanQuery('fls-auth', SHODAN_QUERY)]
+
+def load_queries(path: Optional[str] = None) -> List[ShodanQuery]:
+    """
+    从 JSON 配置文件读取搜索语句列表
+
+    配置文件格式为 {"queries": [...]}，每一项可以是搜索语句字符串，
+    也可以是包含 query 以及可选的 name、max_pages 的对象。
+
+    Args:
+        path: 配置文件路径，为 None 时读取 DEFAULT_QUERIES_FILE，该文件不存在则使用默认语句
+
+    Returns:
+        List[ShodanQuery]: 搜索语句列表
+    """
+    if path is None:
+        if not os.path.exists(DEFAULT_QUERIES_FILE):
+            return list(DEFAULT_QUERIES)
+        path = DEFAULT_QUERIES_FILE
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    queries = []
+    for item in config.get('queries', []):
+        if isinstance(item, str):
+            item = {'query': item}
+        if not item.get('query'):
+            raise ValueError(f"{path}: 搜索语句缺少 query 字段")
+        queries.append(ShodanQuery(name=item.get('name') or item['query'], query=item['query'],
+                                   max_pages=item.get('max_pages')))
+    names = [query.name for query in queries]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path}: 搜索语句名称重复")
+    if not queries:
+        raise ValueError(f"{path}: 没有配置搜索语句")
+    return queries
+
+def _iter_query_pages(api, query: ShodanQuery, max_pages: int, cache_ttl: float,
+                      offline: bool) -> Iterator[List[dict]]:
+    """
+    逐页获取单条搜索语句的匹配项
+    """
+    total_pages = max_pages
+    page = 1
+    while page <= total_pages:
+        results = _search_shodan(api, query.query, page, cache_ttl, offline)
+        if results is None:
+            print(f"[{query.name}] 离线模式: 第 {page} 页没有缓存，停止获取")
+            break
+        matches = results.get('matches', [])
+
+        if page == 1:
+            total = results.get('total', len(matches))
+            total_pages = min(max_pages, math.ceil(total / SHODAN_PAGE_SIZE))
+            print(f"[{query.name}] 搜索结果: 共 {total} 个匹配项，计划获取 {total_pages} 页")
+
+        if not matches:
+            break
+        yield matches
+        page += 1
+
+def iter_activation_servers(max_pages: int = DEFAULT_MAX_PAGES, cache_ttl: float = DEFAULT_CACHE_TTL,
+                            offline: bool = False, api=None, queries: Optional[List[ShodanQuery]] = None,
+                            sources: Optional[Dict[str, List[str]]] = None,
+                            asns: Optional[Dict[str, str]] = None) -> Iterator[List[str]]:
+    """
+    并发执行所有搜索语句，逐页获取结果，按 (ip, port) 去重后产出新发现的服务器
+
+    每条语句在独立的线程中翻页，各页到达后立即合并，先返回的语句不必等待其他语句。
+
+    Args:
+        max_pages: 每条语句最多获取的页数，用于限制查询额度消耗；语句自带 max_pages 时取两者较小值
+        cache_ttl: 本地缓存有效期（秒），为 0 时不使用缓存
+        offline: 离线模式，只从本地缓存读取，不访问 Shodan API
+        api: 自定义的 Shodan 客户端（需提供 search(query, page=...) 方法，会被多个线程同时调用），
+            默认所有语句共用一个由 SHODAN_API_KEY 创建、请求串行执行的客户端
+        queries: 搜索语句列表，默认只使用 SHODAN_QUERY
+        sources: 提供时记录每个服务器由哪些语句找到（URL 到语句名称列表的映射，第一个为最先找到的语句）
+        asns: 提供时记录匹配项中的 ASN（IP 到 ASN 的映射），在产出每一页之前更新，供探测调度使用
+
+    Yields:
+        List[str]: 每一页中首次出现的服务器URL列表
+    """
+    queries = queries or DEFAULT_QUERIES
+    if not offline and api is None:
+        if not SHODAN_API_KEY:
+            raise ValueError("未设置 SHODAN_API_KEY 环境变量")
+        api = _SharedShodanClient(SHODAN_API_KEY)
+
+    # 每条语句最多缓冲一页，调用方处理不过来时翻页线程暂停，不会提前消耗查询额度
+    pages = queue.Queue(maxsize=len(queries))
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def fetch(query):
+        try:
+            client = None if offline else api
+            limit = min(max_pages, query.max_pages or max_pages)
+            for matches in _iter_query_pages(client, query, limit, cache_ttl, offline):
+                put((query, matches))
+                if stopped.is_set():
+                    break
+        except Exception as e:
+            print(f"[{query.name}] 获取服务器时出错: {str(e)}")
+        finally:
+            put((query, None))
+
+    executor = ThreadPoolExecutor(max_workers=len(queries), thread_name_prefix='shodan')
+    for query in queries:
+        executor.submit(fetch, query)
+
+    seen = {}
+    remaining = len(queries)
+    try:
+        while remaining:
+            query, matches = pages.get()
+            if matches is None:
+                remaining -= 1
+                continue
+
+            servers = []
+            for result in matches:
+                url = _build_server_url(result['ip_str'], result.get('port', 443))
+                found_by = seen.get(url)
+                if found_by is not None:
+                    # 其他语句已经找到过，只补充来源
+                    if query.name not in found_by:
+                        found_by.append(query.name)
+                    continue
+                seen[url] = [query.name]
+                servers.append(url)
+                if asns is not None and result.get('asn'):
+                    asns[result['ip_str']] = result['asn']
+
+            print(f"[{query.name}] {len(matches)} 个匹配项，新增 {len(servers)} 个服务器")
+            yield servers
+    finally:
+        # 调用方提前停止迭代时通知其他语句停止翻页，不等待剩余页面
+        stopped.set()
+        executor.shutdown(wait=False)
+        if sources is not None:
+            sources.update(seen)
+
+def get_activation_servers(max_pages: int = DEFAULT_MAX_PAGES, cache_ttl: float = DEFAULT_CACHE_TTL,
+                           offline: bool = False, api=None, queries: Optional[List[ShodanQuery]] = None,
+                           sources: Optional[Dict[str, List[str]]] = None,
+                           asns: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    使用Shodan API获取JetBrains激活服务器列表
+
+    Args:
+        max_pages: 最多获取的页数，用于限制查询额度消耗
+        cache_ttl: 本地缓存有效期（秒），为 0 时不使用缓存
+        offline: 离线模式，只从本地缓存读取，不访问 Shodan API
+        api: 自定义的 Shodan 客户端，默认使用 SHODAN_API_KEY 创建
+        queries: 搜索语句列表，默认只使用 SHODAN_QUERY
+        sources: 提供时记录每个服务器由哪些语句找到
+        asns: 提供时记录每个服务器 IP 的 ASN
+
+    Returns:
+        List[str]: 去重后的服务器URL列表；中途出错时返回已获取的部分
+    """
+    servers = []
+    try:
+        for page_servers in iter_activation_servers(max_pages, cache_ttl, offline, api, queries, sources, asns):
+            servers.extend(page_servers)
+    except Exception as e:
+        print(f"获取服务器时出错: {str(e)}")
+
+    print(f"处理后的服务器数量: {len(servers)}")
+    return servers
+
+def _format_latency(seconds: Optional[float]) -> str:
+    """
+    将耗时格式化为毫秒字符串
+    """
+    if seconds is None:
+        return ''
+    return f"{seconds * 1000:.0f} ms"
+
+def _format_uptime(uptime: Optional[Dict[str, Optional[float]]]) -> str:
+    """
+    将各时间窗口的在线率格式化为 "24h 100%  7d 98%  30d 97%"，没有数据的窗口显示为 -
+
+    只显示整数百分比，与内容哈希使用的精度一致，文件中不会留下过时的小数位。
+    """
+    if not uptime:
+        return ''
+    return '  '.join(f"{name} {'-' if uptime.get(name) is None else f'{round(uptime[name] * 100)}%'}"
+                     for name, _, _ in UPTIME_WINDOWS)
+
+def sort_servers(servers: List[str], latencies: Optional[Dict[str, float]] = None,
+                 uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+                 sort: str = DEFAULT_SORT) -> List[str]:
+    """
+    按 sort 排列服务器: latency 为延迟从低到高，uptime-24h/uptime-7d/uptime-30d 为对应窗口的在线率从高到低，
+    没有数据的排在最后，在线率相同时按延迟排序，延迟也相同时按URL排序
+    """
+    latencies = latencies or {}
+    uptime = uptime or {}
+
+    def latency_key(url):
+        latency = latencies.get(url)
+        return latency is None, latency or 0.0, url
+
+    if sort == 'latency':
+        return sorted(servers, key=latency_key)
+    window = sort[len('uptime-'):]
+
+    def uptime_key(url):
+        value = uptime.get(url, {}).get(window)
+        return (value is None, -(value or 0.0)) + latency_key(url)
+
+    return sorted(servers, key=uptime_key)
+
+@lru_cache(maxsize=None)
+def _load_template(name: str) -> string.Template:
+    """
+    读取并缓存页面模板，整个进程内只解析一次
+    """
+    with open(os.path.join(TEMPLATES_DIR, name), encoding='utf-8') as f:
+        return string.Template(f.read())
+
+@lru_cache(maxsize=None)
+def _read_static(name: str) -> bytes:
+    """
+    读取并缓存 static 目录下的资源文件
+    """
+    with open(os.path.join(STATIC_DIR, name), 'rb') as f:
+        return f.read()
+
+@lru_cache(maxsize=None)
+def _asset_name(name: str) -> str:
+    """
+    静态资源带内容哈希的文件名，如 style.1a2b3c4d5e.css
+    """
+    stem, ext = os.path.splitext(name)
+    digest = hashlib.sha256(_read_static(name)).hexdigest()[:ASSET_HASH_LENGTH]
+    return f"{stem}.{digest}{ext}"
+
+def _publish_asset(name: str) -> str:
+    """
+    把静态资源以内容哈希命名发布到 assets 目录，并清理同名旧版本
+
+    文件名随内容变化，浏览器和 CDN 可以长期缓存，资源改动后页面引用自动更新。
+
+    Args:
+        name: static 目录下的文件名，如 style.css
+
+    Returns:
+        str: 页面中引用的相对路径，如 assets/style.1a2b3c4d.css
+    """
+    content = _read_static(name)
+    stem, ext = os.path.splitext(name)
+    hashed_name = _asset_name(name)
+    os.makedirs(ASSETS_DIR, exist_ok=True)
+    target = os.path.join(ASSETS_DIR, hashed_name)
+    if not os.path.exists(target):
+        _write_atomic(target, content)
+    for stale in os.listdir(ASSETS_DIR):
+        if stale != hashed_name and stale.startswith(f"{stem}.") and stale.endswith(ext):
+            os.remove(os.path.join(ASSETS_DIR, stale))
+    return f"{ASSETS_DIR}/{hashed_name}"
+
+def _server_data_json(valid_servers: List[str], invalid_servers: List[str],
+                      latencies: Dict[str, float],
+                      uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+                      sort: str = DEFAULT_SORT) -> str:
+    """
+    把服务器列表序列化为嵌入页面的紧凑 JSON，由页面脚本按可见区域渲染和重新排序
+
+    每个服务器为 [URL, 延迟毫秒, 在线率] 数组，在线率按 windows 的顺序以整数百分比表示，没有历史时为 null。
+    '<' 转义为 \\u003c，服务器数据中出现 </script> 也不会提前结束脚本块。
+    """
+    uptime = uptime or {}
+
+    def percentages(server):
+        if server not in uptime:
+            return None
+        return [None if uptime[server].get(name) is None else round(uptime[server][name] * 100)
+                for name, _, _ in UPTIME_WINDOWS]
+
+    data = {
+        'sort': sort,
+        'windows': [name for name, _, _ in UPTIME_WINDOWS],
+        'valid': [[server, None if latencies.get(server) is None else round(latencies[server] * 1000),
+                   percentages(server)] for server in valid_servers],
+        'invalid': [[server, None, percentages(server)] for server in invalid_servers],
+    }
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).replace('<', '\\u003c')
+
+def content_hash(valid_servers: List[str], invalid_servers: List[str], *extra: str) -> str:
+    """
+    计算服务器集合的内容哈希，只与有效/无效服务器的成员有关，与顺序、延迟和更新时间无关
+
+    Args:
+        valid_servers: 有效服务器列表
+        invalid_servers: 无效服务器列表
+        extra: 其他影响输出的内容，如页面模板和静态资源的版本
+
+    Returns:
+        str: 十六进制 SHA-256 摘要
+    """
+    digest = hashlib.sha256()
+    for section in (sorted(valid_servers), sorted(invalid_servers), extra):
+        digest.update('\n'.join(section).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def _embedded_hash(path: str) -> Optional[str]:
+    """
+    读取已生成文件中嵌入的内容哈希，文件不存在或没有哈希时返回 None
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            head = f.read(CONTENT_HASH_SCAN_BYTES)
+    except OSError:
+        return None
+    match = CONTENT_HASH_PATTERN.search(head)
+    return match.group(1) if match else None
+
+def _sort_hash_parts(sort: str) -> Tuple[str, ...]:
+    """
+    非默认的排序方式参与内容哈希，切换排序方式后会重新生成文件；默认排序不改变已有文件的哈希
+    """
+    return () if sort == DEFAULT_SORT else (sort,)
+
+def _uptime_hash_parts(servers: List[str],
+                       uptime: Optional[Dict[str, Dict[str, Optional[float]]]]) -> Tuple[str, ...]:
+    """
+    在线率按整数百分比参与内容哈希，显示的在线率变化超过 1% 时重新生成文件；没有在线率历史时不改变哈希
+    """
+    if not uptime:
+        return ()
+    lines = []
+    for server in sorted(servers):
+        if server in uptime:
+            values = ','.join('-' if uptime[server].get(name) is None else str(round(uptime[server][name] * 100))
+                              for name, _, _ in UPTIME_WINDOWS)
+            lines.append(f"{server} {values}")
+    return ('\n'.join(lines),)
+
+def html_content_hash(valid_servers: List[str], invalid_servers: List[str], sort: str = DEFAULT_SORT,
+                      uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None) -> str:
+    """
+    页面的内容哈希: 服务器集合、排序方式和在线率，加上模板和静态资源的版本
+    """
+    return content_hash(valid_servers, invalid_servers, _load_template('index.html').template,
+                        _asset_name('style.css'), _asset_name('app.js'), *_sort_hash_parts(sort),
+                        *_uptime_hash_parts(list(valid_servers) + list(invalid_servers), uptime))
+
+def text_content_hash(servers: List[str], sort: str = DEFAULT_SORT,
+                      uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None) -> str:
+    """
+    文本列表的内容哈希: 只取决于有效服务器集合、排序方式和有效服务器的在线率
+    """
+    return content_hash(servers, [], *_sort_hash_parts(sort), *_uptime_hash_parts(servers, uptime))
+
+def render_html(valid_servers: List[str], invalid_servers: List[str],
+                latencies: Optional[Dict[str, float]] = None, updated_at: Optional[float] = None,
+                uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None, sort: str = DEFAULT_SORT) -> str:
+    """
+    把服务器列表填入页面模板，返回完整的 HTML，不写文件；updated_at 为页面显示的更新时间，默认为当前时间
+    """
+    latencies = latencies or {}
+    return _load_template('index.html').substitute(
+        content_hash=html_content_hash(valid_servers, invalid_servers, sort, uptime),
+        stylesheet=f"{ASSETS_DIR}/{_asset_name('style.css')}",
+        script=f"{ASSETS_DIR}/{_asset_name('app.js')}",
+        update_time=get_beijing_time(updated_at),
+        total_servers=len(valid_servers) + len(invalid_servers),
+        valid_count=len(valid_servers),
+        invalid_count=len(invalid_servers),
+        server_data=_server_data_json(valid_servers, invalid_servers, latencies, uptime, sort),
+    )
+
+def generate_html(valid_servers: List[str], invalid_servers: List[str],
+                  latencies: Optional[Dict[str, float]] = None, updated_at: Optional[float] = None,
+                  uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None, sort: str = DEFAULT_SORT) -> bool:
+    """
+    生成美化后的Apple风格HTML页面展示服务器列表和统计信息
+
+    页面骨架来自 templates/index.html，样式和脚本以内容哈希命名发布到 assets 目录，
+    服务器列表以紧凑 JSON 嵌入页面，由脚本只渲染可见区域内的行，上万条记录也能流畅滚动，
+    并可在页面上按延迟或各时间窗口的在线率重新排序。服务器集合、排序方式、整数百分比的在线率和页面版本都没有变化时不重写文件。
+
+    Args:
+        valid_servers: 有效服务器列表（已按 sort 排序）
+        invalid_servers: 无效服务器列表
+        latencies: 服务器URL到延迟（秒）的映射，会显示在有效服务器旁
+        updated_at: 页面显示的更新时间（Unix 时间戳），默认为当前时间
+        uptime: 服务器URL到各时间窗口在线率的映射（可选），格式见 UptimeLog.uptime
+        sort: 页面初始的排序方式，取值见 SORT_LABELS
+
+    Returns:
+        bool: 是否写入了新的 index.html
+    """
+    latencies = latencies or {}
+    total_servers = len(valid_servers) + len(invalid_servers)
+    if total_servers == 0:
+        print("没有服务器数据，跳过生成HTML")
+        return False
+        
+    print(f"开始生成HTML，总服务器数量: {total_servers}")
+    
+    try:
+        _publish_asset('style.css')
+        _publish_asset('app.js')
+        if _embedded_hash(HTML_OUTPUT_FILE) == html_content_hash(valid_servers, invalid_servers, sort, uptime):
+            print("服务器列表没有变化，跳过生成HTML")
+            return False
+
+        _write_atomic(HTML_OUTPUT_FILE,
+                      render_html(valid_servers, invalid_servers, latencies, updated_at, uptime, sort))
+        print("HTML文件已生成")
+        return True
+    except Exception as e:
+        print(f"生成HTML文件时出错: {str(e)}")
+        return False
+
+def _feed_record(url: str, valid: bool, result: Optional['ProbeResult'] = None,
+                 latency: Optional[float] = None, queries: Optional[List[str]] = None) -> dict:
+    """
+    生成数据文件中单个服务器的记录
+    """
+    if result is not None and latency is None:
+        latency = result.latency if result.valid else None
+    checked_at = result.checked_at if result is not None else None
+    return {
+        'url': url,
+        'valid': valid,
+        'latency': None if latency is None else round(latency, 6),
+        'last_checked': (datetime.fromtimestamp(checked_at, timezone.utc).isoformat(timespec='seconds')
+                         if checked_at is not None else None),
+        'source': {'provider': 'shodan', 'queries': queries or []},
+    }
+
+def _write_compressed(path: str, content: bytes) -> None:
+    """
+    写入文件及其预压缩版本: .gz 总是生成，.br 只在安装了 brotli 时生成
+
+    gzip 头中的时间戳固定为 0，内容相同时压缩文件也逐字节相同。
+    """
+    _write_atomic(path, content)
+    _write_atomic(f"{path}.gz", gzip.compress(content, compresslevel=9, mtime=0))
+    if brotli is not None:
+        _write_atomic(f"{path}.br", brotli.compress(content))
+    elif os.path.exists(f"{path}.br"):
+        # 没有 brotli 时删除旧的 .br，避免和原文件内容不一致
+        os.remove(f"{path}.br")
+
+def _feed_records(servers: List[str], invalid_servers: List[str],
+                  latencies: Optional[Dict[str, float]] = None,
+                  results: Optional[List['ProbeResult']] = None,
+                  sources: Optional[Dict[str, List[str]]] = None) -> List[dict]:
+    latencies = latencies or {}
+    sources = sources or {}
+    by_url = {result.url: result for result in results or []}
+    records = [_feed_record(url, True, by_url.get(url), latencies.get(url), sources.get(url)) for url in servers]
+    records.extend(_feed_record(url, False, by_url.get(url), queries=sources.get(url)) for url in invalid_servers)
+    return records
+
+def _latency_bucket(latency: Optional[float]) -> str:
+    """
+    延迟按 2 的幂毫秒分档，档位 n 表示 [2^(n-1), 2^n) 毫秒，延迟的小幅抖动不改变档位
+    """
+    return '-' if latency is None else str(int(latency * 1000).bit_length())
+
+def feed_content_hash(records: List[dict]) -> str:
+    """
+    数据文件的内容哈希: 服务器集合、各服务器的来源和延迟档位，不包含探测时间和精确延迟
+    """
+    valid = [record['url'] for record in records if record['valid']]
+    invalid = [record['url'] for record in records if not record['valid']]
+    details = '\n'.join(sorted(f"{record['url']} {_latency_bucket(record['latency'])} "
+                               f"{','.join(record['source']['queries'])}" for record in records))
+    return content_hash(valid, invalid, details)
+
+def render_feeds(servers: List[str], invalid_servers: List[str],
+                 latencies: Optional[Dict[str, float]] = None,
+                 results: Optional[List['ProbeResult']] = None,
+                 sources: Optional[Dict[str, List[str]]] = None,
+                 updated_at: Optional[float] = None) -> Tuple[bytes, bytes]:
+    """
+    生成 JSON 文档和 NDJSON 数据流的内容，不写文件；updated_at 为文档的生成时间，默认为当前时间
+
+    Returns:
+        tuple: (JSON 文档, NDJSON 数据流)，均为 UTF-8 字节串
+    """
+    records = _feed_records(servers, invalid_servers, latencies, results, sources)
+    document = {
+        'version': FEED_VERSION,
+        'generated_at': datetime.fromtimestamp(time.time() if updated_at is None else updated_at,
+                                               timezone.utc).isoformat(timespec='seconds'),
+        'content_hash': feed_content_hash(records),
+        'total': len(records),
+        'valid': len(servers),
+        'servers': records,
+    }
+    json_body = json.dumps(document, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    ndjson = ''.join(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n' for record in records)
+    return json_body, ndjson.encode('utf-8')
+
+def write_feeds(servers: List[str], invalid_servers: List[str],
+                latencies: Optional[Dict[str, float]] = None,
+                results: Optional[List['ProbeResult']] = None,
+                sources: Optional[Dict[str, List[str]]] = None, updated_at: Optional[float] = None) -> bool:
+    """
+    生成机器可读的 JSON 文档和 NDJSON 数据流，每个服务器一条记录
+
+    JSON 文档带有格式版本号和内容哈希，NDJSON 每行一条服务器记录，便于流式处理。
+    内容哈希（见 feed_content_hash）没有变化且已有文件生成不到 FEED_MAX_AGE 时不重写文件，
+    只有探测时间和延迟小幅变化时不会产生提交。
+
+    Args:
+        servers: 有效服务器列表（已按延迟从低到高排序）
+        invalid_servers: 无效服务器列表
+        latencies: 服务器URL到延迟（秒）的映射（可选）
+        results: 探测结果列表（可选），提供时记录探测时间
+        sources: 服务器URL到找到它的搜索语句名称列表的映射（可选）
+        updated_at: 文档的生成时间（Unix 时间戳），默认为当前时间
+
+    Returns:
+        bool: 是否写入了新的数据文件
+    """
+    updated_at = time.time() if updated_at is None else updated_at
+    digest = feed_content_hash(_feed_records(servers, invalid_servers, latencies, results, sources))
+    try:
+        with open(FEED_JSON_FILE, encoding='utf-8') as f:
+            document = json.load(f)
+        age = updated_at - _parse_iso_time(document.get('generated_at'))
+        if document.get('content_hash') == digest and age < FEED_MAX_AGE and os.path.exists(FEED_NDJSON_FILE):
+            print("服务器列表没有变化，跳过生成数据文件")
+            return False
+    except (OSError, ValueError, AttributeError, TypeError):
+        pass
+
+    json_body, ndjson_body = render_feeds(servers, invalid_servers, latencies, results, sources, updated_at)
+    _write_compressed(FEED_JSON_FILE, json_body)
+    _write_compressed(FEED_NDJSON_FILE, ndjson_body)
+    print(f"数据文件已生成: {FEED_JSON_FILE}, {FEED_NDJSON_FILE}")
+    return True
+
+def render_servers_text(servers: List[str], latencies: Optional[Dict[str, float]] = None,
+                        updated_at: Optional[float] = None,
+                        uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+                        sort: str = DEFAULT_SORT) -> str:
+    """
+    生成文本格式的服务器列表，每行一个有效服务器，延迟和在线率以注释形式写在后面
+
+    文本只列出有效服务器，内容哈希只取决于有效服务器集合、排序方式和在线率（整数百分比），无效服务器的变化不影响它。
+    """
+    latencies = latencies or {}
+    uptime = uptime or {}
+    lines = [
+        "# JetBrains激活服务器列表",
+        f"# 更新时间: {get_beijing_time(updated_at)}",
+        f"# 按{SORT_LABELS[sort]}排序",
+        f"# 内容哈希: {text_content_hash(servers, sort, uptime)}",
+        "",
+    ]
+    for server in servers:
+        comment = '  '.join(part for part in (_format_latency(latencies.get(server)),
+                                              _format_uptime(uptime.get(server))) if part)
+        lines.append(f"{server}  # {comment}" if comment else server)
+    return '\n'.join(lines) + '\n'
+
+def update_servers_file(servers: List[str], invalid_servers: List[str] = None,
+                        latencies: Optional[Dict[str, float]] = None,
+                        metrics: Optional[RunMetrics] = None,
+                        results: Optional[List['ProbeResult']] = None,
+                        sources: Optional[Dict[str, List[str]]] = None,
+                        updated_at: Optional[float] = None,
+                        uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+                        sort: str = DEFAULT_SORT) -> None:
+    """
+    更新服务器列表文件
+
+    文件头中嵌入服务器集合的内容哈希，集合没有变化时不重写文件，
+    避免只有更新时间或延迟不同的提交和页面重新部署。
+
+    Args:
+        servers: 有效服务器列表（已按 sort 排序）
+        invalid_servers: 无效服务器列表（可选）
+        latencies: 服务器URL到延迟（秒）的映射（可选），以注释形式写在服务器后面
+        metrics: 运行指标（可选），记录写文件和生成 HTML 的耗时
+        results: 探测结果列表（可选），用于在数据文件中记录探测时间
+        sources: 服务器URL到找到它的搜索语句名称列表的映射（可选），写入数据文件
+        updated_at: 本次运行的时间戳（可选），所有输出文件显示同一个更新时间，默认为当前时间
+        uptime: 服务器URL到各时间窗口在线率的映射（可选），显示在文本列表和页面中
+        sort: 有效服务器的排序方式，取值见 SORT_LABELS
+    """
+    invalid_servers = invalid_servers or []
+    latencies = latencies or {}
+    metrics = metrics or RunMetrics()
+    updated_at = time.time() if updated_at is None else updated_at
+    try:
+        with metrics.phase('write_files'):
+            content = render_servers_text(servers, latencies, updated_at, uptime, sort)
+            if _embedded_hash(OUTPUT_FILE) == text_content_hash(servers, sort, uptime):
+                print(f"服务器列表没有变化，跳过写入 {OUTPUT_FILE}")
+            else:
+                _write_atomic(OUTPUT_FILE, content)
+                print(f"成功更新服务器列表，共{len(servers)}个有效服务器")
+            write_feeds(servers, invalid_servers, latencies, results, sources, updated_at)
+        
+        # 生成HTML文件
+        with metrics.phase('render_html'):
+            generate_html(servers, invalid_servers, latencies, updated_at, uptime, sort)
+        
+        # 显示文件内容
+        print("\n=== 服务器列表内容 ===")
+        print(content)
+        print("=====================")
+    except Exception as e:
+        print(f"写入文件时出错: {str(e)}")
+
+@dataclass
+class _LiveResource:
+    """
+    预先序列化好的响应，内容变化前一直复用
+    """
+    body: bytes
+    gzip_body: bytes
+    content_type: str
+    etag: str
+    last_modified: float
+    # 内容版本，版本相同时沿用旧的响应和 ETag
+    version: str
+    cache_control: str = 'no-cache'
+
+def _make_resource(body: bytes, content_type: str, version: str, previous: Optional[_LiveResource] = None,
+                   cache_control: str = 'no-cache') -> _LiveResource:
+    if previous is not None and previous.version == version:
+        return previous
+    return _LiveResource(
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=6, mtime=0),
+        content_type=content_type,
+        etag=f'"{hashlib.sha256(body).hexdigest()[:20]}"',
+        # Last-Modified 只精确到秒，条件请求按同样的精度比较
+        last_modified=float(int(time.time())),
+        version=version,
+        cache_control=cache_control,
+    )
+
+class LiveState:
+    """
+    内置 HTTP 服务使用的内存状态，保存各路径预先序列化好的响应
+
+    publish 在服务器集合变化时整体替换响应表，请求线程只读取替换后的引用，不需要加锁。
+    """
+
+    def __init__(self):
+        self.resources = {}
+
+    def publish(self, servers: List[str], invalid_servers: List[str],
+                latencies: Optional[Dict[str, float]] = None,
+                results: Optional[List['ProbeResult']] = None,
+                sources: Optional[Dict[str, List[str]]] = None, updated_at: Optional[float] = None,
+                uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None, sort: str = DEFAULT_SORT) -> None:
+        """
+        重新生成文本、JSON 和 HTML 响应，内容版本没有变化的路径保留原来的 ETag 和修改时间
+        """
+        old = self.resources
+        updated_at = time.time() if updated_at is None else updated_at
+        json_body, ndjson_body = render_feeds(servers, invalid_servers, latencies, results, sources, updated_at)
+        # 数据文件中的探测时间和延迟每次都可能变化，按实际内容计算版本
+        json_version = hashlib.sha256(json_body).hexdigest()
+        ndjson_version = hashlib.sha256(ndjson_body).hexdigest()
+        html_resource = _make_resource(
+            render_html(servers, invalid_servers, latencies, updated_at, uptime, sort).encode('utf-8'),
+            'text/html; charset=utf-8', html_content_hash(servers, invalid_servers, sort, uptime),
+            old.get('/index.html'))
+        resources = {
+            '/': html_resource,
+            '/index.html': html_resource,
+            f'/{OUTPUT_FILE}': _make_resource(
+                render_servers_text(servers, latencies, updated_at, uptime, sort).encode('utf-8'),
+                'text/plain; charset=utf-8', text_content_hash(servers, sort, uptime), old.get(f'/{OUTPUT_FILE}')),
+            f'/{FEED_JSON_FILE}': _make_resource(
+                json_body, 'application/json', json_version, old.get(f'/{FEED_JSON_FILE}')),
+            f'/{FEED_NDJSON_FILE}': _make_resource(
+                ndjson_body, 'application/x-ndjson', ndjson_version, old.get(f'/{FEED_NDJSON_FILE}')),
+        }
+        # 静态资源文件名带内容哈希，可以永久缓存
+        for name in ('style.css', 'app.js'):
+            path = f'/{ASSETS_DIR}/{_asset_name(name)}'
+            content_type = 'text/css; charset=utf-8' if name.endswith('.css') else 'text/javascript; charset=utf-8'
+            resources[path] = _make_resource(_read_static(name), content_type, path, old.get(path),
+                                             cache_control='public, max-age=31536000, immutable')
+        self.resources = resources
+
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """
+    按 Accept-Encoding 中的 q 值判断客户端是否接受 gzip: 显式列出的 gzip 优先，其次是 *，q=0 表示不接受
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    for coding in ('gzip', 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+class _LiveRequestHandler(BaseHTTPRequestHandler):
+    """
+    从 LiveState 读取响应，支持 If-None-Match / If-Modified-Since 条件请求和 gzip
+    """
+    server_version = 'JetBrainsServersUpdater'
+    # 由 start_http_server 设置
+    state: LiveState = None
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def _respond(self, send_body: bool) -> None:
+        resources = self.state.resources
+        if not resources:
+            self.send_response(503)
+            self.send_header('Retry-After', '5')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        resource = resources.get(urlsplit(self.path).path)
+        if resource is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        use_gzip = _accepts_gzip(self.headers.get('Accept-Encoding', ''))
+        # 压缩和未压缩的表示使用不同的 ETag
+        etag = f'{resource.etag[:-1]}-gzip"' if use_gzip else resource.etag
+        if self._not_modified(etag, resource.last_modified):
+            self.send_response(304)
+            self._send_validators(resource, etag)
+            self.end_headers()
+            return
+
+        body = resource.gzip_body if use_gzip else resource.body
+        self.send_response(200)
+        self.send_header('Content-Type', resource.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self._send_validators(resource, etag)
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_validators(self, resource: _LiveResource, etag: str) -> None:
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(resource.last_modified, usegmt=True))
+        self.send_header('Cache-Control', resource.cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+
+    def _not_modified(self, etag: str, last_modified: float) -> bool:
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            # 有 If-None-Match 时忽略 If-Modified-Since
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def log_message(self, format, *args):
+        # 轮询请求很多，不逐条打印访问日志
+        pass
+
+def start_http_server(host: str, port: int, state: LiveState) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动内置 HTTP 服务
+
+    Args:
+        host: 监听地址
+        port: 监听端口，0 表示随机端口
+        state: 提供响应内容的内存状态
+
+    Returns:
+        ThreadingHTTPServer: 已启动的服务，退出时调用 shutdown() 停止
+    """
+    handler = type('LiveRequestHandler', (_LiveRequestHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='http-server', daemon=True).start()
+    return server
+
+@lru_cache(maxsize=None)
+def _requests():
+    """
+    导入 requests，第一次探测时才调用
+    """
+    import requests
+    from urllib3.exceptions import InsecureRequestWarning
+
+    # 探测时不校验证书，关闭每个 HTTPS 请求都会打印的警告
+    requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+    return requests
+
+@lru_cache(maxsize=None)
+def _probe_session_class():
+    """
+    探测专用会话类，继承自 requests.Session，随 requests 一起延迟创建
+    """
+    class _ProbeSession(_requests().Session):
+        """
+        探测专用会话，重定向由 test_server 手动跟随
+        """
+        def resolve_redirects(self, resp, req, **kwargs):
+            # 即使 allow_redirects=False，requests 也会为计算 response.next
+            # 读取完整的重定向响应体，慢速或无限长的响应体会卡住工作线程
+            return iter(())
+
+    return _ProbeSession
+
+def create_probe_session(pool_size=DEFAULT_CONCURRENCY):
+    """
+    创建整个运行期间复用的探测会话
+
+    Args:
+        pool_size (int): 连接池大小，通常与并发数一致
+
+    Returns:
+        requests.Session: 带连接池的会话
+    """
+    _requests()
+    from requests.adapters import HTTPAdapter
+
+    session = _probe_session_class()()
+    # 不做自动重试，失败即判定无效
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+@dataclass
+class ProbeResult:
+    """
+    单个服务器的探测结果，耗时单位均为秒
+    """
+    url: str
+    valid: bool
+    # TCP 建连耗时
+    connect_time: Optional[float] = None
+    # 首字节耗时: 从发出第一个请求到收到响应头（含建连）
+    ttfb: Optional[float] = None
+    # 整个探测过程的耗时
+    total_time: Optional[float] = None
+    error: Optional[str] = None
+    # 失败原因分类，取值见 ERROR_CLASSES
+    error_class: Optional[str] = None
+    # 探测完成时的 Unix 时间戳
+    checked_at: Optional[float] = None
+
+    @property
+    def timed_out(self) -> bool:
+        return self.error_class == 'timeout'
+
+    @property
+    def latency(self) -> Optional[float]:
+        """
+        用于排序和展示的延迟，优先使用首字节耗时
+        """
+        return self.ttfb if self.ttfb is not None else self.total_time
+
+def _classify_error(exc: BaseException) -> str:
+    """
+    沿异常链判断探测失败的原因分类
+    """
+    # requests 还没有导入时（如使用其他探测后端）不可能出现它的异常，不为此导入它
+    requests = sys.modules.get('requests')
+    request_timeouts = (requests.Timeout,) if requests is not None else ()
+    request_ssl_errors = (requests.exceptions.SSLError,) if requests is not None else ()
+    seen = set()
+    pending = [exc]
+    while pending:
+        e = pending.pop()
+        if e is None or id(e) in seen:
+            continue
+        seen.add(id(e))
+        if isinstance(e, (asyncio.TimeoutError, socket.timeout) + request_timeouts):
+            return 'timeout'
+        if isinstance(e, ConnectionRefusedError):
+            return 'refused'
+        if isinstance(e, ConnectionResetError):
+            return 'reset'
+        if isinstance(e, (ssl.SSLError,) + request_ssl_errors):
+            return 'tls'
+        if isinstance(e, socket.gaierror):
+            return 'dns'
+        # requests 和 urllib3 把底层异常放在 args 或 reason 中
+        pending.extend([e.__cause__, e.__context__, getattr(e, 'reason', None)])
+        pending.extend(arg for arg in e.args if isinstance(arg, BaseException))
+    return 'other'
+
+def _measure_connect(url: str, timeout: float) -> float:
+    """
+    测量到服务器的 TCP 建连耗时，连接失败时抛出 OSError
+    """
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    start = time.perf_counter()
+    with socket.create_connection((parts.hostname, port), timeout=timeout):
+        return time.perf_counter() - start
+
+def _next_hop(result: 'ProbeResult', url: str, status: int, location: Optional[str]) -> Optional[str]:
+    """
+    根据一次响应判定探测结果: 状态码为 200 或重定向到 JetBrains 授权地址即有效，
+    其他重定向返回下一跳的URL继续跟随，其余情况判定无效；不再跟随时返回 None
+    """
+    if status == 200:
+        result.valid = True
+        return None
+    if not (status in REDIRECT_STATUSES and location):
+        result.error = f"HTTP {status}"
+        result.error_class = 'http_status'
+        return None
+    url = urljoin(url, location)
+    if url.startswith(FLS_AUTH_URL):
+        result.valid = True
+        return None
+    return url
+
+def _send_probe_request(session, url: str, method: str, timeouts: Tuple[float, float]):
+    """
+    用 requests 会话发出一次不跟随重定向的探测请求，返回已关闭的响应
+    """
+    # 服务器按 IP 访问，证书的主机名不可能匹配；这里只判断激活服务是否在应答，不校验证书。
+    # verify 必须逐个请求传入，会话上的设置会被 REQUESTS_CA_BUNDLE 等环境变量覆盖
+    if method == 'head':
+        response = session.head(url, timeout=timeouts, allow_redirects=False, verify=False)
+    else:
+        response = session.get(url, timeout=timeouts, allow_redirects=False, stream=True, verify=False)
+    # 响应体一个字节都不读取：关闭未读完的流式响应会直接断开该连接，
+    # 超大或无限长的响应体不会占用带宽和工作线程
+    response.close()
+    return response
+
+def probe_server(server_url, session=None, method=DEFAULT_PROBE_METHOD,
+                 timeouts: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                 connect_time: Optional[float] = None) -> ProbeResult:
+    """
+    探测服务器并记录建连、首字节和总耗时
+
+    先单独测量 TCP 建连（已由预筛阶段测得时跳过），连不上的服务器直接判定无效，不再发起 HTTP 请求。
+    HTTP 阶段只读取状态行和响应头：状态码为 200，或重定向到 JetBrains 授权地址
+    即判定有效。其他重定向会手动跟随（最多 PROBE_MAX_REDIRECTS 次），响应体一律不下载。
+
+    Args:
+        server_url (str): 要测试的服务器URL
+        session (requests.Session): 复用的探测会话，为空时临时创建
+        method (str): 探测方式，'get' 或 'head'
+        timeouts (tuple): (建连超时, 读取超时)，单位秒
+        connect_time (float): 预筛阶段测得的建连耗时
+
+    Returns:
+        ProbeResult: 探测结果
+    """
+    result = ProbeResult(url=server_url, valid=False, connect_time=connect_time)
+
+    # 确保URL格式正确
+    if not server_url.startswith(('http://', 'https://')):
+        server_url = f'http://{server_url}'
+
+    start = time.perf_counter()
+    own_session = session is None
+    if own_session:
+        session = create_probe_session(pool_size=1)
+
+    connect_timeout, read_timeout = timeouts
+    # 整个重定向链的截止时间，防止逐跳拖延长期占用线程
+    deadline = time.monotonic() + connect_timeout + read_timeout * 2
+    url = server_url
+    try:
+        if result.connect_time is None:
+            result.connect_time = _measure_connect(server_url, connect_timeout)
+
+        for _ in range(PROBE_MAX_REDIRECTS + 1):
+            with profile_span('http_request', url=url, method=method):
+                response = _send_probe_request(session, url, method, timeouts)
+            if result.ttfb is None:
+                result.ttfb = response.elapsed.total_seconds()
+
+            url = _next_hop(result, url, response.status_code, response.headers.get('Location'))
+            if url is None:
+                break
+            if time.monotonic() > deadline:
+                result.error = "重定向超时"
+                result.error_class = 'redirect'
+                break
+        else:
+            result.error = "重定向次数过多"
+            result.error_class = 'redirect'
+    except Exception as e:
+        result.error = str(e)
+        result.error_class = _classify_error(e)
+        print(f"测试服务器 {server_url} 时发生错误: {str(e)}")
+    finally:
+        if own_session:
+            session.close()
+
+    result.total_time = time.perf_counter() - start
+    return result
+
+def test_server(server_url, session=None, method=DEFAULT_PROBE_METHOD):
+    """
+    测试服务器连接是否有效
+    
+    Args:
+        server_url (str): 要测试的服务器URL
+        session (requests.Session): 复用的探测会话，为空时临时创建
+        method (str): 探测方式，'get' 或 'head'
+    
+    Returns:
+        bool: 如果服务器有效返回True，否则返回False
+    """
+    if not _needs_scheme_detection(server_url):
+        return probe_server(server_url, session=session, method=method).valid
+    # 无法从端口判断协议时与 ProbePipeline 一样竞速探测 HTTP 和 HTTPS，任一有效即可，不等待另一个协议超时
+    executor = ThreadPoolExecutor(max_workers=2)
+    try:
+        http_probe = executor.submit(probe_server, _with_scheme(server_url, 'http'), session=session, method=method)
+        done, _ = wait([http_probe], timeout=SCHEME_DETECT_DELAY)
+        if done and http_probe.result().valid:
+            return True
+        https_probe = executor.submit(probe_server, _with_scheme(server_url, 'https'), session=session, method=method)
+        return any(future.result().valid for future in as_completed([http_probe, https_probe]))
+    finally:
+        executor.shutdown(wait=False)
+
+def _update_rtt(srtt: Optional[float], rttvar: Optional[float],
+                sample: Optional[float]) -> Tuple[Optional[float], Optional[float]]:
+    """
+    用一次耗时样本更新平滑延迟和延迟波动（RFC 6298）
+
+    Returns:
+        tuple: (平滑延迟, 延迟波动)，没有样本时保持原值
+    """
+    if sample is None:
+        return srtt, rttvar
+    if srtt is None:
+        return sample, sample / 2
+    rttvar = (1 - RTT_BETA) * rttvar + RTT_BETA * abs(srtt - sample)
+    srtt = (1 - RTT_ALPHA) * srtt + RTT_ALPHA * sample
+    return srtt, rttvar
+
+def _clamp_timeout(srtt: Optional[float], rttvar: Optional[float], default: float) -> float:
+    """
+    根据平滑延迟和波动计算超时时间，并限制在上下限之间
+    """
+    if srtt is None:
+        return default
+    return min(PROBE_TIMEOUT_CEILING, max(PROBE_TIMEOUT_FLOOR, srtt + 4 * rttvar))
 
-def get_beijing_time():
+def adaptive_timeouts(row: Optional[sqlite3.Row]) -> Tuple[float, float]:
     """
-    获取北京时间
-    
+    根据服务器的探测历史计算 (建连超时, 读取超时)
+
+    Args:
+        row: 服务器的探测记录，首次探测的服务器为 None
+
     Returns:
-        str: 格式化的北京时间字符串
+        tuple: (建连超时, 读取超时)，单位秒
     """
-    beijing_tz = pytz.timezone('Asia/Shanghai')
-    beijing_time = datetime.now(beijing_tz)
-    return beijing_time.strftime('%Y-%m-%d %H:%M:%S')
+    if row is None:
+        return DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+    return (_clamp_timeout(row['srtt_connect'], row['rttvar_connect'], DEFAULT_CONNECT_TIMEOUT),
+            _clamp_timeout(row['srtt_ttfb'], row['rttvar_ttfb'], DEFAULT_READ_TIMEOUT))
 
-def get_activation_servers() -> List[str]:
+def quarantine_until(failures: int, checked_at: float) -> Optional[float]:
     """
-    使用Shodan API获取JetBrains激活服务器列表
+    根据连续失败次数计算隔离期的结束时间，未达到隔离阈值时返回 None
+    """
+    if failures < QUARANTINE_THRESHOLD:
+        return None
+    return checked_at + min(QUARANTINE_BASE * 2 ** (failures - QUARANTINE_THRESHOLD), QUARANTINE_MAX)
+
+# 原始记录: 探测时间、服务器编号、是否有效、延迟毫秒（无延迟为 _NO_LATENCY），共 11 字节
+_UPTIME_RAW = struct.Struct('<IIBH')
+# 汇总记录: 桶起始时间、服务器编号、探测次数、成功次数、成功探测的延迟毫秒之和，共 20 字节
+_UPTIME_ROLLUP = struct.Struct('<IIIII')
+_NO_LATENCY = 0xFFFF
+
+class UptimeLog:
+    """
+    只追加的在线率历史，文件都在 directory 下:
+
+    - servers.txt: 服务器URL，每行一个，行号即记录中的服务器编号
+    - raw.bin: 每次探测一条定长原始记录
+    - hourly.bin、daily.bin: 按小时和按天汇总的记录
+
+    汇总把原始记录中上次汇总位置之后的部分按桶累加，追加到汇总文件，同一个桶可以有多条记录，读取时相加；
+    压缩时合并同一个桶的记录，并删除超出保留期的原始和汇总记录。计算在线率只读汇总文件，不扫描原始记录。
+
+    meta.json 是汇总的检查点: 已汇总到的原始文件位置，以及此时各汇总文件的大小。汇总记录追加之后、
+    检查点保存之前中断时，打开时把汇总文件截回检查点中的大小，这批原始记录下次重新汇总，不会重复计数。
+    """
+
+    def __init__(self, directory: str = UPTIME_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'servers.txt')
+        self.raw_path = os.path.join(directory, 'raw.bin')
+        self.rollup_paths = {3600: os.path.join(directory, 'hourly.bin'),
+                             24 * 3600: os.path.join(directory, 'daily.bin')}
+        self.meta_path = os.path.join(directory, 'meta.json')
+
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            content = ''
+        if content and not content.endswith('\n'):
+            # 上次写到一半的服务器没有对应的记录，丢弃
+            content = content[:content.rfind('\n') + 1]
+            _write_atomic(self.index_path, content)
+        self.urls = content.splitlines()
+        self.ids = {url: server_id for server_id, url in enumerate(self.urls)}
+
+        try:
+            with open(self.meta_path, encoding='utf-8') as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            self.meta = {'rolled_up': 0, 'compacted_at': 0.0}
+        raw_size = self._truncate_partial(self.raw_path, _UPTIME_RAW.size)
+        # 压缩在写入 meta.json 之前中断时，新的原始文件已全部汇总过
+        self.meta['rolled_up'] = min(self.meta['rolled_up'], raw_size)
+
+        # 旧版本的检查点没有汇总文件大小，以当前大小为准
+        sizes = self.meta.get('rollup_sizes', {})
+        changed = False
+        for width, path in self.rollup_paths.items():
+            size = self._truncate_partial(path, _UPTIME_ROLLUP.size)
+            recorded = sizes.get(str(width), size)
+            if size > recorded:
+                # 汇总记录已追加但检查点没有保存，截掉这一批
+                os.truncate(path, recorded)
+                size = recorded
+            # 比检查点小说明压缩在保存检查点之前中断，压缩前已全部汇总，以当前大小为准
+            changed = changed or sizes.get(str(width)) != size
+            sizes[str(width)] = size
+        self.meta['rollup_sizes'] = sizes
+        if changed:
+            self._save_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def _truncate_partial(path: str, record_size: int) -> int:
+        """
+        去掉文件末尾写了一半的记录，返回截断后的文件大小
+        """
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+        if size % record_size:
+            size -= size % record_size
+            os.truncate(path, size)
+        return size
+
+    def _save_meta(self) -> None:
+        _write_atomic(self.meta_path, json.dumps(self.meta))
+
+    def append(self, results: List['ProbeResult'], checked_at: float) -> None:
+        """
+        追加探测结果，新出现的服务器先写入服务器列表再写记录
+
+        Args:
+            results: 探测结果列表
+            checked_at: 探测时间戳
+        """
+        new_urls = [url for url in dict.fromkeys(r.url for r in results) if url not in self.ids]
+        if new_urls:
+            with open(self.index_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(f"{url}\n" for url in new_urls))
+            for url in new_urls:
+                self.ids[url] = len(self.urls)
+                self.urls.append(url)
+        records = []
+        for r in results:
+            latency = r.latency if r.valid else None
+            latency_ms = _NO_LATENCY if latency is None else min(round(latency * 1000), _NO_LATENCY - 1)
+            records.append(_UPTIME_RAW.pack(int(checked_at), self.ids[r.url], int(r.valid), latency_ms))
+        with open(self.raw_path, 'ab') as f:
+            f.write(b''.join(records))
+
+    def rollup(self) -> int:
+        """
+        把上次汇总之后的原始记录累加到按小时和按天的汇总文件
+
+        Returns:
+            int: 本次汇总的原始记录数
+        """
+        try:
+            with open(self.raw_path, 'rb') as f:
+                f.seek(self.meta['rolled_up'])
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        data = data[:len(data) - len(data) % _UPTIME_RAW.size]
+        if not data:
+            return 0
+        buckets = {width: {} for width in self.rollup_paths}
+        for checked_at, server_id, valid, latency_ms in _UPTIME_RAW.iter_unpack(data):
+            for width, totals in buckets.items():
+                counts = totals.setdefault((checked_at - checked_at % width, server_id), [0, 0, 0])
+                counts[0] += 1
+                if valid:
+                    counts[1] += 1
+                    if latency_ms != _NO_LATENCY:
+                        counts[2] += latency_ms
+        for width, totals in buckets.items():
+            with open(self.rollup_paths[width], 'ab') as f:
+                f.write(b''.join(_UPTIME_ROLLUP.pack(*key, *totals[key]) for key in sorted(totals)))
+                self.meta['rollup_sizes'][str(width)] = f.tell()
+        self.meta['rolled_up'] += len(data)
+        self._save_meta()
+        return len(data) // _UPTIME_RAW.size
+
+    def _read_rollup(self, width: int, since: float) -> Iterator[Tuple[int, int, int, int, int]]:
+        """
+        读取桶起始时间不早于 since 的汇总记录
+        """
+        try:
+            with open(self.rollup_paths[width], 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        data = data[:len(data) - len(data) % _UPTIME_ROLLUP.size]
+        for record in _UPTIME_ROLLUP.iter_unpack(data):
+            if record[0] >= since:
+                yield record
+
+    def compact(self, now: Optional[float] = None) -> None:
+        """
+        合并汇总文件中同一个桶的记录，删除超出保留期的原始和汇总记录
+        """
+        now = time.time() if now is None else now
+        self.rollup()
+        sizes = {}
+        for width, retention in ((3600, UPTIME_HOURLY_RETENTION), (24 * 3600, UPTIME_DAILY_RETENTION)):
+            merged = {}
+            for bucket, server_id, probes, up, latency_ms in self._read_rollup(width, now - retention):
+                counts = merged.setdefault((bucket, server_id), [0, 0, 0])
+                counts[0] += probes
+                counts[1] += up
+                counts[2] += latency_ms
+            _write_atomic(self.rollup_paths[width],
+                          b''.join(_UPTIME_ROLLUP.pack(*key, *merged[key]) for key in sorted(merged)))
+            sizes[str(width)] = len(merged) * _UPTIME_ROLLUP.size
+
+        try:
+            with open(self.raw_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        data = data[:len(data) - len(data) % _UPTIME_RAW.size]
+        # 原始记录按写入顺序大致按时间排列，保留第一条未过期记录及之后的部分
+        cutoff = now - UPTIME_RAW_RETENTION
+        keep_from = len(data)
+        for index, record in enumerate(_UPTIME_RAW.iter_unpack(data)):
+            if record[0] >= cutoff:
+                keep_from = index * _UPTIME_RAW.size
+                break
+        data = data[keep_from:]
+        _write_atomic(self.raw_path, data)
+        self.meta = {'rolled_up': len(data), 'compacted_at': now, 'rollup_sizes': sizes}
+        self._save_meta()
+
+    def flush(self, now: Optional[float] = None) -> None:
+        """
+        汇总新的原始记录，距上次压缩超过 UPTIME_COMPACT_INTERVAL 时顺便压缩
+        """
+        now = time.time() if now is None else now
+        if now - self.meta.get('compacted_at', 0.0) >= UPTIME_COMPACT_INTERVAL:
+            self.compact(now)
+        else:
+            self.rollup()
+
+    def uptime(self, urls: Optional[List[str]] = None,
+               now: Optional[float] = None) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        根据汇总记录计算各时间窗口的在线率（成功次数 / 探测次数）
+
+        24 小时窗口由最近 24 个小时桶组成，7 天和 30 天窗口由最近的自然日（UTC）组成，都包含当前未结束的桶。
+
+        Args:
+            urls: 只返回这些服务器，默认为所有有记录的服务器
+            now: 计算窗口的参考时间，默认为当前时间
+
+        Returns:
+            Dict[str, Dict[str, Optional[float]]]: 服务器URL到 {窗口名称: 0~1 的在线率} 的映射，
+                窗口内没有探测记录时为 None
+        """
+        now = time.time() if now is None else now
+        self.flush(now)
+        totals = {}
+        for width in self.rollup_paths:
+            windows = [(name, now - now % width - (count - 1) * width)
+                       for name, window_width, count in UPTIME_WINDOWS if window_width == width]
+            if not windows:
+                continue
+            for bucket, server_id, probes, up, _ in self._read_rollup(width, min(start for _, start in windows)):
+                for name, start in windows:
+                    if bucket >= start:
+                        counts = totals.setdefault(server_id, {}).setdefault(name, [0, 0])
+                        counts[0] += probes
+                        counts[1] += up
+        wanted = None if urls is None else set(urls)
+        result = {}
+        for server_id, windows in totals.items():
+            if server_id >= len(self.urls) or (wanted is not None and self.urls[server_id] not in wanted):
+                continue
+            result[self.urls[server_id]] = {
+                name: windows[name][1] / windows[name][0] if windows.get(name, [0])[0] else None
+                for name, _, _ in UPTIME_WINDOWS
+            }
+        return result
+
+    def close(self) -> None:
+        self.flush()
+
+def load_uptime(urls: List[str], directory: str = UPTIME_DIR) -> Dict[str, Dict[str, Optional[float]]]:
+    """
+    读取服务器的在线率，还没有在线率历史时返回空字典，格式见 UptimeLog.uptime
+    """
+    if not os.path.isdir(directory):
+        return {}
+    with UptimeLog(directory) as log:
+        return log.uptime(urls)
+
+class ProbeHistory:
+    """
+    持久化的探测历史，记录每个服务器最近一次探测的时间、结果和耗时；
+    每次的结果同时追加到 uptime_dir 下的在线率历史，uptime_dir 为 None 时不记录
+    """
+
+    def __init__(self, path: str = PROBE_HISTORY_DB, uptime_dir: Optional[str] = UPTIME_DIR):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.uptime_log = UptimeLog(uptime_dir) if uptime_dir else None
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS probes (
+                url TEXT PRIMARY KEY,
+                last_checked REAL NOT NULL,
+                valid INTEGER NOT NULL,
+                latency REAL
+            )
+        """)
+        # 旧版本数据库没有分阶段耗时和延迟估计字段，按需补齐
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(probes)")}
+        for column in ('connect_time', 'ttfb', 'srtt_connect', 'rttvar_connect', 'srtt_ttfb', 'rttvar_ttfb',
+                       'quarantined_until'):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE probes ADD COLUMN {column} REAL")
+        if 'failures' not in columns:
+            # 连续失败次数，旧记录按最近一次的结果初始化
+            self.conn.execute("ALTER TABLE probes ADD COLUMN failures INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute("UPDATE probes SET failures = 1 WHERE valid = 0")
+        # 每个 ip:port 最近一次探测成功时使用的协议
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS schemes (
+                endpoint TEXT PRIMARY KEY,
+                scheme TEXT NOT NULL,
+                detected_at REAL NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_many(self, urls: List[str]) -> Dict[str, sqlite3.Row]:
+        """
+        批量查询服务器的最近一次探测记录
+
+        Returns:
+            Dict[str, sqlite3.Row]: URL 到探测记录的映射，没有记录的服务器不在其中
+        """
+        rows = {}
+        urls = list(urls)
+        # SQLite 对单条语句的参数数量有限制，分批查询
+        for i in range(0, len(urls), 500):
+            batch = urls[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            for row in self.conn.execute(f"SELECT * FROM probes WHERE url IN ({placeholders})", batch):
+                rows[row['url']] = row
+        return rows
+
+    def get_schemes(self, urls: List[str], max_age: float = SCHEME_CACHE_TTL) -> Dict[str, str]:
+        """
+        查询需要检测协议的服务器在缓存有效期内探测成功过的协议
+
+        Returns:
+            Dict[str, str]: 服务器URL到协议（'http' 或 'https'）的映射，没有缓存的服务器不在其中
+        """
+        endpoints = {}
+        for url in urls:
+            if _needs_scheme_detection(url):
+                _, host, port = _split_endpoint(url)
+                endpoints.setdefault(f"{host}:{port}", []).append(url)
+        schemes = {}
+        keys = list(endpoints)
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            placeholders = ','.join('?' * len(batch))
+            for row in self.conn.execute(
+                    f"SELECT endpoint, scheme FROM schemes WHERE endpoint IN ({placeholders}) AND detected_at >= ?",
+                    batch + [time.time() - max_age]):
+                for url in endpoints[row['endpoint']]:
+                    schemes[url] = row['scheme']
+        return schemes
+
+    def record_many(self, results: List[ProbeResult], checked_at: float) -> None:
+        """
+        批量写入探测结果，并用本次耗时更新每个服务器的延迟估计；
+        非 80/443 端口的有效服务器同时记录探测成功的协议。
+
+        连续失败次数达到 QUARANTINE_THRESHOLD 的服务器进入隔离期，成功一次即清零解除隔离。
+
+        Args:
+            results: 探测结果列表
+            checked_at: 探测时间戳
+        """
+        previous = self.get_many(r.url for r in results)
+        records = []
+        for r in results:
+            row = previous.get(r.url)
+            srtt_connect, rttvar_connect = _update_rtt(
+                row['srtt_connect'] if row else None, row['rttvar_connect'] if row else None, r.connect_time)
+            srtt_ttfb, rttvar_ttfb = _update_rtt(
+                row['srtt_ttfb'] if row else None, row['rttvar_ttfb'] if row else None, r.ttfb)
+            failures = 0 if r.valid else (row['failures'] if row else 0) + 1
+            records.append((r.url, checked_at, int(r.valid), r.total_time, r.connect_time, r.ttfb,
+                            srtt_connect, rttvar_connect, srtt_ttfb, rttvar_ttfb,
+                            failures, quarantine_until(failures, checked_at)))
+        schemes = []
+        for r in results:
+            scheme, host, port = _split_endpoint(r.url)
+            if r.valid and port not in (80, 443):
+                schemes.append((f"{host}:{port}", scheme, checked_at))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO probes (url, last_checked, valid, latency, connect_time, ttfb, "
+                "srtt_connect, rttvar_connect, srtt_ttfb, rttvar_ttfb, failures, quarantined_until) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO schemes (endpoint, scheme, detected_at) VALUES (?, ?, ?)", schemes)
+        if self.uptime_log is not None:
+            self.uptime_log.append(results, checked_at)
+
+    def uptime(self, urls: List[str]) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        服务器的在线率，格式见 UptimeLog.uptime，不记录在线率历史时返回空字典
+        """
+        return self.uptime_log.uptime(urls) if self.uptime_log is not None else {}
+
+    def close(self) -> None:
+        if self.uptime_log is not None:
+            self.uptime_log.close()
+        self.conn.close()
+
+async def _tcp_connect(url: str, timeout: float) -> float:
     """
+    异步测量到服务器的 TCP 建连耗时，连接失败或超时时抛出 OSError
+    """
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    start = time.perf_counter()
+    _, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port), timeout)
+    elapsed = time.perf_counter() - start
+    writer.close()
     try:
-        if not SHODAN_API_KEY:
-            raise ValueError("未设置 SHODAN_API_KEY 环境变量")
-            
-        api = shodan.Shodan(SHODAN_API_KEY)
-        
-        # 搜索查询
-        query = 'Location: https://account.jetbrains.com/fls-auth'
-        results = api.search(query)
-        
-        print(f"搜索结果: {len(results['matches'])} 个匹配项")
-        
-        servers = []
-        for result in results['matches']:
-            ip = result['ip_str']
-            port = result.get('port', 443)
-            
-            # 构建服务器URL
-            if port == 443:
-                server_url = f"https://{ip}"
-            else:
-                server_url = f"http://{ip}:{port}"
-            
-            servers.append(server_url)
-        
-        print(f"处理后的服务器数量: {len(servers)}")
-        return servers
-    
-    except Exception as e:
-        print(f"获取服务器时出错: {str(e)}")
-        return []
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return elapsed
 
-def generate_html(valid_servers: List[str], invalid_servers: List[str]) -> None:
+@dataclass
+class StageStats:
     """
-    生成美化后的Apple风格HTML页面展示服务器列表和统计信息
+    单个探测阶段的统计信息
     """
-    total_servers = len(valid_servers) + len(invalid_servers)
-    if total_servers == 0:
-        print("没有服务器数据，跳过生成HTML")
-        return
-        
-    print(f"开始生成HTML，总服务器数量: {total_servers}")
-    
-    html_content = f"""
-<!DOCTYPE html>
-<html lang="zh-CN">
-    <head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <meta name="description" content="JetBrains 激活服务器状态监控 - 实时验证和管理激活服务器">
-    <meta name="theme-color" content="#fbfbfd">
-    <title>JetBrains 激活服务器</title>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=SF+Pro+Display:wght@300;400;500;600;700&display=swap" rel="stylesheet">
-    <style>
-        :root {{
-            --primary-color: #0071e3;
-            --primary-dark: #0077ED;
-            --success-color: #30d158;
-            --error-color: #ff3b30;
-            --warning-color: #ff9500;
-            --background-color: #fbfbfd;
-            --card-background: #ffffff;
-            --text-primary: #1d1d1f;
-            --text-secondary: #86868b;
-            --border-color: #d2d2d7;
-            --border-radius: 18px;
-            --transition: all 0.4s cubic-bezier(0.28, 0.11, 0.32, 1);
-            --shadow-sm: 0 2px 10px rgba(0, 0, 0, 0.04);
-            --shadow-md: 0 4px 20px rgba(0, 0, 0, 0.08);
-            --shadow-lg: 0 8px 30px rgba(0, 0, 0, 0.12);
-        }}
-
-        * {{
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            -webkit-font-smoothing: antialiased;
-            -moz-osx-font-smoothing: grayscale;
-        }}
-
-        body {{
-            font-family: -apple-system, BlinkMacSystemFont, 'SF Pro Display', 'Segoe UI', Roboto, 'Helvetica Neue', Arial, sans-serif;
-            line-height: 1.47059;
-            letter-spacing: -0.022em;
-            background: var(--background-color);
-            color: var(--text-primary);
-            min-height: 100vh;
-            padding: 0;
-            overflow-x: hidden;
-            opacity: 0;
-            transition: opacity 0.5s ease;
-        }}
-
-        body.loaded {{
-            opacity: 1;
-        }}
-
-        .container {{
-            max-width: 980px;
-            margin: 0 auto;
-            padding: 0 22px;
-        }}
-
-        @keyframes fadeIn {{
-            from {{
-                opacity: 0;
-                transform: translateY(30px);
-            }}
-            to {{
-                opacity: 1;
-                transform: translateY(0);
-            }}
-        }}
-
-        .hero-spacer {{
-            height: 44px;
-        }}
-
-        .navbar {{
-            position: fixed;
-            top: 0;
-            left: 0;
-            right: 0;
-            height: 44px;
-            background: rgba(251, 251, 253, 0.8);
-            backdrop-filter: saturate(180%) blur(20px);
-            border-bottom: 1px solid rgba(0, 0, 0, 0.1);
-            z-index: 9999;
-            transition: var(--transition);
-        }}
-
-        .navbar.scrolled {{
-            background: rgba(251, 251, 253, 0.95);
-            box-shadow: 0 1px 3px rgba(0, 0, 0, 0.1);
-        }}
-
-        .navbar-content {{
-            max-width: 980px;
-            margin: 0 auto;
-            padding: 0 22px;
-            height: 100%;
-            display: flex;
-            align-items: center;
-            justify-content: space-between;
-        }}
-
-        .navbar-brand {{
-            font-size: 17px;
-            line-height: 1.47059;
-            font-weight: 600;
-            letter-spacing: -0.022em;
-            color: var(--text-primary);
-        }}
-
-        .navbar-links {{
-            display: flex;
-            gap: 32px;
-        }}
-
-        .navbar-links a {{
-            font-size: 14px;
-            line-height: 1.42859;
-            font-weight: 400;
-            letter-spacing: -0.016em;
-            color: var(--text-primary);
-            text-decoration: none;
-            opacity: 0.8;
-            transition: opacity 0.3s ease;
-        }}
-
-        .navbar-links a:hover {{
-            opacity: 1;
-        }}
-
-        .header {{
-            text-align: center;
-            padding: 48px 0 36px;
-            animation: fadeIn 0.8s ease-out;
-        }}
-
-        .header h1 {{
-            font-size: 48px;
-            line-height: 1.07143;
-            font-weight: 600;
-            letter-spacing: -0.005em;
-            color: var(--text-primary);
-            margin-bottom: 4px;
-        }}
-
-        .header .subtitle {{
-            font-size: 24px;
-            line-height: 1.14286;
-            font-weight: 400;
-            letter-spacing: 0.007em;
-            color: var(--text-secondary);
-            margin-top: 10px;
-            margin-bottom: 12px;
-        }}
-
-        .update-time {{
-            color: var(--text-secondary);
-            font-size: 15px;
-            line-height: 1.47059;
-            font-weight: 400;
-            letter-spacing: -0.022em;
-            margin-top: 8px;
-        }}
-
-        .stats-container {{
-            display: grid;
-            grid-template-columns: repeat(3, 1fr);
-            gap: 10px;
-            margin-bottom: 48px;
-            animation: fadeIn 0.8s ease-out 0.2s backwards;
-        }}
-
-        .stats-card {{
-            background: var(--card-background);
-            padding: 24px 16px;
-            border-radius: var(--border-radius);
-            border: 1px solid var(--border-color);
-            text-align: center;
-            transition: var(--transition);
-            position: relative;
-            overflow: hidden;
-        }}
-
-        .stats-card:hover {{
-            transform: scale(1.02);
-            box-shadow: var(--shadow-md);
-            border-color: rgba(0, 113, 227, 0.3);
-        }}
-
-        .stats-value {{
-            font-size: 48px;
-            line-height: 1.0625;
-            font-weight: 600;
-            letter-spacing: -0.009em;
-            color: var(--text-primary);
-            margin-bottom: 6px;
-        }}
-
-        .stats-card:nth-child(2) .stats-value {{
-            color: var(--success-color);
-        }}
-
-        .stats-card:nth-child(3) .stats-value {{
-            color: var(--error-color);
-        }}
-
-        .stats-label {{
-            color: var(--text-secondary);
-            font-size: 15px;
-            line-height: 1.47059;
-            font-weight: 400;
-            letter-spacing: -0.022em;
-        }}
-
-        .servers-section {{
-            margin-bottom: 40px;
-            animation: fadeIn 0.8s ease-out 0.4s backwards;
-        }}
-
-        .section-title {{
-            font-size: 32px;
-            line-height: 1.1;
-            font-weight: 600;
-            letter-spacing: 0em;
-            color: var(--text-primary);
-            margin-bottom: 20px;
-            text-align: left;
-        }}
-
-        .section-badge {{
-            display: inline-block;
-            font-size: 11px;
-            line-height: 1.33337;
-            font-weight: 600;
-            letter-spacing: -0.01em;
-            text-transform: uppercase;
-            color: var(--success-color);
-            margin-bottom: 6px;
-        }}
-
-        .servers-section:last-of-type .section-badge {{
-            color: var(--error-color);
-        }}
-
-        .server-list {{
-            list-style: none;
-            display: grid;
-            gap: 8px;
-        }}
-
-        .server-item {{
-            background: var(--card-background);
-            padding: 14px 18px;
-            border-radius: 10px;
-            border: 1px solid var(--border-color);
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            transition: var(--transition);
-            position: relative;
-        }}
-
-        .server-item:hover {{
-            box-shadow: var(--shadow-sm);
-            border-color: rgba(0, 0, 0, 0.15);
-        }}
-
-        .valid:hover {{
-            border-color: rgba(48, 209, 88, 0.4);
-        }}
-
-        .invalid:hover {{
-            border-color: rgba(255, 59, 48, 0.4);
-        }}
-
-        .server-url {{
-            font-family: 'SF Mono', 'Monaco', 'Menlo', 'Courier New', monospace;
-            font-size: 14px;
-            line-height: 1.47059;
-            font-weight: 400;
-            letter-spacing: -0.016em;
-            color: var(--text-primary);
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }}
-
-        .server-url::before {{
-            content: '';
-            width: 7px;
-            height: 7px;
-            border-radius: 50%;
-            display: inline-block;
-            flex-shrink: 0;
-        }}
-
-        .valid .server-url::before {{
-            background: var(--success-color);
-            box-shadow: 0 0 0 2px rgba(48, 209, 88, 0.2);
-        }}
-
-        .invalid .server-url::before {{
-            background: var(--error-color);
-            box-shadow: 0 0 0 2px rgba(255, 59, 48, 0.2);
-        }}
-
-        .copy-btn {{
-            background: var(--primary-color);
-            color: white;
-            border: none;
-            padding: 6px 18px;
-            border-radius: 980px;
-            cursor: pointer;
-            font-size: 14px;
-            line-height: 1.47059;
-            font-weight: 400;
-            letter-spacing: -0.022em;
-            transition: var(--transition);
-            display: inline-flex;
-            align-items: center;
-            gap: 5px;
-            white-space: nowrap;
-        }}
-
-        .copy-btn:hover {{
-            background: var(--primary-dark);
-            transform: scale(0.98);
-        }}
-
-        .copy-btn:active {{
-            transform: scale(0.96);
-        }}
-
-        .copy-btn.copied {{
-            background: var(--success-color);
-        }}
-
-        @keyframes pulse {{
-            0%, 100% {{
-                opacity: 1;
-                transform: scale(1);
-            }}
-            50% {{
-                opacity: 0.8;
-                transform: scale(0.98);
-            }}
-        }}
-
-        .server-url::before {{
-            animation: pulse 2s ease-in-out infinite;
-        }}
-
-        .footer {{
-            text-align: center;
-            padding: 40px 0 48px;
-            border-top: 1px solid var(--border-color);
-            margin-top: 48px;
-        }}
-
-        .footer p {{
-            color: var(--text-secondary);
-            font-size: 13px;
-            line-height: 1.42859;
-            font-weight: 400;
-            letter-spacing: -0.016em;
-        }}
-
-        .footer strong {{
-            color: var(--text-primary);
-            font-weight: 500;
-        }}
-
-        .progress-bar {{
-            position: fixed;
-            top: 0;
-            left: 0;
-            height: 3px;
-            background: linear-gradient(90deg, var(--primary-color), var(--success-color));
-            z-index: 10000;
-            transition: width 0.3s ease;
-            box-shadow: 0 0 10px rgba(0, 113, 227, 0.5);
-        }}
-
-        .back-to-top {{
-            position: fixed;
-            bottom: 40px;
-            right: 40px;
-            width: 48px;
-            height: 48px;
-            background: var(--card-background);
-            border: 1px solid var(--border-color);
-            border-radius: 50%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            cursor: pointer;
-            opacity: 0;
-            visibility: hidden;
-            transition: var(--transition);
-            box-shadow: var(--shadow-md);
-            z-index: 999;
-        }}
-
-        .back-to-top.show {{
-            opacity: 1;
-            visibility: visible;
-        }}
-
-        .back-to-top:hover {{
-            transform: translateY(-4px);
-            box-shadow: var(--shadow-lg);
-            border-color: var(--primary-color);
-        }}
-
-        .back-to-top::before {{
-            content: '↑';
-            font-size: 24px;
-            color: var(--text-primary);
-        }}
-
-        ::selection {{
-            background: rgba(0, 113, 227, 0.2);
-            color: var(--text-primary);
-        }}
-
-        ::-webkit-scrollbar {{
-            width: 12px;
-        }}
-
-        ::-webkit-scrollbar-track {{
-            background: var(--background-color);
-        }}
-
-        ::-webkit-scrollbar-thumb {{
-            background: rgba(0, 0, 0, 0.2);
-            border-radius: 6px;
-            border: 3px solid var(--background-color);
-        }}
-
-        ::-webkit-scrollbar-thumb:hover {{
-            background: rgba(0, 0, 0, 0.3);
-        }}
-
-        @media (max-width: 1068px) {{
-            .container {{
-                padding: 0 48px;
-            }}
-        }}
-
-        @media (max-width: 734px) {{
-            .navbar-content {{
-                padding: 0 16px;
-            }}
-
-            .navbar-links {{
-                gap: 20px;
-            }}
-
-            .navbar-links a {{
-                font-size: 12px;
-            }}
-
-            .container {{
-                padding: 0 16px;
-            }}
-
-            .hero-spacer {{
-                height: 44px;
-            }}
-
-            .header {{
-                padding: 32px 0 28px;
-            }}
-
-            .header h1 {{
-                font-size: 36px;
-                line-height: 1.1;
-                letter-spacing: -0.003em;
-            }}
-
-            .header .subtitle {{
-                font-size: 19px;
-                line-height: 1.19048;
-                letter-spacing: 0.011em;
-                margin-top: 8px;
-            }}
-
-            .update-time {{
-                font-size: 13px;
-            }}
-
-            .stats-container {{
-                grid-template-columns: 1fr;
-                gap: 8px;
-                margin-bottom: 32px;
-            }}
-
-            .stats-card {{
-                padding: 20px 14px;
-            }}
-
-            .stats-value {{
-                font-size: 40px;
-            }}
-
-            .stats-label {{
-                font-size: 14px;
-            }}
-
-            .servers-section {{
-                margin-bottom: 32px;
-            }}
-
-            .section-title {{
-                font-size: 28px;
-                margin-bottom: 16px;
-            }}
-
-            .server-item {{
-                flex-direction: column;
-                gap: 12px;
-                align-items: stretch;
-                padding: 12px 14px;
-            }}
-
-            .server-url {{
-                word-break: break-all;
-                font-size: 13px;
-                justify-content: flex-start;
-            }}
-
-            .copy-btn {{
-                width: 100%;
-                justify-content: center;
-                padding: 8px 18px;
-            }}
-
-            .footer {{
-                padding: 32px 0 40px;
-                margin-top: 32px;
-            }}
-
-            .back-to-top {{
-                bottom: 20px;
-                right: 20px;
-                width: 44px;
-                height: 44px;
-            }}
-
-            .back-to-top::before {{
-                font-size: 20px;
-            }}
-        }}
-
-    </style>
-</head>
-<body>
-    <div class="progress-bar" id="progressBar" style="width: 0%"></div>
-    
-    <nav class="navbar">
-        <div class="navbar-content">
-            <div class="navbar-brand">JetBrains Servers</div>
-            <div class="navbar-links">
-                <a href="#valid-servers">有效服务器</a>
-                <a href="#invalid-servers">无效服务器</a>
-            </div>
-        </div>
-    </nav>
-    
-    <div class="hero-spacer"></div>
-    <div class="container">
-        <div class="header">
-            <h1>JetBrains 激活服务器</h1>
-            <div class="subtitle">实时监控和验证服务器状态</div>
-            <div class="update-time">更新时间: {get_beijing_time()}</div>
-        </div>
-        
-        <div class="stats-container">
-            <div class="stats-card">
-                <div class="stats-value">{total_servers}</div>
-                <div class="stats-label">总服务器</div>
-            </div>
-            <div class="stats-card">
-                <div class="stats-value" style="color: var(--success-color)">{len(valid_servers)}</div>
-                <div class="stats-label">在线服务器</div>
-            </div>
-            <div class="stats-card">
-                <div class="stats-value" style="color: var(--error-color)">{len(invalid_servers)}</div>
-                <div class="stats-label">离线服务器</div>
-            </div>
-        </div>
-
-        <div class="servers-section" id="valid-servers">
-            <div class="section-badge">可用</div>
-            <h2 class="section-title">有效服务器</h2>
-            <ul class="server-list">
-                {chr(10).join(f'''
-                <li class="server-item valid">
-                    <span class="server-url">{server}</span>
-                    <button class="copy-btn" onclick="copyToClipboard(this, '{server}')">复制</button>
-                </li>''' for server in valid_servers)}
-            </ul>
-        </div>
-
-        <div class="servers-section" id="invalid-servers">
-            <div class="section-badge">不可用</div>
-            <h2 class="section-title">无效服务器</h2>
-            <ul class="server-list">
-                {chr(10).join(f'''
-                <li class="server-item invalid">
-                    <span class="server-url">{server}</span>
-                    <button class="copy-btn" onclick="copyToClipboard(this, '{server}')">复制</button>
-                </li>''' for server in invalid_servers)}
-            </ul>
-        </div>
-    </div>
-
-    <footer class="footer">
-        <p>⚡ 由 <strong>JetBrains Servers Updater</strong> 自动更新 | Made with cuijianzhuang ❤️</p>
-    </footer>
-
-    <div class="back-to-top" id="backToTop" title="返回顶部"></div>
-        
-    
-    <script>
-    async function copyToClipboard(button, text) {{
-        try {{
-            await navigator.clipboard.writeText(text);
-            const originalText = button.textContent;
-            
-            // 添加复制成功反馈
-            button.textContent = '已复制 ✓';
-            button.classList.add('copied');
-            
-            // 添加触觉反馈（如果支持）
-            if (navigator.vibrate) {{
-                navigator.vibrate(50);
-            }}
-            
-            setTimeout(() => {{
-                button.textContent = originalText;
-                button.classList.remove('copied');
-            }}, 2000);
-        }} catch (err) {{
-            console.error('复制失败:', err);
-            button.textContent = '失败 ✗';
-            setTimeout(() => {{
-                button.textContent = '复制';
-            }}, 2000);
-        }}
-    }}
-
-    // 添加键盘快捷键支持
-    document.addEventListener('keydown', (e) => {{
-        // Cmd/Ctrl + K 聚焦到第一个复制按钮
-        if ((e.metaKey || e.ctrlKey) && e.key === 'k') {{
-            e.preventDefault();
-            const firstButton = document.querySelector('.copy-btn');
-            if (firstButton) {{
-                firstButton.focus();
-                firstButton.scrollIntoView({{ behavior: 'smooth', block: 'center' }});
-            }}
-        }}
-    }});
-
-    // 导航栏滚动效果和返回顶部按钮
-    const navbar = document.querySelector('.navbar');
-    const backToTop = document.getElementById('backToTop');
-    const progressBar = document.getElementById('progressBar');
-    let lastScroll = 0;
-    
-    window.addEventListener('scroll', () => {{
-        const currentScroll = window.pageYOffset;
-        
-        // 导航栏效果
-        if (currentScroll > 50) {{
-            navbar.classList.add('scrolled');
-        }} else {{
-            navbar.classList.remove('scrolled');
-        }}
-        
-        // 返回顶部按钮
-        if (currentScroll > 300) {{
-            backToTop.classList.add('show');
-        }} else {{
-            backToTop.classList.remove('show');
-        }}
-        
-        // 进度条
-        const windowHeight = document.documentElement.scrollHeight - document.documentElement.clientHeight;
-        const scrolled = (currentScroll / windowHeight) * 100;
-        progressBar.style.width = scrolled + '%';
-        
-        lastScroll = currentScroll;
-    }});
-
-    // 返回顶部点击事件
-    backToTop.addEventListener('click', () => {{
-        window.scrollTo({{
-            top: 0,
-            behavior: 'smooth'
-        }});
-    }});
-
-    // 页面加载完成
-    window.addEventListener('load', () => {{
-        document.body.classList.add('loaded');
-    }});
-
-    // 页面加载后添加平滑滚动
-    document.addEventListener('DOMContentLoaded', () => {{
-        // 平滑滚动
-        document.querySelectorAll('a[href^="#"]').forEach(anchor => {{
-            anchor.addEventListener('click', function (e) {{
-                e.preventDefault();
-                const target = document.querySelector(this.getAttribute('href'));
-                if (target) {{
-                    const navHeight = navbar.offsetHeight;
-                    const targetPosition = target.offsetTop - navHeight - 20;
-                    window.scrollTo({{
-                        top: targetPosition,
-                        behavior: 'smooth'
-                    }});
-                }}
-            }});
-        }});
-
-        // 滚动时元素淡入动画
-        const observerOptions = {{
-            threshold: 0.1,
-            rootMargin: '0px 0px -100px 0px'
-        }};
-
-        const observer = new IntersectionObserver((entries) => {{
-            entries.forEach(entry => {{
-                if (entry.isIntersecting) {{
-                    entry.target.style.opacity = '1';
-                    entry.target.style.transform = 'translateY(0)';
-                }}
-            }});
-        }}, observerOptions);
-
-        // 为服务器列表项添加观察
-        document.querySelectorAll('.server-item').forEach((item, index) => {{
-            item.style.opacity = '0';
-            item.style.transform = 'translateY(20px)';
-            item.style.transition = `opacity 0.6s ease ${{index * 0.05}}s, transform 0.6s ease ${{index * 0.05}}s`;
-            observer.observe(item);
-        }});
-    }});
-    </script>
-</body>
-</html>
+    # 指标中使用的阶段标识
+    key: str
+    # 输出中显示的阶段名称
+    name: str
+    passed: int = 0
+    failed: int = 0
+    first_started: Optional[float] = None
+    last_finished: Optional[float] = None
+
+    def start(self) -> None:
+        if self.first_started is None:
+            self.first_started = time.perf_counter()
+
+    def finish(self, passed: bool) -> None:
+        if passed:
+            self.passed += 1
+        else:
+            self.failed += 1
+        self.last_finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        """
+        从第一个任务开始到最后一个任务结束的耗时（秒）
+        """
+        if self.first_started is None or self.last_finished is None:
+            return 0.0
+        return self.last_finished - self.first_started
+
+    def summary(self) -> str:
+        return f"{self.name}: 通过 {self.passed} 个，淘汰 {self.failed} 个，耗时 {self.elapsed:.2f} 秒"
+
+class TokenBucket:
+    """
+    令牌桶限速器，令牌按固定速率补充，桶满后不再累积
+
+    需要在事件循环中使用，acquire 在令牌不足时异步等待。
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        while True:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+def _subnet_key(host: str) -> str:
+    """
+    服务器所在的网段: IPv4 取 /24，IPv6 取 /64，主机名原样返回
     """
-    
     try:
-        with open('index.html', 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        print("HTML文件已生成")
-    except Exception as e:
-        print(f"生成HTML文件时出错: {str(e)}")
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return host
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f'{address}/{prefix}', strict=False))
 
-def update_servers_file(servers: List[str], invalid_servers: List[str] = None) -> None:
+class ProbeLimiter:
     """
-    更新服务器列表文件
-    
+    探测调度层，位于候选服务器和探测协程之间
+
+    每个服务器开始探测前依次等待: 所在网段和 ASN 的并发名额、全局令牌桶的令牌；
+    探测过程中每打开一个套接字（TCP 预筛和每个 HTTP 请求）还要占用一个全局套接字名额。
+    吞吐量因此保持平稳，不会因为突发的大量连接触发上游限流，或耗尽本机的连接跟踪表和临时端口。
+
+    各项限制为 0 时不生效。需要在事件循环中使用。
+
+    Attributes:
+        asns: 服务器 IP 到 ASN 的映射（来自 Shodan 匹配项），没有 ASN 的服务器不受 ASN 限制
+        throttled: 每项限制导致探测等待的次数
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE_LIMIT, subnet_concurrency: int = DEFAULT_SUBNET_CONCURRENCY,
+                 asn_concurrency: int = DEFAULT_ASN_CONCURRENCY, max_sockets: int = DEFAULT_MAX_SOCKETS,
+                 asns: Optional[Dict[str, str]] = None):
+        self.bucket = TokenBucket(rate) if rate > 0 else None
+        self.subnet_concurrency = subnet_concurrency
+        self.asn_concurrency = asn_concurrency
+        self.sockets = asyncio.Semaphore(max_sockets) if max_sockets > 0 else None
+        self.asns = asns if asns is not None else {}
+        self.throttled = Counter()
+        # 按键创建的信号量及其使用者（持有和等待）数量，没有使用者时删除，空闲网段不占内存
+        self.groups = {}
+
+    @asynccontextmanager
+    async def _hold(self, kind: str, key: str, limit: int):
+        group = (kind, key)
+        semaphore, users = self.groups.get(group, (None, 0))
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(limit)
+        self.groups[group] = (semaphore, users + 1)
+        try:
+            if semaphore.locked():
+                self.throttled[kind] += 1
+            async with semaphore:
+                yield
+        finally:
+            semaphore, users = self.groups[group]
+            if users == 1:
+                del self.groups[group]
+            else:
+                self.groups[group] = (semaphore, users - 1)
+
+    @asynccontextmanager
+    async def slot(self, server: str):
+        """
+        等待服务器可以开始探测，退出时归还网段和 ASN 名额
+        """
+        host = _split_endpoint(server)[1]
+        async with AsyncExitStack() as stack:
+            with profile_span('schedule_wait', server):
+                if self.subnet_concurrency > 0:
+                    await stack.enter_async_context(
+                        self._hold('subnet', _subnet_key(host), self.subnet_concurrency))
+                asn = self.asns.get(host)
+                if asn and self.asn_concurrency > 0:
+                    await stack.enter_async_context(self._hold('asn', asn, self.asn_concurrency))
+                if self.bucket is not None:
+                    if self.bucket.tokens < 1:
+                        self.throttled['rate'] += 1
+                    await self.bucket.acquire()
+            yield
+
+    async def acquire_socket(self) -> None:
+        """
+        占用一个套接字名额，用完后调用 release_socket 归还
+        """
+        if self.sockets is None:
+            return
+        if self.sockets.locked():
+            self.throttled['sockets'] += 1
+        await self.sockets.acquire()
+
+    def release_socket(self, *_) -> None:
+        if self.sockets is not None:
+            self.sockets.release()
+
+    def report(self, metrics: Optional[RunMetrics] = None) -> None:
+        """
+        打印各项限制导致等待的次数，并记录到运行指标中
+        """
+        names = {'rate': '速率', 'subnet': '网段', 'asn': 'ASN', 'sockets': '套接字'}
+        if self.throttled:
+            print("调度限流: " + "，".join(f"{names[kind]} {count} 次" for kind, count in sorted(self.throttled.items())))
+        if metrics is not None:
+            for kind, count in self.throttled.items():
+                metrics.count(f'throttled_{kind}', count)
+
+class ProbeBackend(abc.ABC):
+    """
+    探测后端: 决定 TCP 预筛之后的 HTTP 验证阶段如何发出请求
+
+    ProbePipeline 对每个服务器调用 start，得到探测结束时完成的 Future（结果为 ProbeResult）。
+    自定义后端继承本类并实现 request（发出一次请求，返回状态码和 Location 头），重定向跟随和
+    有效性判定与 probe_server 相同；需要释放连接池等资源时再覆盖 close。
+
+    Attributes:
+        name: 在 PROBE_BACKENDS 和 --backend 中使用的名称
+        cancellable: 进行中的探测能否取消；协议检测时落后的一方在可以取消时直接取消
+    """
+    name = None
+    cancellable = True
+
+    def __init__(self, pool_size: int = DEFAULT_CONCURRENCY, method: str = DEFAULT_PROBE_METHOD):
+        self.pool_size = pool_size
+        self.method = method
+
+    @classmethod
+    def available(cls) -> bool:
+        """
+        后端依赖的库是否已安装
+        """
+        return True
+
+    def start(self, server: str, timeouts: Tuple[float, float], connect_time: Optional[float]) -> asyncio.Future:
+        return asyncio.ensure_future(self.probe(server, timeouts, connect_time))
+
+    async def probe(self, server_url: str,
+                    timeouts: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+                    connect_time: Optional[float] = None) -> 'ProbeResult':
+        """
+        探测服务器，判定规则和记录的耗时与 probe_server 相同
+        """
+        result = ProbeResult(url=server_url, valid=False, connect_time=connect_time)
+        url = server_url if server_url.startswith(('http://', 'https://')) else f'http://{server_url}'
+        start = time.perf_counter()
+        connect_timeout, read_timeout = timeouts
+        deadline = time.monotonic() + connect_timeout + read_timeout * 2
+        try:
+            for _ in range(PROBE_MAX_REDIRECTS + 1):
+                request_start = time.perf_counter()
+                with profile_span('http_request', url=url, method=self.method):
+                    status, location = await self.request(url, timeouts)
+                if result.ttfb is None:
+                    result.ttfb = time.perf_counter() - request_start
+
+                url = _next_hop(result, url, status, location)
+                if url is None:
+                    break
+                if time.monotonic() > deadline:
+                    result.error = "重定向超时"
+                    result.error_class = 'redirect'
+                    break
+            else:
+                result.error = "重定向次数过多"
+                result.error_class = 'redirect'
+        except Exception as e:
+            result.error = str(e) or type(e).__name__
+            result.error_class = _classify_error(e)
+            print(f"测试服务器 {server_url} 时发生错误: {result.error}")
+
+        result.total_time = time.perf_counter() - start
+        return result
+
+    @abc.abstractmethod
+    async def request(self, url: str, timeouts: Tuple[float, float]) -> Tuple[int, Optional[str]]:
+        """
+        发出一次不跟随重定向的请求，不读取响应体
+
+        Args:
+            url: 请求的URL
+            timeouts: (建连超时, 读取超时)，单位秒
+
+        Returns:
+            tuple: (状态码, Location 头)，没有 Location 头时为 None；请求失败时抛出异常
+        """
+
+    async def close(self) -> None:
+        """
+        释放后端占用的资源，ProbePipeline 退出时调用
+        """
+
+class RequestsBackend(ProbeBackend):
+    """
+    requests 后端（默认）: 在线程池中执行阻塞的 probe_server，所有探测共享同一个连接池
+    """
+    name = 'requests'
+    # 线程中的请求无法中断，只能等它超时
+    cancellable = False
+
+    def __init__(self, pool_size: int = DEFAULT_CONCURRENCY, method: str = DEFAULT_PROBE_METHOD):
+        super().__init__(pool_size, method)
+        self.session = create_probe_session(pool_size=pool_size)
+        # 协议检测时一个服务器同时占用两个线程
+        self.executor = ThreadPoolExecutor(max_workers=pool_size * 2)
+
+    def start(self, server: str, timeouts: Tuple[float, float], connect_time: Optional[float]) -> asyncio.Future:
+        probe_one = partial(probe_server, server, session=self.session, method=self.method,
+                            timeouts=timeouts, connect_time=connect_time)
+        return asyncio.get_running_loop().run_in_executor(self.executor, probe_one)
+
+    async def request(self, url: str, timeouts: Tuple[float, float]) -> Tuple[int, Optional[str]]:
+        send = partial(_send_probe_request, self.session, url, self.method, timeouts)
+        response = await asyncio.get_running_loop().run_in_executor(self.executor, send)
+        return response.status_code, response.headers.get('Location')
+
+    async def close(self) -> None:
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+class AiohttpBackend(ProbeBackend):
+    """
+    aiohttp 后端: 在事件循环中直接发出请求，不占用线程；aiohttp 为可选依赖
+    """
+    name = 'aiohttp'
+
+    def __init__(self, pool_size: int = DEFAULT_CONCURRENCY, method: str = DEFAULT_PROBE_METHOD):
+        super().__init__(pool_size, method)
+        import aiohttp
+        self.aiohttp = aiohttp
+        self.session = None
+
+    @classmethod
+    def available(cls) -> bool:
+        return importlib.util.find_spec('aiohttp') is not None
+
+    def _session(self):
+        # ClientSession 需要在事件循环中创建
+        if self.session is None:
+            # 每次请求后关闭连接，未读取的响应体不会被放回连接池
+            connector = self.aiohttp.TCPConnector(limit=self.pool_size * 2, ssl=False, force_close=True)
+            self.session = self.aiohttp.ClientSession(connector=connector, auto_decompress=False)
+        return self.session
+
+    async def request(self, url: str, timeouts: Tuple[float, float]) -> Tuple[int, Optional[str]]:
+        connect_timeout, read_timeout = timeouts
+        # connect 包括 TLS 握手，sock_connect 只限制 TCP 建连，接受连接后卡住握手的服务器会等到 asyncio 的默认超时
+        timeout = self.aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+        return await asyncio.wait_for(self._send(url, timeout), connect_timeout + read_timeout)
+
+    async def _send(self, url: str, timeout) -> Tuple[int, Optional[str]]:
+        async with self._session().request(self.method.upper(), url, allow_redirects=False,
+                                           timeout=timeout) as response:
+            return response.status, response.headers.get('Location')
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+
+class StreamsBackend(ProbeBackend):
+    """
+    asyncio 后端: 用 asyncio 的流直接发送最小的 HTTP/1.1 请求，只解析状态行和 Location 头，
+    读完响应头立即断开，不依赖任何第三方库
+    """
+    name = 'asyncio'
+
+    def __init__(self, pool_size: int = DEFAULT_CONCURRENCY, method: str = DEFAULT_PROBE_METHOD):
+        super().__init__(pool_size, method)
+        # 与其他后端一样不校验证书
+        self.ssl_context = ssl.create_default_context()
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+    async def request(self, url: str, timeouts: Tuple[float, float]) -> Tuple[int, Optional[str]]:
+        connect_timeout, read_timeout = timeouts
+        parts = urlsplit(url)
+        https = parts.scheme == 'https'
+        port = parts.port or (443 if https else 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(parts.hostname, port, ssl=self.ssl_context if https else None,
+                                    limit=PROBE_MAX_HEADER_BYTES),
+            connect_timeout)
+        try:
+            path = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+            writer.write(f"{self.method.upper()} {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+                         f"Accept: */*\r\nConnection: close\r\n\r\n".encode('latin-1'))
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), read_timeout)
+        finally:
+            # 不读取响应体，直接断开
+            writer.transport.abort()
+
+        status_line, *header_lines = head.decode('latin-1').split('\r\n')
+        fields = status_line.split(' ', 2)
+        if len(fields) < 2 or not fields[0].startswith('HTTP/') or not fields[1].isdigit():
+            raise ValueError(f"无效的响应: {status_line[:80]}")
+        location = None
+        for line in header_lines:
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'location':
+                location = value.strip()
+                break
+        return int(fields[1]), location
+
+# 可选的探测后端，名称到实现类的映射
+PROBE_BACKENDS = {backend.name: backend for backend in (RequestsBackend, AiohttpBackend, StreamsBackend)}
+
+# 指定探测后端的方式: PROBE_BACKENDS 中的名称、ProbeBackend 子类或其实例
+ProbeBackendSpec = Union[str, Type[ProbeBackend], ProbeBackend]
+
+def make_backend(backend: ProbeBackendSpec, pool_size: int = DEFAULT_CONCURRENCY,
+                 method: str = DEFAULT_PROBE_METHOD) -> ProbeBackend:
+    """
+    创建探测后端: 名称和子类按 pool_size、method 创建新实例，实例原样返回
+
+    Raises:
+        ValueError: 名称不在 PROBE_BACKENDS 中
+        TypeError: 既不是名称也不是 ProbeBackend 子类或实例
+    """
+    if isinstance(backend, ProbeBackend):
+        return backend
+    if isinstance(backend, str):
+        if backend not in PROBE_BACKENDS:
+            raise ValueError(f"未知的探测后端: {backend}，可选值: {', '.join(PROBE_BACKENDS)}")
+        backend = PROBE_BACKENDS[backend]
+    if isinstance(backend, type) and issubclass(backend, ProbeBackend):
+        return backend(pool_size, method)
+    raise TypeError(f"探测后端必须是名称、ProbeBackend 子类或实例: {backend!r}")
+
+class ProbePipeline:
+    """
+    两阶段探测流水线
+
+    第一阶段用异步 TCP 建连快速筛掉不在监听的地址，只有能连上的服务器才进入
+    第二阶段的 HTTP 验证。两个阶段各自有独立的并发上限和统计信息；HTTP 阶段
+    由探测后端（见 PROBE_BACKENDS 和 make_backend）发出请求，默认在线程池中用 requests 执行；
+    传入后端实例时由流水线使用并在退出时关闭，每个实例只用于一个流水线。
+
+    每个服务器的超时时间根据探测历史自适应计算。曾经有效的服务器如果本次超时，
+    会用上限超时再重试一次，避免把慢速但可用的服务器误判为无效。
+
+    每次探测都先经过 ProbeLimiter 调度，未提供时使用默认限制。
+
+    需要在事件循环中通过 async with 使用。
+    """
+
+    def __init__(self, connect_concurrency=DEFAULT_CONNECT_CONCURRENCY, http_concurrency=DEFAULT_CONCURRENCY,
+                 method=DEFAULT_PROBE_METHOD, rows=None, limiter: Optional[ProbeLimiter] = None,
+                 backend: ProbeBackendSpec = DEFAULT_PROBE_BACKEND):
+        self.method = method
+        self.rows = rows or {}
+        self.limiter = limiter if limiter is not None else ProbeLimiter()
+        self.connect_semaphore = asyncio.Semaphore(connect_concurrency)
+        self.http_semaphore = asyncio.Semaphore(http_concurrency)
+        self.backend = make_backend(backend, http_concurrency, method)
+        self.connect_stats = StageStats('connect', 'TCP 建连预筛')
+        self.http_stats = StageStats('http', 'HTTP 验证')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.backend.close()
+
+    def report(self, metrics: Optional[RunMetrics] = None) -> None:
+        """
+        打印各阶段统计信息，并记录到运行指标中
+        """
+        for stats in (self.connect_stats, self.http_stats):
+            print(stats.summary())
+            if metrics is not None:
+                metrics.record_stage(stats)
+        self.limiter.report(metrics)
+
+    async def probe(self, server: str) -> ProbeResult:
+        """
+        探测单个服务器并打印结果
+        """
+        # ANSI颜色代码
+        GREEN_BG = '\033[42m'
+        RED_BG = '\033[41m'
+        WHITE_TEXT = '\033[37m'
+        RESET = '\033[0m'
+
+        row = self.rows.get(server)
+        print(f"正在测试服务器: {server}")
+        result = await self._probe_once(server, adaptive_timeouts(row))
+        if result.timed_out and row is not None and row['valid']:
+            print(f"服务器 {server} 超时，使用最大超时时间重试")
+            result = await self._probe_once(server, (PROBE_TIMEOUT_CEILING, PROBE_TIMEOUT_CEILING))
+        result.checked_at = time.time()
+
+        if result.valid:
+            print(f"{GREEN_BG}{WHITE_TEXT}服务器 {server} 有效 ({_format_latency(result.latency)}){RESET}")
+        else:
+            print(f"{RED_BG}{WHITE_TEXT}服务器 {server} 无效{RESET}")
+        return result
+
+    async def _probe_once(self, server: str, timeouts: Tuple[float, float]) -> ProbeResult:
+        with profile_span('probe', server):
+            async with self.limiter.slot(server):
+                return await self._probe_stages(server, timeouts)
+
+    async def _probe_stages(self, server: str, timeouts: Tuple[float, float]) -> ProbeResult:
+        url = server if server.startswith(('http://', 'https://')) else f'http://{server}'
+        start = time.perf_counter()
+
+        async with self.connect_semaphore:
+            self.connect_stats.start()
+            await self.limiter.acquire_socket()
+            try:
+                with profile_span('tcp_connect', server):
+                    connect_time = await _tcp_connect(url, timeouts[0])
+            except (OSError, asyncio.TimeoutError) as e:
+                self.connect_stats.finish(False)
+                error_class = _classify_error(e)
+                return ProbeResult(url=server, valid=False, error=str(e) or error_class,
+                                   error_class=error_class, total_time=time.perf_counter() - start)
+            finally:
+                self.limiter.release_socket()
+            self.connect_stats.finish(True)
+
+        async with self.http_semaphore:
+            self.http_stats.start()
+            with profile_span('http', server):
+                if _needs_scheme_detection(server):
+                    result = await self._detect_scheme(server, timeouts, connect_time)
+                else:
+                    result = await (await self._run_probe(server, timeouts, connect_time))
+            self.http_stats.finish(result.valid)
+
+        result.total_time = time.perf_counter() - start
+        return result
+
+    async def _run_probe(self, server: str, timeouts: Tuple[float, float], connect_time: float) -> asyncio.Future:
+        """
+        占用一个套接字名额后由探测后端开始探测，返回探测结束时完成的 Future，名额随之归还
+        """
+        await self.limiter.acquire_socket()
+        future = self.backend.start(server, timeouts, connect_time)
+        future.add_done_callback(self.limiter.release_socket)
+        return future
+
+    async def _detect_scheme(self, server: str, timeouts: Tuple[float, float], connect_time: float) -> ProbeResult:
+        """
+        用 HTTP 和 HTTPS 竞速探测同一个 ip:port，采用最先判定有效的结果
+
+        先发起 HTTP 探测，SCHEME_DETECT_DELAY 秒内没有判定有效（或已经失败）时再发起 HTTPS 探测，
+        两者同时进行。两种协议都无效时返回 HTTP 的结果。有效时结果的 URL 为实际可用的协议，
+        由探测历史记录下来，之后的运行直接使用该协议。
+        """
+        http_url = _with_scheme(server, 'http')
+        http_probe = await self._run_probe(http_url, timeouts, connect_time)
+        done, _ = await asyncio.wait({http_probe}, timeout=SCHEME_DETECT_DELAY)
+        if done and http_probe.result().valid:
+            return http_probe.result()
+
+        pending = {http_probe, await self._run_probe(_with_scheme(server, 'https'), timeouts, connect_time)}
+        finished = []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result.valid:
+                    # 另一个协议的探测能取消时直接取消，否则在线程中继续运行到超时为止，结果直接丢弃
+                    if self.backend.cancellable:
+                        for other in pending:
+                            other.cancel()
+                    return result
+                finished.append(result)
+        result = next(r for r in finished if r.url == http_url)
+        # 保留输入的URL，便于调用方按原URL对应结果
+        result.url = server
+        return result
+
+def apply_cached_schemes(servers: List[str], history: Optional['ProbeHistory']) -> List[str]:
+    """
+    把探测历史中缓存过协议的服务器换成对应协议的URL，顺序不变
+    """
+    if history is None:
+        return list(servers)
+    schemes = history.get_schemes(servers)
+    return [_with_scheme(server, schemes[server]) if server in schemes else server for server in servers]
+
+def _rekey_sources(sources: Optional[Dict[str, List[str]]], pairs: Iterable[Tuple[str, str]]) -> None:
+    """
+    把按获取时URL记录的来源改为以探测结果的URL为键
+
+    协议缓存或协议检测会把 http URL 换成 https，来源仍以原URL为键时会对不上探测结果。
+    同一个服务器的两个键合并为一个，语句名称保持最先找到的顺序。
+
     Args:
-        servers: 有效服务器列表
-        invalid_servers: 无效服务器列表（可选）
+        sources: 服务器URL到搜索语句名称列表的映射，原地修改，为 None 时不做任何事
+        pairs: (获取时的URL, 探测结果的URL) 序列
     """
-    try:
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            f.write(f"# JetBrains激活服务器列表\n")
-            f.write(f"# 更新时间: {get_beijing_time()}\n\n")
-            for server in servers:
-                f.write(f"{server}\n")
-        print(f"成功更新服务器列表，共{len(servers)}个有效服务器")
-        
-        # 生成HTML文件
-        generate_html(servers, invalid_servers or [])
-        
-        # 显示文件内容
-        print("\n=== 服务器列表内容 ===")
-        with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
-            print(f.read())
-        print("=====================")
-    except Exception as e:
-        print(f"写入文件时出错: {str(e)}")
+    if sources is None:
+        return
+    for server, url in pairs:
+        if url != server and server in sources:
+            known = sources.setdefault(url, [])
+            known.extend(name for name in sources.pop(server) if name not in known)
 
-def test_server(server_url):
+async def _probe_servers_async(servers_list, connect_concurrency, http_concurrency, method, rows=None,
+                               metrics=None, limiter=None, backend=DEFAULT_PROBE_BACKEND):
     """
-    测试服务器连接是否有效
-    
+    通过两阶段流水线并发探测服务器
+
+    Returns:
+        List[ProbeResult]: 与 servers_list 顺序一致的探测结果
+    """
+    async with ProbePipeline(connect_concurrency, http_concurrency, method, rows, limiter, backend) as pipeline:
+        # gather 按输入顺序返回结果，保证输出顺序稳定
+        results = await asyncio.gather(*(pipeline.probe(server) for server in servers_list))
+
+    pipeline.report(metrics)
+    return results
+
+def _result_from_row(row: sqlite3.Row) -> ProbeResult:
+    """
+    把探测历史中的记录还原为探测结果
+    """
+    return ProbeResult(url=row['url'], valid=bool(row['valid']), connect_time=row['connect_time'],
+                       ttfb=row['ttfb'], total_time=row['latency'], checked_at=row['last_checked'])
+
+def _quarantined_result(row: Optional[sqlite3.Row], now: float) -> Optional[ProbeResult]:
+    """
+    服务器仍在隔离期内时返回最近一次的探测结果（无效），否则返回 None；
+    隔离期在 QUARANTINE_SLACK 秒内就要结束的服务器视为已结束
+    """
+    if row is None or row['quarantined_until'] is None or row['quarantined_until'] <= now + QUARANTINE_SLACK:
+        return None
+    return _result_from_row(row)
+
+def _fresh_result(row: Optional[sqlite3.Row], freshness: Optional[float]) -> Optional[ProbeResult]:
+    """
+    增量模式下，探测记录仍在有效期内时将其还原为探测结果，否则返回 None
+    """
+    if row is None or freshness is None or row['last_checked'] < time.time() - freshness:
+        return None
+    return _result_from_row(row)
+
+def probe_all_servers(servers_list, concurrency=DEFAULT_CONCURRENCY, method=DEFAULT_PROBE_METHOD,
+                      history=None, freshness=None, connect_concurrency=DEFAULT_CONNECT_CONCURRENCY,
+                      metrics=None, quarantine=True, limiter=None,
+                      backend=DEFAULT_PROBE_BACKEND, sources=None) -> List[ProbeResult]:
+    """
+    探测所有服务器，返回带耗时信息的探测结果
+
     Args:
-        server_url (str): 要测试的服务器URL
-    
+        servers_list (list): 要测试的服务器URL列表
+        concurrency (int): HTTP 验证阶段同时进行的最大探测数量
+        method (str): 探测方式，'get' 或 'head'
+        history (ProbeHistory): 探测历史，提供时会记录本次探测结果
+        freshness (float): 增量模式下结果的有效期（秒），为 None 时全部重新探测
+        connect_concurrency (int): TCP 建连预筛阶段同时进行的最大建连数量
+        metrics (RunMetrics): 运行指标，提供时记录各阶段统计和每次探测的结果
+        quarantine (bool): 是否跳过隔离期内的服务器，跳过的服务器沿用最近一次的结果（无效）
+        limiter (ProbeLimiter): 探测调度层，控制速率、每个网段和 ASN 的并发数以及套接字总数，默认使用默认限制
+        backend: 探测后端名称、ProbeBackend 子类或实例，见 make_backend
+        sources (dict): 服务器URL到搜索语句名称列表的映射，提供时原地改为以探测结果的URL为键
+
     Returns:
-        bool: 如果服务器有效返回True，否则返回False
+        List[ProbeResult]: 去重后按输入顺序排列的探测结果
     """
-    try:
-        # 确保URL格式正确
-        if not server_url.startswith(('http://', 'https://')):
-            server_url = f'http://{server_url}'
-            
-        # 设置超时时间为5秒
-        response = requests.get(server_url, timeout=5)
-        
-        # 检查响应状态码
-        if response.status_code == 200:
-            return True
-        return False
-    except (requests.RequestException, Exception) as e:
-        print(f"测试服务器 {server_url} 时发生错误: {str(e)}")
-        return False
+    discovered = list(dict.fromkeys(servers_list))
+    canonical = apply_cached_schemes(discovered, history)
+    servers_list = list(dict.fromkeys(canonical))
+    if not servers_list:
+        return []
+
+    rows = history.get_many(servers_list) if history is not None else {}
+
+    # 隔离期内的服务器不探测，沿用最近一次的结果
+    results = {}
+    if quarantine:
+        now = time.time()
+        for url, row in rows.items():
+            result = _quarantined_result(row, now)
+            if result is not None:
+                results[url] = result
+        if results:
+            print(f"隔离: 跳过 {len(results)} 个连续失败的服务器")
+    quarantined = len(results)
+
+    # 增量模式: 有效期内探测过的服务器直接沿用上次的结果
+    if freshness is not None:
+        for url, row in rows.items():
+            result = _fresh_result(row, freshness)
+            if result is not None and url not in results:
+                results[url] = result
+        print(f"增量模式: {len(results) - quarantined} 个服务器沿用最近的探测结果")
+
+    pending = [server for server in servers_list if server not in results]
+    if pending:
+        concurrency = max(1, min(concurrency, len(pending)))
+        connect_concurrency = max(1, min(connect_concurrency, len(pending)))
+        probed = asyncio.run(_probe_servers_async(pending, connect_concurrency, concurrency, method, rows, metrics,
+                                                  limiter, backend))
+        checked_at = time.time()
+        for server, result in zip(pending, probed):
+            results[server] = result
+        if history is not None:
+            history.record_many(probed, checked_at)
+        if metrics is not None:
+            for result in probed:
+                metrics.observe_probe(result)
+
+    if metrics is not None:
+        metrics.count('quarantined', quarantined)
+        metrics.count('reused', len(servers_list) - len(pending) - quarantined)
+    _rekey_sources(sources, ((server, results[url].url) for server, url in zip(discovered, canonical)))
+    return [results[server] for server in servers_list]
+
+async def _stream_probe_async(pages, connect_concurrency, http_concurrency, method, history, freshness,
+                             queue_size, metrics=None, quarantine=True, limiter=None,
+                             backend=DEFAULT_PROBE_BACKEND):
+    """
+    边获取边探测: 后台线程逐页拉取候选服务器放入有界队列，探测协程同时从队列中取出探测
+
+    队列满时生产线程阻塞，获取速度不会超过探测速度。
+
+    Returns:
+        tuple: (按到达顺序排列的服务器列表, 对应的探测结果列表, 重新探测的结果列表, 隔离跳过的数量,
+            (获取时的URL, 探测结果的URL) 列表)
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=queue_size)
+    workers = connect_concurrency
+    servers = []
+    results = {}
+    probed = []
+    quarantined = 0
+    renamed = []
+
+    def produce():
+        try:
+            for page_servers in pages:
+                for server in page_servers:
+                    asyncio.run_coroutine_threadsafe(queue.put(server), loop).result()
+        except Exception as e:
+            print(f"获取服务器时出错: {str(e)}")
+        finally:
+            for _ in range(workers):
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+    async def consume(pipeline):
+        nonlocal quarantined
+        while True:
+            server = await queue.get()
+            if server is None:
+                return
+            discovered = server
+            server = apply_cached_schemes([server], history)[0]
+            servers.append(server)
+            # SQLite 连接只能在创建它的线程中使用，在事件循环线程里逐个查询
+            row = history.get_many([server]).get(server) if history is not None else None
+            result = _quarantined_result(row, time.time()) if quarantine else None
+            if result is not None:
+                quarantined += 1
+            else:
+                result = _fresh_result(row, freshness)
+            if result is None:
+                if row is not None:
+                    pipeline.rows[server] = row
+                result = await pipeline.probe(server)
+                probed.append(result)
+            results[server] = result
+            renamed.append((discovered, result.url))
+
+    async with ProbePipeline(connect_concurrency, http_concurrency, method, limiter=limiter,
+                             backend=backend) as pipeline:
+        producer = loop.run_in_executor(None, produce)
+        await asyncio.gather(producer, *(consume(pipeline) for _ in range(workers)))
+
+    pipeline.report(metrics)
+    if quarantined:
+        print(f"隔离: 跳过 {quarantined} 个连续失败的服务器")
+    return servers, [results[server] for server in servers], probed, quarantined, renamed
+
+def stream_probe_servers(max_pages=DEFAULT_MAX_PAGES, cache_ttl=DEFAULT_CACHE_TTL, offline=False,
+                         concurrency=DEFAULT_CONCURRENCY, method=DEFAULT_PROBE_METHOD, history=None,
+                         freshness=None, connect_concurrency=DEFAULT_CONNECT_CONCURRENCY,
+                         queue_size=DEFAULT_QUEUE_SIZE, api=None,
+                         metrics=None, queries=None, sources=None,
+                         quarantine=True, limiter=None,
+                         backend=DEFAULT_PROBE_BACKEND) -> Tuple[List[str], List[ProbeResult]]:
+    """
+    流式模式: 获取 Shodan 结果的同时开始探测，不必等待全部页面返回
+
+    参数含义与 get_activation_servers 和 probe_all_servers 相同，queue_size 为候选服务器队列容量。
+    提供 limiter 时，获取到的 ASN 会随页面到达写入 limiter.asns。sources 最终以探测结果的URL为键。
+
+    Returns:
+        tuple: (去重后的服务器列表, 与之顺序一致的探测结果列表)
+    """
+    pages = iter_activation_servers(max_pages, cache_ttl, offline, api, queries, sources,
+                                    limiter.asns if limiter is not None else None)
+    servers, results, probed, quarantined, renamed = asyncio.run(_stream_probe_async(
+        pages, connect_concurrency, concurrency, method, history, freshness, queue_size, metrics, quarantine,
+        limiter, backend))
+    # 获取线程在全部页面处理完后才写入 sources，此时再按探测结果的URL改键
+    _rekey_sources(sources, renamed)
+    if history is not None and probed:
+        history.record_many(probed, time.time())
+    if metrics is not None:
+        for result in probed:
+            metrics.observe_probe(result)
+        metrics.count('quarantined', quarantined)
+        metrics.count('reused', len(servers) - len(probed) - quarantined)
+    print(f"处理后的服务器数量: {len(servers)}")
+    return servers, results
+
+def sort_by_latency(results: List[ProbeResult]) -> List[ProbeResult]:
+    """
+    按延迟从低到高排序，没有延迟数据的排在最后，延迟相同时按URL排序
+    """
+    return sorted(results, key=lambda r: (r.latency is None, r.latency or 0.0, r.url))
 
-def test_all_servers(servers_list):
+def test_all_servers(servers_list, concurrency=DEFAULT_CONCURRENCY, method=DEFAULT_PROBE_METHOD,
+                     history=None, freshness=None, connect_concurrency=DEFAULT_CONNECT_CONCURRENCY):
     """
     测试所有服务器并返回有效的服务器列表
     
     Args:
         servers_list (list): 要测试的服务器URL列表
+        concurrency (int): HTTP 验证阶段同时进行的最大探测数量
+        method (str): 探测方式，'get' 或 'head'
+        history (ProbeHistory): 探测历史，提供时会记录本次探测结果
+        freshness (float): 增量模式下结果的有效期（秒），为 None 时全部重新探测
+        connect_concurrency (int): TCP 建连预筛阶段同时进行的最大建连数量
     
     Returns:
-        tuple: (有效服务器列表, 无效服务器列表)
+        tuple: (有效服务器列表, 无效服务器列表)，非 80/443 端口的服务器使用检测到的协议
     """
-    valid_servers = []
-    invalid_servers = []
-    
-    # ANSI颜色代码
-    GREEN_BG = '\033[42m'
-    RED_BG = '\033[41m'
-    WHITE_TEXT = '\033[37m'
-    RESET = '\033[0m'
-    
-    for server in servers_list:
-        print(f"正在测试服务器: {server}")
-        if test_server(server):
-            valid_servers.append(server)
-            print(f"{GREEN_BG}{WHITE_TEXT}服务器 {server} 有效{RESET}")
-        else:
-            invalid_servers.append(server)
-            print(f"{RED_BG}{WHITE_TEXT}服务器 {server} 无效{RESET}")
-    
+    results = probe_all_servers(servers_list, concurrency, method, history, freshness, connect_concurrency)
+    valid_servers = [result.url for result in results if result.valid]
+    invalid_servers = [result.url for result in results if not result.valid]
+    return valid_servers, invalid_servers
+
+def _split_results(results: List[ProbeResult], uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+                   sort: str = DEFAULT_SORT) -> Tuple[List[str], List[str], Dict[str, float]]:
+    """
+    把探测结果分为有效和无效服务器: 有效服务器按 sort 排序（默认延迟从低到高），无效服务器按URL排序，
+    输出顺序不受探测完成顺序影响
+
+    Returns:
+        tuple: (有效服务器列表, 无效服务器列表, 有效服务器URL到延迟的映射)
+    """
+    latencies = {result.url: result.latency for result in results if result.valid}
+    valid_servers = sort_servers(list(latencies), latencies, uptime, sort)
+    invalid_servers = sorted(result.url for result in results if not result.valid)
+    return valid_servers, invalid_servers, latencies
+
+# 以下为供其他程序导入使用的接口，与命令行共用同一套实现:
+#
+#     servers = discover(max_pages=2)
+#     results = probe(servers, backend='asyncio')
+#     render(results, uptime=load_uptime([r.url for r in results]), sort='uptime-7d')
+
+def discover(max_pages: int = DEFAULT_MAX_PAGES, cache_ttl: float = DEFAULT_CACHE_TTL, offline: bool = False,
+             api=None, queries: Optional[List[ShodanQuery]] = None,
+             sources: Optional[Dict[str, List[str]]] = None,
+             asns: Optional[Dict[str, str]] = None) -> List[str]:
+    """
+    从 Shodan 获取候选服务器，参数含义与 get_activation_servers 相同
+
+    Returns:
+        List[str]: 去重后的候选服务器URL列表
+    """
+    return get_activation_servers(max_pages, cache_ttl, offline, api, queries, sources, asns)
+
+def probe(urls: List[str], backend: ProbeBackendSpec = DEFAULT_PROBE_BACKEND, concurrency: int = DEFAULT_CONCURRENCY,
+          connect_concurrency: int = DEFAULT_CONNECT_CONCURRENCY, method: str = DEFAULT_PROBE_METHOD,
+          limiter: Optional[ProbeLimiter] = None, history: Optional['ProbeHistory'] = None,
+          metrics: Optional[RunMetrics] = None) -> List[ProbeResult]:
+    """
+    探测服务器，在已有的事件循环中请使用 probe_async
+
+    Args:
+        urls: 服务器URL列表
+        backend: 探测后端名称（可选值见 PROBE_BACKENDS）、ProbeBackend 子类或实例
+        history: 探测历史，提供时使用自适应超时和协议缓存、跳过隔离期内的服务器并记录本次结果
+
+    Returns:
+        List[ProbeResult]: 去重后按输入顺序排列的探测结果
+    """
+    return probe_all_servers(urls, concurrency, method, history, None, connect_concurrency, metrics,
+                             quarantine=history is not None, limiter=limiter, backend=backend)
+
+async def probe_async(urls: List[str], backend: ProbeBackendSpec = DEFAULT_PROBE_BACKEND,
+                      concurrency: int = DEFAULT_CONCURRENCY,
+                      connect_concurrency: int = DEFAULT_CONNECT_CONCURRENCY, method: str = DEFAULT_PROBE_METHOD,
+                      limiter: Optional[ProbeLimiter] = None,
+                      metrics: Optional[RunMetrics] = None) -> List[ProbeResult]:
+    """
+    probe 的协程版本，在调用方的事件循环中探测，不读写探测历史
+
+    Returns:
+        List[ProbeResult]: 去重后按输入顺序排列的探测结果
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return []
+    return await _probe_servers_async(urls, max(1, min(connect_concurrency, len(urls))),
+                                      max(1, min(concurrency, len(urls))), method, metrics=metrics,
+                                      limiter=limiter, backend=backend)
+
+def render(results: List[ProbeResult], sources: Optional[Dict[str, List[str]]] = None,
+           metrics: Optional[RunMetrics] = None, updated_at: Optional[float] = None,
+           uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+           sort: str = DEFAULT_SORT) -> Tuple[List[str], List[str]]:
+    """
+    根据探测结果写入文本列表、数据文件和页面，没有有效服务器时不写文件
+
+    Args:
+        results: 探测结果列表
+        sources: 服务器URL到找到它的搜索语句名称列表的映射（可选）
+        metrics: 运行指标（可选）
+        updated_at: 输出中显示的更新时间（Unix 时间戳），默认为当前时间
+        uptime: 服务器URL到各时间窗口在线率的映射（可选），可由 load_uptime 读取
+        sort: 有效服务器的排序方式，取值见 SORT_LABELS
+
+    Returns:
+        tuple: (按 sort 排序的有效服务器列表, 按URL排序的无效服务器列表)
+    """
+    results = list(results)
+    valid_servers, invalid_servers, latencies = _split_results(results, uptime, sort)
+    if valid_servers:
+        update_servers_file(valid_servers, invalid_servers, latencies, metrics, results, sources, updated_at,
+                            uptime, sort)
+    else:
+        print("未找到有效的服务器，不更新文件")
     return valid_servers, invalid_servers
 
-def main():
-    print(f"开始更新服务器列表 - {get_beijing_time()}")
-    servers = get_activation_servers()
+class ReprobeScheduler:
+    """
+    守护进程模式的重新探测调度器
+
+    用最小堆按下次探测时间排列已知服务器: 从未探测过的服务器立即探测，
+    有效服务器每隔 interval 秒探测一次，连续失败的服务器按失败次数指数退避，
+    距上次探测越久的服务器越先被探测。启用隔离时，处于隔离期的服务器等到隔离期结束才探测。
+
+    堆中的条目在重新安排或移除后不会立即删除，取出时与 due 中记录的到期时间不一致的条目直接丢弃。
+    """
+
+    def __init__(self, interval: float = DEFAULT_REPROBE_INTERVAL, quarantine: bool = True):
+        self.interval = interval
+        self.quarantine = quarantine
+        self.heap = []
+        self.failures = {}
+        # 每个服务器当前有效的到期时间
+        self.due = {}
+
+    def __len__(self):
+        return len(self.failures)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.failures
+
+    def next_due(self, last_checked: Optional[float], failures: int) -> float:
+        """
+        根据上次探测时间和连续失败次数计算下次探测时间
+        """
+        if last_checked is None:
+            return 0.0
+        due = last_checked + self.interval * 2 ** min(failures, DAEMON_MAX_BACKOFF_EXPONENT)
+        if self.quarantine:
+            due = max(due, quarantine_until(failures, last_checked) or 0.0)
+        return due
+
+    def add(self, url: str, row: Optional[sqlite3.Row] = None) -> None:
+        """
+        加入一个服务器，有探测记录时据此安排下次探测，已在调度中的服务器忽略
+        """
+        if url in self.failures:
+            return
+        failures = row['failures'] if row is not None else 0
+        self.failures[url] = failures
+        self._push(url, self.next_due(row['last_checked'] if row else None, failures))
+
+    def discard(self, url: str) -> None:
+        """
+        不再调度这个服务器，例如协议检测后改用带检测到的协议的URL
+        """
+        self.failures.pop(url, None)
+        self.due.pop(url, None)
+
+    def _push(self, url: str, due: float) -> None:
+        self.due[url] = due
+        heapq.heappush(self.heap, (due, url))
+
+    def _drop_stale(self) -> None:
+        """
+        丢弃堆顶已被重新安排或移除的条目
+        """
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+    def seconds_until_due(self) -> Optional[float]:
+        """
+        距离最早一个服务器到期还有多少秒，已到期时返回 0，没有服务器时返回 None
+        """
+        self._drop_stale()
+        if not self.heap:
+            return None
+        return max(0.0, self.heap[0][0] - time.time())
+
+    def pop_due(self) -> Optional[str]:
+        """
+        取出一个已到期的服务器，没有到期的服务器时返回 None
+        """
+        self._drop_stale()
+        if not self.heap or self.heap[0][0] > time.time():
+            return None
+        due, url = heapq.heappop(self.heap)
+        # 探测完成后由 reschedule 重新安排
+        self.due[url] = None
+        return url
+
+    def reschedule(self, result: ProbeResult) -> None:
+        """
+        根据探测结果更新失败次数并重新放回堆中，已在堆中的旧条目随之失效
+        """
+        failures = 0 if result.valid else self.failures.get(result.url, 0) + 1
+        self.failures[result.url] = failures
+        self._push(result.url, self.next_due(result.checked_at or time.time(), failures))
+
+def _limiter_from_args(args) -> ProbeLimiter:
+    """
+    根据命令行参数创建探测调度层
+    """
+    return ProbeLimiter(args.rate_limit, args.subnet_concurrency, args.asn_concurrency, args.max_sockets)
+
+def _render_outputs(latest: Dict[str, ProbeResult], metrics: RunMetrics,
+                    live_state: Optional[LiveState] = None,
+                    sources: Optional[Dict[str, List[str]]] = None,
+                    uptime: Optional[Dict[str, Dict[str, Optional[float]]]] = None,
+                    sort: str = DEFAULT_SORT) -> None:
+    """
+    根据每个服务器最近一次的探测结果重新生成输出文件，并更新内置 HTTP 服务的内容，
+    文件和 HTTP 服务显示同一个更新时间
+    """
+    updated_at = time.time()
+    results = list(latest.values())
+    if live_state is not None:
+        live_state.publish(*_split_results(results, uptime, sort), results, sources, updated_at, uptime, sort)
+    render(results, sources, metrics, updated_at, uptime, sort)
+
+async def _daemon_async(args, history: ProbeHistory, metrics: RunMetrics, stop: asyncio.Event,
+                        live_state: Optional[LiveState] = None) -> None:
+    loop = asyncio.get_running_loop()
+    scheduler = ReprobeScheduler(args.reprobe_interval, quarantine=args.quarantine)
+    bucket = TokenBucket(args.probe_rate)
+    # 同时在途的探测数量不超过 HTTP 并发数，探测变慢时不会无限堆积任务
+    in_flight = asyncio.Semaphore(args.concurrency)
+    latest = {}
+    dirty = False
+    last_render = 0.0
+    next_discovery = 0.0
+    discovery = None
+
+    sources = {}
+    limiter = _limiter_from_args(args)
+
+    def _rediscover():
+        found = {}
+        servers = get_activation_servers(max_pages=args.max_pages, cache_ttl=args.cache_ttl, offline=args.offline,
+                                         queries=args.queries, sources=found, asns=limiter.asns)
+        return servers, found
+
+    async def probe_one(pipeline, server):
+        nonlocal dirty
+        try:
+            result = await pipeline.probe(server)
+            history.record_many([result], result.checked_at)
+            metrics.observe_probe(result)
+            url = result.url
+            previous = latest.pop(server, None)
+            if url != server:
+                # 协议检测得到了带 https 的URL，之后以检测到的URL为准，旧的键不再保留和探测，
+                # 否则同一个服务器会以两个键同时出现在输出中
+                previous = latest.get(url, previous)
+                pipeline.rows.pop(server, None)
+                scheduler.discard(server)
+                _rekey_sources(sources, [(server, url)])
+                dirty = True
+            row = history.get_many([url]).get(url)
+            if row is not None:
+                pipeline.rows[url] = row
+            latest[url] = result
+            scheduler.reschedule(result)
+            # 只有服务器在有效和无效之间切换，或首次得到结果时，服务器集合才会变化
+            if previous is None or previous.valid != result.valid:
+                dirty = True
+        finally:
+            in_flight.release()
+
+    async with ProbePipeline(args.connect_concurrency, args.concurrency, args.probe_method,
+                             limiter=limiter, backend=args.backend) as pipeline:
+        tasks = set()
+        while not stop.is_set():
+            now = time.time()
+
+            # 按较慢的节奏在后台获取新的候选服务器
+            if discovery is None and now >= next_discovery:
+                discovery = loop.run_in_executor(None, _rediscover)
+            if discovery is not None and discovery.done():
+                servers, found = discovery.result()
+                canonical = apply_cached_schemes(servers, history)
+                for url, server in zip(servers, canonical):
+                    known = sources.setdefault(server, [])
+                    known.extend(name for name in found.get(url, []) if name not in known)
+                servers = canonical
+                rows = history.get_many(servers)
+                added = [server for server in servers if server not in scheduler]
+                for server in added:
+                    scheduler.add(server, rows.get(server))
+                    if server in rows:
+                        latest[server] = _result_from_row(rows[server])
+                        pipeline.rows[server] = rows[server]
+                print(f"守护进程: 新增 {len(added)} 个候选服务器，共 {len(scheduler)} 个")
+                metrics.count('candidates', len(added))
+                dirty = dirty or bool(added)
+                discovery = None
+                next_discovery = time.time() + args.discovery_interval
+
+            # 服务器集合有变化时重新生成输出，两次之间至少间隔 DAEMON_RENDER_INTERVAL 秒
+            if dirty and now - last_render >= DAEMON_RENDER_INTERVAL:
+                dirty = False
+                last_render = now
+                with metrics.phase('render'):
+                    _render_outputs(latest, metrics, live_state, sources, history.uptime(list(latest)), args.sort)
+                valid_count = sum(1 for result in latest.values() if result.valid)
+                metrics.set('valid', valid_count)
+                metrics.set('invalid', len(latest) - valid_count)
+                metrics.record_queries(args.queries, sources, latest.values())
+                _write_reports(args, metrics)
+
+            server = scheduler.pop_due()
+            if server is None:
+                delay = scheduler.seconds_until_due()
+                delay = 1.0 if delay is None else min(delay, 1.0)
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=max(delay, 0.05))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await in_flight.acquire()
+            await bucket.acquire()
+            task = asyncio.ensure_future(probe_one(pipeline, server))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        print("守护进程: 正在退出，等待进行中的探测完成...")
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if dirty:
+            _render_outputs(latest, metrics, live_state, sources, history.uptime(list(latest)), args.sort)
+
+    pipeline.report(metrics)
+
+def run_daemon(args, metrics: RunMetrics) -> None:
+    """
+    守护进程模式: 持续按优先级重新探测已知服务器，并定期获取新的候选服务器
+
+    全局探测速率受令牌桶限制，资源占用平稳可预期；服务器集合变化时重新生成输出文件。
+    指定 --serve 时同时启动内置 HTTP 服务，直接从内存提供最新的列表。
+    收到 SIGINT 或 SIGTERM 时等待进行中的探测完成后退出。
+
+    Args:
+        args: parse_args 返回的命令行参数
+        metrics: 运行指标，持续累积并在每次生成输出后写入报告
+    """
+    print(f"启动守护进程 - {get_beijing_time()}")
+    print(f"探测速率: {args.probe_rate} 次/秒，重新探测间隔: {args.reprobe_interval} 秒，"
+          f"获取间隔: {args.discovery_interval} 秒")
+
+    async def main_loop():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows 的事件循环不支持信号处理，只能靠 Ctrl+C 中断
+                pass
+        with ProbeHistory() as history, metrics.phase('daemon'):
+            await _daemon_async(args, history, metrics, stop, live_state)
+
+    live_state = None
+    http_server = None
+    if args.serve:
+        host, port = args.serve
+        live_state = LiveState()
+        http_server = start_http_server(host, port, live_state)
+        print(f"内置 HTTP 服务已启动: http://{host}:{http_server.server_address[1]}/")
+    try:
+        asyncio.run(main_loop())
+    finally:
+        if http_server is not None:
+            http_server.shutdown()
+            http_server.server_close()
+
+def _parse_serve_address(value: str) -> Tuple[str, int]:
+    """
+    解析 --serve 的 [HOST:]PORT 参数
+    """
+    host, _, port = value.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的端口: {value}")
+    if not 0 <= port <= 65535:
+        raise argparse.ArgumentTypeError(f"端口超出范围: {value}")
+    return host.strip('[]') or DEFAULT_SERVE_HOST, port
+
+def parse_args(argv=None):
+    """
+    解析命令行参数
+
+    Args:
+        argv (list): 命令行参数列表，默认为 sys.argv[1:]
+
+    Returns:
+        argparse.Namespace: 解析后的参数
+    """
+    parser = argparse.ArgumentParser(description="JetBrains 激活服务器列表更新工具")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"HTTP 验证阶段同时探测的最大服务器数量（默认: {DEFAULT_CONCURRENCY}）")
+    parser.add_argument('--connect-concurrency', type=int, default=DEFAULT_CONNECT_CONCURRENCY,
+                        help=f"TCP 建连预筛阶段同时建连的最大数量（默认: {DEFAULT_CONNECT_CONCURRENCY}）")
+    parser.add_argument('--rate-limit', type=float, default=DEFAULT_RATE_LIMIT,
+                        help=f"所有探测每秒最多发起的数量，0 表示不限制（默认: {DEFAULT_RATE_LIMIT:g}）")
+    parser.add_argument('--subnet-concurrency', type=int, default=DEFAULT_SUBNET_CONCURRENCY,
+                        help=f"同一 /24 网段同时探测的最大服务器数量，0 表示不限制（默认: {DEFAULT_SUBNET_CONCURRENCY}）")
+    parser.add_argument('--asn-concurrency', type=int, default=DEFAULT_ASN_CONCURRENCY,
+                        help=f"同一 ASN 同时探测的最大服务器数量，0 表示不限制（默认: {DEFAULT_ASN_CONCURRENCY}）")
+    parser.add_argument('--max-sockets', type=int, default=DEFAULT_MAX_SOCKETS,
+                        help=f"探测同时打开的最大套接字数量，0 表示不限制（默认: {DEFAULT_MAX_SOCKETS}）")
+    parser.add_argument('--probe-method', choices=PROBE_METHODS, default=DEFAULT_PROBE_METHOD,
+                        help="探测方式: get 为只读响应头的流式 GET，head 为 HEAD 请求（默认: get）")
+    parser.add_argument('--backend', choices=list(PROBE_BACKENDS), default=DEFAULT_PROBE_BACKEND,
+                        help="HTTP 验证阶段的探测后端: requests 为线程池中的 requests，aiohttp 为 aiohttp（需要另行安装），"
+                             f"asyncio 为直接使用 asyncio 的流（默认: {DEFAULT_PROBE_BACKEND}）")
+    parser.add_argument('--queries', metavar='PATH',
+                        help=f"Shodan 搜索语句配置文件（JSON），所有语句并发执行（默认: {DEFAULT_QUERIES_FILE}，"
+                             f"不存在时只使用内置语句）")
+    parser.add_argument('--max-pages', type=int, default=DEFAULT_MAX_PAGES,
+                        help=f"最多获取的 Shodan 结果页数（默认: {DEFAULT_MAX_PAGES}）")
+    parser.add_argument('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL,
+                        help=f"Shodan 响应缓存有效期，单位秒，0 表示不读缓存（默认: {DEFAULT_CACHE_TTL}）")
+    parser.add_argument('--offline', action='store_true',
+                        help="离线模式: 只使用本地缓存的 Shodan 结果，不访问 API")
+    parser.add_argument('--incremental', action='store_true',
+                        help="增量模式: 只重新探测结果已过期的服务器和新发现的服务器")
+    parser.add_argument('--freshness', type=float, default=DEFAULT_FRESHNESS,
+                        help=f"增量模式下探测结果的有效期，单位秒（默认: {DEFAULT_FRESHNESS}）")
+    parser.add_argument('--no-quarantine', dest='quarantine', action='store_false',
+                        help=f"不跳过隔离期内的服务器（连续失败 {QUARANTINE_THRESHOLD} 次的服务器默认隔离，"
+                             f"隔离期从 {QUARANTINE_BASE // 3600} 小时起指数增长）")
+    parser.add_argument('--stream', action='store_true',
+                        help="流式模式: 获取 Shodan 结果的同时开始探测")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f"流式模式下候选服务器队列的容量（默认: {DEFAULT_QUEUE_SIZE}）")
+    parser.add_argument('--sort', choices=list(SORT_LABELS), default=DEFAULT_SORT,
+                        help="有效服务器在文本列表和页面中的排序方式: latency 为延迟从低到高，"
+                             "uptime-24h/uptime-7d/uptime-30d 为对应时间窗口的在线率从高到低（默认: latency）")
+    parser.add_argument('--render-only', action='store_true',
+                        help="只用上次生成的数据重新生成文本、数据文件和页面，不访问 Shodan 也不探测")
+    parser.add_argument('--daemon', action='store_true',
+                        help="守护进程模式: 持续按优先级重新探测服务器，服务器集合变化时更新输出文件")
+    parser.add_argument('--probe-rate', type=float, default=DEFAULT_PROBE_RATE,
+                        help=f"守护进程模式下每秒最多发起的探测次数（默认: {DEFAULT_PROBE_RATE}）")
+    parser.add_argument('--reprobe-interval', type=float, default=DEFAULT_REPROBE_INTERVAL,
+                        help=f"守护进程模式下有效服务器的重新探测间隔，单位秒（默认: {DEFAULT_REPROBE_INTERVAL}）")
+    parser.add_argument('--discovery-interval', type=float, default=DEFAULT_DISCOVERY_INTERVAL,
+                        help=f"守护进程模式下获取新候选服务器的间隔，单位秒（默认: {DEFAULT_DISCOVERY_INTERVAL}）")
+    parser.add_argument('--serve', metavar='[HOST:]PORT', type=_parse_serve_address,
+                        help=f"守护进程模式下启动内置 HTTP 服务，从内存提供文本、JSON 和 HTML 列表"
+                             f"（默认监听 {DEFAULT_SERVE_HOST}）")
+    parser.add_argument('--profile', nargs='?', const=DEFAULT_PROFILE_DIR, metavar='DIR',
+                        help=f"剖析模式: 把每个阶段的 cProfile 结果（.pstats）、采样得到的折叠调用栈（.collapsed，"
+                             f"可生成火焰图）和探测耗时区间（trace.json）写入目录（默认: {DEFAULT_PROFILE_DIR}）")
+    parser.add_argument('--report', metavar='PATH',
+                        help="把本次运行的指标以 JSON 格式写入文件")
+    parser.add_argument('--prometheus-textfile', metavar='PATH',
+                        help="把本次运行的指标以 Prometheus 文本格式写入文件（供 node_exporter 收集）")
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency 必须大于 0")
+    if args.connect_concurrency < 1:
+        parser.error("--connect-concurrency 必须大于 0")
+    for name in ('rate_limit', 'subnet_concurrency', 'asn_concurrency', 'max_sockets'):
+        if getattr(args, name) < 0:
+            parser.error(f"--{name.replace('_', '-')} 不能为负数")
+    if args.max_pages < 1:
+        parser.error("--max-pages 必须大于 0")
+    if args.cache_ttl < 0:
+        parser.error("--cache-ttl 不能为负数")
+    if args.freshness < 0:
+        parser.error("--freshness 不能为负数")
+    if args.queue_size < 1:
+        parser.error("--queue-size 必须大于 0")
+    if args.probe_rate <= 0:
+        parser.error("--probe-rate 必须大于 0")
+    if args.reprobe_interval <= 0:
+        parser.error("--reprobe-interval 必须大于 0")
+    if args.discovery_interval <= 0:
+        parser.error("--discovery-interval 必须大于 0")
+    if not PROBE_BACKENDS[args.backend].available():
+        parser.error(f"探测后端 {args.backend} 需要安装 {args.backend}")
+    if args.render_only and args.daemon:
+        parser.error("--render-only 不能与 --daemon 一起使用")
+    if args.serve and not args.daemon:
+        parser.error("--serve 需要与 --daemon 一起使用")
+    try:
+        args.queries = load_queries(args.queries)
+    except (OSError, ValueError) as e:
+        parser.error(f"无法读取搜索语句配置: {e}")
+    return args
+
+def run_update(args, metrics: RunMetrics) -> None:
+    """
+    执行一次完整的更新: 获取服务器、测试、写入文件
+
+    Args:
+        args: parse_args 返回的命令行参数
+        metrics: 本次运行的指标
+    """
+    # 整次运行使用同一个时间戳，日志和各输出文件中的更新时间一致
+    updated_at = metrics.started_at
+    print(f"开始更新服务器列表 - {get_beijing_time(updated_at)}")
+    freshness = args.freshness if args.incremental else None
+    sources = {}
+    limiter = _limiter_from_args(args)
+    with ProbeHistory() as history:
+        if args.stream:
+            # 获取和测试同时进行
+            print("\n流式模式: 边获取边测试服务器...")
+            with metrics.phase('shodan_fetch_and_probe'):
+                servers, results = stream_probe_servers(
+                    max_pages=args.max_pages, cache_ttl=args.cache_ttl, offline=args.offline,
+                    concurrency=args.concurrency, method=args.probe_method, history=history,
+                    freshness=freshness, connect_concurrency=args.connect_concurrency,
+                    queue_size=args.queue_size, metrics=metrics, queries=args.queries, sources=sources,
+                    quarantine=args.quarantine, limiter=limiter, backend=args.backend)
+        else:
+            with metrics.phase('shodan_fetch'):
+                servers = get_activation_servers(
+                    max_pages=args.max_pages, cache_ttl=args.cache_ttl, offline=args.offline,
+                    queries=args.queries, sources=sources, asns=limiter.asns)
+            results = []
+            if servers:
+                # 先测试所有获取到的服务器
+                print("\n开始测试服务器...")
+                with metrics.phase('probe'):
+                    results = probe_all_servers(
+                        servers, concurrency=args.concurrency, method=args.probe_method,
+                        history=history, freshness=freshness, connect_concurrency=args.connect_concurrency,
+                        metrics=metrics, quarantine=args.quarantine, limiter=limiter,
+                        backend=args.backend, sources=sources)
+        with metrics.phase('uptime'):
+            uptime = history.uptime([result.url for result in results])
+    metrics.count('candidates', len(servers))
+    metrics.record_queries(args.queries, sources, results)
+
     if servers:
-        # 先测试所有获取到的服务器
-        print("\n开始测试服务器...")
-        valid_servers, invalid_servers = test_all_servers(servers)
+        valid_servers, invalid_servers, latencies = _split_results(results, uptime, args.sort)
+        metrics.set('valid', len(valid_servers))
+        metrics.set('invalid', len(invalid_servers))
         
         # ANSI颜色代码
         GREEN_BG = '\033[42m'
@@ -943,7 +3674,9 @@ def main():
         print("\n所有服务器状态:")
         print("有效服务器:")
         for server in valid_servers:
-            print(f"{GREEN_BG}{WHITE_TEXT}{server}{RESET}")
+            details = '  '.join(part for part in (_format_latency(latencies[server]),
+                                                  _format_uptime(uptime.get(server))) if part)
+            print(f"{GREEN_BG}{WHITE_TEXT}{server} ({details}){RESET}")
             
         print("\n无效服务器:")
         for server in invalid_servers:
@@ -951,11 +3684,110 @@ def main():
         
         # 只更新有效的服务器到文件
         if valid_servers:
-            update_servers_file(valid_servers, invalid_servers)
+            update_servers_file(valid_servers, invalid_servers, latencies, metrics, results, sources, updated_at,
+                                uptime, args.sort)
         else:
             print("\n未找到有效的服务器，不更新文件")
     else:
         print("未获取到服务器，跳过更新")
 
+def _parse_iso_time(value: Optional[str]) -> Optional[float]:
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+def load_previous_outputs() -> Optional[tuple]:
+    """
+    读取上次生成的服务器列表，供 --render-only 重新生成输出
+
+    优先读取 JSON 数据文件；不存在时退回到文本文件，此时只有有效服务器和延迟。
+
+    Returns:
+        tuple: (有效服务器列表, 无效服务器列表, 延迟映射, 探测结果列表, 来源映射, 更新时间戳)，
+            两种文件都不存在时返回 None
+    """
+    try:
+        with open(FEED_JSON_FILE, encoding='utf-8') as f:
+            document = json.load(f)
+    except (OSError, ValueError):
+        document = None
+    if document is not None:
+        servers, invalid_servers, latencies, results, sources = [], [], {}, [], {}
+        for record in document.get('servers', []):
+            url = record['url']
+            (servers if record['valid'] else invalid_servers).append(url)
+            if record.get('latency') is not None:
+                latencies[url] = record['latency']
+            results.append(ProbeResult(url=url, valid=record['valid'], total_time=record.get('latency'),
+                                       checked_at=_parse_iso_time(record.get('last_checked'))))
+            sources[url] = record.get('source', {}).get('queries', [])
+        return servers, invalid_servers, latencies, results, sources, _parse_iso_time(document.get('generated_at'))
+
+    try:
+        with open(OUTPUT_FILE, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    servers, latencies, updated_at = [], {}, None
+    for line in lines:
+        if line.startswith('# 更新时间: '):
+            moment = datetime.strptime(line[len('# 更新时间: '):], '%Y-%m-%d %H:%M:%S')
+            updated_at = moment.replace(tzinfo=_beijing_tz()).timestamp()
+        elif line and not line.startswith('#'):
+            url, _, comment = line.partition('  # ')
+            servers.append(url)
+            # 注释中延迟在前，后面可能还有在线率
+            latency = comment.split('  ', 1)[0]
+            if latency.endswith(' ms'):
+                latencies[url] = float(latency[:-len(' ms')]) / 1000
+    return servers, [], latencies, [], {}, updated_at
+
+def run_render_only(args, metrics: RunMetrics) -> None:
+    """
+    不访问 Shodan 也不探测，用上次生成的数据重新生成所有输出文件，例如修改模板或样式之后
+
+    更新时间沿用上次数据的生成时间，页面不会显示一个并没有发生过的更新；在线率从在线率历史的汇总记录重新计算。
+    """
+    loaded = load_previous_outputs()
+    if loaded is None:
+        print(f"没有找到 {FEED_JSON_FILE} 或 {OUTPUT_FILE}，请先完整运行一次")
+        return
+    servers, invalid_servers, latencies, results, sources, updated_at = loaded
+    print(f"只生成输出: {len(servers)} 个有效服务器，{len(invalid_servers)} 个无效服务器")
+    metrics.set('valid', len(servers))
+    metrics.set('invalid', len(invalid_servers))
+    with metrics.phase('uptime'):
+        uptime = load_uptime(servers + invalid_servers)
+    servers = sort_servers(servers, latencies, uptime, args.sort)
+    update_servers_file(servers, invalid_servers, latencies, metrics, results, sources, updated_at, uptime, args.sort)
+
+def _write_reports(args, metrics: RunMetrics) -> None:
+    """
+    按命令行参数写入 JSON 运行报告和 Prometheus 指标文件
+    """
+    if args.report:
+        metrics.write_json(args.report)
+        print(f"运行报告已写入 {args.report}")
+    if args.prometheus_textfile:
+        metrics.write_prometheus(args.prometheus_textfile)
+        print(f"Prometheus 指标已写入 {args.prometheus_textfile}")
+
+def main(argv=None):
+    args = parse_args(argv)
+    metrics = RunMetrics(cumulative=args.daemon)
+    if args.profile:
+        start_profiling(args.profile)
+    try:
+        if args.daemon:
+            run_daemon(args, metrics)
+        elif args.render_only:
+            run_render_only(args, metrics)
+        else:
+            run_update(args, metrics)
+    finally:
+        # 即使中途出错也输出已收集的指标和剖析结果，便于排查
+        _write_reports(args, metrics)
+        if args.profile:
+            written = stop_profiling()
+            print(f"剖析结果已写入 {args.profile}（{len(written)} 个文件）")
+
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,288 @@
+async function copyToClipboard(button, text) {
+    try {
+        await navigator.clipboard.writeText(text);
+        const originalText = button.textContent;
+
+        // 添加复制成功反馈
+        button.textContent = '已复制 ✓';
+        button.classList.add('copied');
+
+        // 添加触觉反馈（如果支持）
+        if (navigator.vibrate) {
+            navigator.vibrate(50);
+        }
+
+        setTimeout(() => {
+            button.textContent = originalText;
+            button.classList.remove('copied');
+        }, 2000);
+    } catch (err) {
+        console.error('复制失败:', err);
+        button.textContent = '失败 ✗';
+        setTimeout(() => {
+            button.textContent = '复制';
+        }, 2000);
+    }
+}
+
+// 添加键盘快捷键支持
+document.addEventListener('keydown', (e) => {
+    // Cmd/Ctrl + K 聚焦到第一个复制按钮
+    if ((e.metaKey || e.ctrlKey) && e.key === 'k') {
+        e.preventDefault();
+        const firstButton = document.querySelector('.copy-btn');
+        if (firstButton) {
+            firstButton.focus();
+            firstButton.scrollIntoView({ behavior: 'smooth', block: 'center' });
+        }
+    }
+});
+
+// 服务器列表的虚拟渲染: 数据以 JSON 嵌在页面中，只为可见区域附近的行创建 DOM
+const ROW_GAP = 8;          // 行间距（px）
+const OVERSCAN = 10;        // 可见区域上下额外渲染的行数
+const STAGGER_STEP = 0.03;  // 首屏行淡入的错开间隔（秒）
+const STAGGER_MAX = 0.3;    // 错开延迟的上限（秒），行数再多也不会更晚出现
+
+class VirtualList {
+    constructor(container, rows, kind) {
+        this.container = container;
+        this.rows = rows;
+        this.kind = kind;
+        this.rendered = new Map();
+        this.rowHeight = 0;
+        this.firstPaint = true;
+
+        // 复制按钮通过事件委托处理，不为每一行单独绑定
+        container.addEventListener('click', (e) => {
+            const button = e.target.closest('.copy-btn');
+            if (button) {
+                copyToClipboard(button, button.dataset.url);
+            }
+        });
+    }
+
+    // 换成重新排序后的行，已渲染的行全部重建
+    setRows(rows) {
+        this.rows = rows;
+        this.rendered.forEach(item => item.remove());
+        this.rendered.clear();
+        this.update();
+    }
+
+    createRow(index) {
+        const [url, latency, uptime] = this.rows[index];
+        const item = document.createElement('li');
+        item.className = `server-item ${this.kind}`;
+
+        const label = document.createElement('span');
+        label.className = 'server-url';
+        const text = document.createElement('span');
+        text.className = 'server-url-text';
+        text.textContent = url;
+        text.title = url;
+        label.appendChild(text);
+        if (latency !== null && latency !== undefined) {
+            const latencyLabel = document.createElement('span');
+            latencyLabel.className = 'server-latency';
+            latencyLabel.textContent = `${latency} ms`;
+            label.appendChild(latencyLabel);
+        }
+        if (uptime) {
+            const uptimeLabel = document.createElement('span');
+            uptimeLabel.className = 'server-uptime';
+            uptimeLabel.textContent = serverData.windows
+                .map((name, i) => `${name} ${uptime[i] === null ? '-' : uptime[i] + '%'}`)
+                .join(' · ');
+            label.appendChild(uptimeLabel);
+        }
+
+        const button = document.createElement('button');
+        button.className = 'copy-btn';
+        button.dataset.url = url;
+        button.textContent = '复制';
+
+        item.appendChild(label);
+        item.appendChild(button);
+        return item;
+    }
+
+    // 用第一行的实际高度作为行高，窗口宽度变化时重新测量
+    measure() {
+        if (!this.rows.length) {
+            return;
+        }
+        const probe = this.createRow(0);
+        probe.style.visibility = 'hidden';
+        this.container.appendChild(probe);
+        const rowHeight = probe.offsetHeight + ROW_GAP;
+        probe.remove();
+        if (rowHeight === this.rowHeight) {
+            return;
+        }
+        this.rowHeight = rowHeight;
+        this.container.style.height = `${this.rows.length * this.rowHeight - ROW_GAP}px`;
+        this.rendered.forEach(item => item.remove());
+        this.rendered.clear();
+    }
+
+    update() {
+        if (!this.rows.length) {
+            return;
+        }
+        if (!this.rowHeight) {
+            this.measure();
+        }
+        const top = this.container.getBoundingClientRect().top;
+        const viewport = window.innerHeight;
+        const first = Math.max(0, Math.floor(-top / this.rowHeight) - OVERSCAN);
+        const last = Math.min(this.rows.length - 1, Math.ceil((viewport - top) / this.rowHeight) + OVERSCAN);
+
+        // 移除离开窗口的行
+        this.rendered.forEach((item, index) => {
+            if (index < first || index > last) {
+                item.remove();
+                this.rendered.delete(index);
+            }
+        });
+
+        if (first > last) {
+            return;
+        }
+        const fragment = document.createDocumentFragment();
+        for (let index = first; index <= last; index++) {
+            if (this.rendered.has(index)) {
+                continue;
+            }
+            const item = this.createRow(index);
+            item.style.top = `${index * this.rowHeight}px`;
+            if (this.firstPaint) {
+                item.classList.add('entering');
+                item.style.animationDelay = `${Math.min((index - first) * STAGGER_STEP, STAGGER_MAX)}s`;
+            }
+            this.rendered.set(index, item);
+            fragment.appendChild(item);
+        }
+        this.container.appendChild(fragment);
+        this.firstPaint = false;
+    }
+}
+
+function loadServerData() {
+    const element = document.getElementById('server-data');
+    try {
+        return JSON.parse(element.textContent);
+    } catch (err) {
+        console.error('服务器数据解析失败:', err);
+        return { sort: 'latency', windows: [], valid: [], invalid: [] };
+    }
+}
+
+const serverData = loadServerData();
+const virtualLists = Array.from(document.querySelectorAll('.server-list[data-list]'), container => {
+    const kind = container.dataset.list;
+    return new VirtualList(container, serverData[kind], kind);
+});
+
+// 排序: 按延迟从低到高，或按某个时间窗口的在线率从高到低；没有数据的排在最后，相同时依次按延迟和URL排序
+function compareRows(sort) {
+    const latencyOf = row => row[1] ?? Infinity;
+    const byLatency = (a, b) => latencyOf(a) - latencyOf(b) || a[0].localeCompare(b[0]);
+    if (sort === 'latency') {
+        return byLatency;
+    }
+    const index = serverData.windows.indexOf(sort.slice('uptime-'.length));
+    const uptimeOf = row => (row[2] && row[2][index] !== null ? row[2][index] : -1);
+    return (a, b) => uptimeOf(b) - uptimeOf(a) || byLatency(a, b);
+}
+
+const sortButtons = document.querySelectorAll('.sort-btn');
+
+function applySort(sort, reorder) {
+    sortButtons.forEach(button => button.classList.toggle('active', button.dataset.sort === sort));
+    if (reorder) {
+        virtualLists.forEach(list => list.setRows([...list.rows].sort(compareRows(sort))));
+    }
+}
+
+sortButtons.forEach(button => {
+    button.addEventListener('click', () => applySort(button.dataset.sort, true));
+});
+// 页面生成时已按初始排序方式排好，只需标记按钮
+applySort(serverData.sort || 'latency', false);
+
+// 导航栏滚动效果和返回顶部按钮
+const navbar = document.querySelector('.navbar');
+const backToTop = document.getElementById('backToTop');
+const progressBar = document.getElementById('progressBar');
+
+function updateOnScroll() {
+    const currentScroll = window.pageYOffset;
+
+    // 导航栏效果
+    navbar.classList.toggle('scrolled', currentScroll > 50);
+
+    // 返回顶部按钮
+    backToTop.classList.toggle('show', currentScroll > 300);
+
+    // 进度条
+    const windowHeight = document.documentElement.scrollHeight - document.documentElement.clientHeight;
+    const scrolled = windowHeight > 0 ? (currentScroll / windowHeight) * 100 : 0;
+    progressBar.style.width = scrolled + '%';
+
+    virtualLists.forEach(list => list.update());
+}
+
+// 滚动和缩放事件合并到每帧最多处理一次
+let frameRequested = false;
+
+function scheduleUpdate() {
+    if (!frameRequested) {
+        frameRequested = true;
+        requestAnimationFrame(() => {
+            frameRequested = false;
+            updateOnScroll();
+        });
+    }
+}
+
+window.addEventListener('scroll', scheduleUpdate, { passive: true });
+window.addEventListener('resize', () => {
+    virtualLists.forEach(list => list.measure());
+    scheduleUpdate();
+}, { passive: true });
+updateOnScroll();
+
+// 返回顶部点击事件
+backToTop.addEventListener('click', () => {
+    window.scrollTo({
+        top: 0,
+        behavior: 'smooth'
+    });
+});
+
+// 页面加载完成，字体等资源就绪后行高可能变化，重新测量
+window.addEventListener('load', () => {
+    document.body.classList.add('loaded');
+    virtualLists.forEach(list => list.measure());
+    scheduleUpdate();
+});
+
+// 页面加载后添加平滑滚动
+document.addEventListener('DOMContentLoaded', () => {
+    // 平滑滚动
+    document.querySelectorAll('a[href^="#"]').forEach(anchor => {
+        anchor.addEventListener('click', function (e) {
+            e.preventDefault();
+            const target = document.querySelector(this.getAttribute('href'));
+            if (target) {
+                const navHeight = navbar.offsetHeight;
+                const targetPosition = target.offsetTop - navHeight - 20;
+                window.scrollTo({
+                    top: targetPosition,
+                    behavior: 'smooth'
+                });
+            }
+        });
+    });
+});
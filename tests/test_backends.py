@@ -0,0 +1,77 @@
+"""
+探测后端扩展接口的测试
+
+在回环地址上监听一个端口供 TCP 预筛连接，HTTP 请求由自定义后端伪造，不访问外部网络。
+"""
+import asyncio
+import os
+import socket
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jetbrains_servers_updater as updater  # noqa: E402
+
+class StaticBackend(updater.ProbeBackend):
+    """
+    对所有请求返回固定的状态码，记录请求过的URL
+    """
+    status = 200
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requested = []
+        self.closed = False
+
+    async def request(self, url, timeouts):
+        self.requested.append(url)
+        return self.status, None
+
+    async def close(self):
+        self.closed = True
+
+class BackendSpecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(16)
+        self.addCleanup(self.listener.close)
+        self.url = f"https://127.0.0.1:{self.listener.getsockname()[1]}"
+
+    def test_abstract_base_requires_request(self):
+        class Incomplete(updater.ProbeBackend):
+            pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+    def test_make_backend_accepts_name_class_and_instance(self):
+        self.assertIsInstance(updater.make_backend('asyncio'), updater.StreamsBackend)
+        backend = updater.make_backend(StaticBackend, pool_size=3, method='head')
+        self.assertIsInstance(backend, StaticBackend)
+        self.assertEqual((backend.pool_size, backend.method), (3, 'head'))
+        self.assertIs(updater.make_backend(backend), backend)
+        with self.assertRaises(ValueError):
+            updater.make_backend('missing')
+        with self.assertRaises(TypeError):
+            updater.make_backend(object)
+
+    def test_probe_with_backend_instance(self):
+        backend = StaticBackend()
+        results = updater.probe([self.url], backend=backend)
+        self.assertEqual([result.valid for result in results], [True])
+        self.assertEqual(backend.requested, [self.url])
+        self.assertTrue(backend.closed)
+
+    def test_probe_async_with_backend_class(self):
+        class Failing(StaticBackend):
+            status = 503
+
+        results = asyncio.run(updater.probe_async([self.url], backend=Failing))
+        self.assertFalse(results[0].valid)
+        self.assertEqual(results[0].error_class, 'http_status')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""
+守护进程模式的回归测试
+
+用伪造的探测流水线代替真实探测，不访问网络和 Shodan。
+"""
+import asyncio
+import argparse
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jetbrains_servers_updater as updater  # noqa: E402
+
+HTTP_URL = 'http://10.0.0.1:8443'
+HTTPS_URL = 'https://10.0.0.1:8443'
+
+class FakePipeline:
+    """
+    第一次探测时检测到 https 并成功，之后对 https URL 的探测全部失败
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.rows = {}
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def probe(self, url):
+        self.calls.append(url)
+        now = updater.time.time()
+        if url == HTTP_URL:
+            return updater.ProbeResult(url=HTTPS_URL, valid=True, total_time=0.01, checked_at=now)
+        return updater.ProbeResult(url=url, valid=False, error='refused', error_class='refused', checked_at=now)
+
+    def report(self, metrics):
+        pass
+
+class DaemonSchemeDetectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+
+    def run_daemon(self, probes):
+        args = argparse.Namespace(
+            reprobe_interval=0.01, quarantine=False, probe_rate=1000.0, concurrency=4, connect_concurrency=4,
+            probe_method='get', backend='requests', max_pages=1, cache_ttl=0, offline=True, queries=[],
+            discovery_interval=3600, sort=updater.DEFAULT_SORT, rate_limit=0, subnet_concurrency=0,
+            asn_concurrency=0, max_sockets=0, report=None, prometheus_textfile=None)
+        rendered = []
+        pipeline = FakePipeline()
+
+        def render(latest, *rest):
+            rendered.append(dict(latest))
+
+        async def main():
+            stop = asyncio.Event()
+
+            async def stop_after_probes():
+                while len(pipeline.calls) < probes:
+                    await asyncio.sleep(0.01)
+                stop.set()
+
+            stopper = asyncio.ensure_future(stop_after_probes())
+            history = updater.ProbeHistory(os.path.join(self.tmp.name, 'history.sqlite3'),
+                                           uptime_dir=os.path.join(self.tmp.name, 'uptime'))
+            try:
+                await asyncio.wait_for(
+                    updater._daemon_async(args, history, updater.RunMetrics(), stop), timeout=10)
+            finally:
+                history.close()
+                stopper.cancel()
+
+        with mock.patch.object(updater, 'ProbePipeline', return_value=pipeline), \
+                mock.patch.object(updater, 'get_activation_servers', return_value=[HTTP_URL]), \
+                mock.patch.object(updater, '_render_outputs', side_effect=render), \
+                mock.patch.object(updater, 'DAEMON_RENDER_INTERVAL', 0):
+            asyncio.run(main())
+        return pipeline, rendered
+
+    def test_detected_scheme_replaces_scheduled_url(self):
+        pipeline, rendered = self.run_daemon(probes=3)
+
+        # 检测到 https 之后只探测 https URL，原来的 http URL 不再探测
+        self.assertEqual(pipeline.calls[0], HTTP_URL)
+        self.assertTrue(all(url == HTTPS_URL for url in pipeline.calls[1:]))
+        # 每次生成输出时同一个服务器只出现一次，https 探测失败后不再保留旧的有效结果
+        self.assertTrue(rendered)
+        for latest in rendered:
+            self.assertNotIn(HTTP_URL, latest)
+        self.assertEqual(list(rendered[-1]), [HTTPS_URL])
+        self.assertFalse(rendered[-1][HTTPS_URL].valid)
+
+    def test_scheduler_discard_drops_pending_entry(self):
+        scheduler = updater.ReprobeScheduler(interval=60)
+        scheduler.add(HTTP_URL)
+        scheduler.discard(HTTP_URL)
+        self.assertEqual(len(scheduler), 0)
+        self.assertIsNone(scheduler.pop_due())
+        self.assertIsNone(scheduler.seconds_until_due())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+内置 HTTP 服务（LiveState 和请求处理）的测试
+
+服务监听回环地址的随机端口，响应内容在内存中生成，不写输出文件。
+"""
+import gzip
+import http.client
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jetbrains_servers_updater as updater  # noqa: E402
+
+VALID = ['https://10.0.0.1:443']
+INVALID = ['http://10.0.0.2:8080']
+
+class LiveServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state = updater.LiveState()
+        self.server = updater.start_http_server('127.0.0.1', 0, self.state)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def publish(self):
+        self.state.publish(VALID, INVALID, {VALID[0]: 0.05})
+
+    def get(self, path, **headers):
+        conn = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=5)
+        self.addCleanup(conn.close)
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def test_unavailable_before_first_publish(self):
+        response, body = self.get('/')
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.getheader('Retry-After'), '5')
+        self.assertEqual(body, b'')
+
+    def test_gzip_follows_q_values(self):
+        self.publish()
+        path = f'/{updater.OUTPUT_FILE}'
+        response, body = self.get(path, **{'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+        self.assertIn(VALID[0], gzip.decompress(body).decode('utf-8'))
+
+        for header in ('gzip;q=0', 'gzip; q=0.0, identity', '*;q=0', 'br, *;q=0', ''):
+            response, body = self.get(path, **{'Accept-Encoding': header})
+            self.assertIsNone(response.getheader('Content-Encoding'), header)
+            self.assertIn(VALID[0], body.decode('utf-8'))
+
+        response, _ = self.get(path, **{'Accept-Encoding': 'br, *;q=0.5'})
+        self.assertEqual(response.getheader('Content-Encoding'), 'gzip')
+
+    def test_conditional_requests(self):
+        self.publish()
+        path = f'/{updater.FEED_JSON_FILE}'
+        response, _ = self.get(path)
+        self.assertEqual(response.status, 200)
+        etag = response.getheader('ETag')
+        last_modified = response.getheader('Last-Modified')
+
+        response, body = self.get(path, **{'If-None-Match': etag})
+        self.assertEqual(response.status, 304)
+        self.assertEqual(body, b'')
+        self.assertEqual(response.getheader('ETag'), etag)
+        # 压缩和未压缩的表示 ETag 不同
+        response, _ = self.get(path, **{'If-None-Match': etag, 'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.status, 200)
+
+        # 客户端原样回传 Last-Modified 时，秒以下的部分不能让比较失败
+        response, _ = self.get(path, **{'If-Modified-Since': last_modified})
+        self.assertEqual(response.status, 304)
+        response, _ = self.get(path, **{'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+        self.assertEqual(response.status, 200)
+
+    def test_unknown_path(self):
+        self.publish()
+        response, _ = self.get('/missing')
+        self.assertEqual(response.status, 404)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+输出文件（文本列表、页面、数据文件）跳过重写的回归测试
+
+在临时目录中生成输出，不访问网络和 Shodan。
+"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jetbrains_servers_updater as updater  # noqa: E402
+
+VALID = ['https://10.0.0.1:443', 'http://10.0.0.2:8080']
+INVALID = ['http://10.0.0.3:8080']
+SOURCES = {url: ['jetbrains'] for url in VALID + INVALID}
+DAY = 24 * 3600
+
+def results_at(checked_at, latencies):
+    results = [updater.ProbeResult(url=url, valid=True, total_time=latency, checked_at=checked_at)
+               for url, latency in latencies.items()]
+    results.extend(updater.ProbeResult(url=url, valid=False, error='refused', checked_at=checked_at)
+                   for url in INVALID)
+    return results
+
+class FeedRewriteTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cwd = os.getcwd()
+        os.chdir(tmp.name)
+        self.addCleanup(os.chdir, cwd)
+
+    def write(self, updated_at, latencies, valid=VALID):
+        return updater.write_feeds(valid, INVALID, latencies, results_at(updated_at, latencies), SOURCES,
+                                   updated_at)
+
+    def test_jitter_and_new_probe_times_do_not_rewrite(self):
+        start = 1_700_000_000
+        self.assertTrue(self.write(start, {VALID[0]: 0.040, VALID[1]: 0.300}))
+        with open(updater.FEED_JSON_FILE, encoding='utf-8') as f:
+            before = f.read()
+        # 探测时间不同、延迟在同一档位内抖动
+        self.assertFalse(self.write(start + DAY, {VALID[0]: 0.045, VALID[1]: 0.280}))
+        with open(updater.FEED_JSON_FILE, encoding='utf-8') as f:
+            self.assertEqual(f.read(), before)
+
+    def test_material_change_rewrites(self):
+        start = 1_700_000_000
+        self.write(start, {VALID[0]: 0.040, VALID[1]: 0.300})
+        # 延迟跨过档位
+        self.assertTrue(self.write(start + DAY, {VALID[0]: 0.200, VALID[1]: 0.300}))
+        # 服务器集合变化
+        self.assertTrue(self.write(start + 2 * DAY, {VALID[0]: 0.200}, valid=VALID[:1]))
+        with open(updater.FEED_JSON_FILE, encoding='utf-8') as f:
+            document = json.load(f)
+        self.assertEqual(document['valid'], 1)
+
+    def test_rewrites_after_max_age(self):
+        start = 1_700_000_000
+        latencies = {VALID[0]: 0.040, VALID[1]: 0.300}
+        self.write(start, latencies)
+        self.assertFalse(self.write(start + updater.FEED_MAX_AGE - 1, latencies))
+        self.assertTrue(self.write(start + updater.FEED_MAX_AGE, latencies))
+
+class UnchangedRunTest(unittest.TestCase):
+    """
+    两次内容相同的运行不改动任何输出文件，服务器集合变化时全部重写
+    """
+
+    OUTPUTS = (updater.OUTPUT_FILE, updater.HTML_OUTPUT_FILE, updater.FEED_JSON_FILE, updater.FEED_NDJSON_FILE,
+               f'{updater.FEED_JSON_FILE}.gz', f'{updater.FEED_NDJSON_FILE}.gz')
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cwd = os.getcwd()
+        os.chdir(tmp.name)
+        self.addCleanup(os.chdir, cwd)
+
+    def run_once(self, updated_at, latencies):
+        valid = list(latencies)
+        invalid = [url for url in VALID + INVALID if url not in latencies]
+        results = [updater.ProbeResult(url=url, valid=url in latencies, total_time=latencies.get(url),
+                                       checked_at=updated_at) for url in valid + invalid]
+        updater.update_servers_file(valid, invalid, latencies, results=results, sources=SOURCES,
+                                    updated_at=updated_at)
+
+    def backdate(self):
+        # 把修改时间调到过去，重写后一定能看出来
+        for path in self.OUTPUTS:
+            os.utime(path, (1_000_000_000, 1_000_000_000))
+        return {path: os.stat(path).st_mtime_ns for path in self.OUTPUTS}
+
+    def test_identical_runs_keep_mtimes(self):
+        start = 1_700_000_000
+        self.run_once(start, {VALID[0]: 0.040, VALID[1]: 0.300})
+        before = self.backdate()
+        # 下一次定时运行: 更新时间和探测时间不同，延迟小幅抖动
+        self.run_once(start + DAY, {VALID[0]: 0.042, VALID[1]: 0.290})
+        self.assertEqual({path: os.stat(path).st_mtime_ns for path in self.OUTPUTS}, before)
+
+    def test_membership_change_rewrites(self):
+        start = 1_700_000_000
+        self.run_once(start, {VALID[0]: 0.040, VALID[1]: 0.300})
+        before = self.backdate()
+        self.run_once(start + DAY, {VALID[0]: 0.040})
+        for path in self.OUTPUTS:
+            self.assertNotEqual(os.stat(path).st_mtime_ns, before[path], path)
+        with open(updater.OUTPUT_FILE, encoding='utf-8') as f:
+            self.assertNotIn(VALID[1], f.read())
+
+if __name__ == '__main__':
+    unittest.main()
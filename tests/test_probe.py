@@ -0,0 +1,128 @@
+"""
+一次性运行（run_update）探测路径的回归测试
+
+用伪造的探测代替真实探测，不访问网络和 Shodan。
+"""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jetbrains_servers_updater as updater  # noqa: E402
+
+# 协议检测得到 https 的服务器、探测历史中缓存了 https 的服务器、一直使用 http 的服务器
+DETECTED = 'http://10.0.0.1:8443'
+CACHED = 'http://10.0.0.2:8443'
+PLAIN = 'http://10.0.0.3:8080'
+SERVERS = [DETECTED, CACHED, PLAIN]
+SOURCES = {DETECTED: ['jetbrains'], CACHED: ['jetbrains', 'license'], PLAIN: ['license']}
+
+def fake_result(url):
+    now = updater.time.time()
+    if url == DETECTED:
+        url = updater._with_scheme(url, 'https')
+    return updater.ProbeResult(url=url, valid=True, total_time=0.01, checked_at=now)
+
+class FakePipeline:
+
+    def __init__(self, *args, **kwargs):
+        self.rows = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def probe(self, url):
+        return fake_result(url)
+
+    def report(self, metrics):
+        pass
+
+async def fake_probe_servers_async(servers, *args, **kwargs):
+    return [fake_result(url) for url in servers]
+
+def fake_pages(max_pages, cache_ttl, offline, api, queries, sources, asns):
+    try:
+        yield list(SERVERS)
+    finally:
+        sources.update({url: list(names) for url, names in SOURCES.items()})
+
+class MixedSchemeSourcesTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.history = updater.ProbeHistory(os.path.join(tmp.name, 'history.sqlite3'),
+                                            uptime_dir=os.path.join(tmp.name, 'uptime'))
+        self.addCleanup(self.history.close)
+        cached = updater._with_scheme(CACHED, 'https')
+        self.history.record_many([updater.ProbeResult(url=cached, valid=True, total_time=0.01)],
+                                 updater.time.time())
+
+    def assert_sources_match(self, results, sources):
+        self.assertEqual(sorted(sources), sorted(result.url for result in results))
+        by_url = {result.url: sources[result.url] for result in results}
+        self.assertEqual(by_url['https://10.0.0.1:8443'], ['jetbrains'])
+        self.assertEqual(by_url['https://10.0.0.2:8443'], ['jetbrains', 'license'])
+        self.assertEqual(by_url[PLAIN], ['license'])
+
+    def test_probe_all_servers_rekeys_sources(self):
+        sources = {url: list(names) for url, names in SOURCES.items()}
+        with mock.patch.object(updater, '_probe_servers_async', side_effect=fake_probe_servers_async):
+            results = updater.probe_all_servers(SERVERS, history=self.history, quarantine=False,
+                                                sources=sources)
+        self.assert_sources_match(results, sources)
+
+    def test_stream_probe_servers_rekeys_sources(self):
+        sources = {}
+        with mock.patch.object(updater, 'ProbePipeline', FakePipeline), \
+                mock.patch.object(updater, 'iter_activation_servers', side_effect=fake_pages):
+            _, results = updater.stream_probe_servers(history=self.history, quarantine=False, sources=sources)
+        self.assert_sources_match(results, sources)
+
+    def test_record_queries_counts_every_server(self):
+        sources = {url: list(names) for url, names in SOURCES.items()}
+        with mock.patch.object(updater, '_probe_servers_async', side_effect=fake_probe_servers_async):
+            results = updater.probe_all_servers(SERVERS, history=self.history, quarantine=False,
+                                                sources=sources)
+        metrics = updater.RunMetrics()
+        queries = [updater.ShodanQuery(name='jetbrains', query='x'), updater.ShodanQuery(name='license', query='y')]
+        metrics.record_queries(queries, sources, results)
+        valid = {name: entry['valid'] for name, entry in metrics.queries.items()}
+        self.assertEqual(valid, {'jetbrains': 2, 'license': 2})
+
+class QuarantineSlackTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.history = updater.ProbeHistory(os.path.join(tmp.name, 'history.sqlite3'), uptime_dir=None)
+        self.addCleanup(self.history.close)
+
+    def quarantine(self, checked_at):
+        failed = updater.ProbeResult(url=PLAIN, valid=False, error='refused', error_class='refused')
+        for _ in range(updater.QUARANTINE_THRESHOLD):
+            self.history.record_many([failed], checked_at)
+        return self.history.get_many([PLAIN])[PLAIN]
+
+    def test_daily_run_started_early_ends_quarantine(self):
+        # 下一次每天一次的定时运行比上一次早几分钟启动
+        checked_at = 1_700_000_000
+        row = self.quarantine(checked_at)
+        self.assertEqual(row['quarantined_until'], checked_at + updater.QUARANTINE_BASE)
+        self.assertIsNone(updater._quarantined_result(row, checked_at + updater.QUARANTINE_BASE - 600))
+
+    def test_quarantine_holds_until_slack(self):
+        checked_at = 1_700_000_000
+        row = self.quarantine(checked_at)
+        result = updater._quarantined_result(row, checked_at + 3600)
+        self.assertIsNotNone(result)
+        self.assertFalse(result.valid)
+
+if __name__ == '__main__':
+    unittest.main()
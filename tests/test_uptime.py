@@ -0,0 +1,91 @@
+"""
+在线率历史（UptimeLog）的读写、汇总和压缩测试
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jetbrains_servers_updater as updater  # noqa: E402
+
+HOUR = 3600
+DAY = 24 * HOUR
+# 当天（UTC）中午，窗口的边界固定；关闭时按当前时间压缩，记录不能早于保留期
+NOW = int(time.time()) // DAY * DAY + 12 * HOUR
+UP = 'https://10.0.0.1:443'
+FLAKY = 'http://10.0.0.2:8080'
+
+def results(flaky_valid):
+    return [updater.ProbeResult(url=UP, valid=True, total_time=0.05),
+            updater.ProbeResult(url=FLAKY, valid=flaky_valid, total_time=0.2 if flaky_valid else None)]
+
+class UptimeLogTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def fill(self, log, start=NOW - 10 * HOUR, count=10):
+        # 每小时探测一次，FLAKY 每隔一次失败
+        for i in range(count):
+            log.append(results(i % 2 == 0), start + i * HOUR)
+
+    def test_round_trip(self):
+        with updater.UptimeLog(self.directory) as log:
+            self.fill(log)
+            expected = log.uptime(now=NOW)
+        self.assertEqual(expected[UP]['24h'], 1.0)
+        self.assertEqual(expected[FLAKY]['24h'], 0.5)
+
+        reopened = updater.UptimeLog(self.directory)
+        self.assertEqual(reopened.urls, [UP, FLAKY])
+        self.assertEqual(reopened.uptime(now=NOW), expected)
+        self.assertEqual(reopened.uptime([FLAKY], now=NOW), {FLAKY: expected[FLAKY]})
+
+    def test_rollup_only_new_records(self):
+        log = updater.UptimeLog(self.directory)
+        self.fill(log, count=4)
+        self.assertEqual(log.rollup(), 8)
+        self.assertEqual(log.rollup(), 0)
+        log.append(results(True), NOW - HOUR)
+        self.assertEqual(log.rollup(), 2)
+        self.assertEqual(log.uptime(now=NOW)[FLAKY]['24h'], 0.6)
+
+    def test_interrupted_rollup_is_not_counted_twice(self):
+        log = updater.UptimeLog(self.directory)
+        self.fill(log)
+        # 汇总记录已追加、检查点保存之前中断
+        with mock.patch.object(updater.UptimeLog, '_save_meta', side_effect=OSError('interrupted')):
+            with self.assertRaises(OSError):
+                log.rollup()
+
+        reopened = updater.UptimeLog(self.directory)
+        uptime = reopened.uptime(now=NOW)
+        self.assertEqual(uptime[FLAKY]['24h'], 0.5)
+        probes = sum(record[2] for record in reopened._read_rollup(HOUR, 0))
+        self.assertEqual(probes, 20)
+
+    def test_compact_merges_buckets_and_drops_expired(self):
+        log = updater.UptimeLog(self.directory)
+        # 超出原始记录和小时汇总保留期的旧记录
+        log.append(results(True), NOW - updater.UPTIME_HOURLY_RETENTION - DAY)
+        for _ in range(3):
+            self.fill(log)
+            log.rollup()
+        before = log.uptime(now=NOW)
+
+        log.compact(NOW)
+        hourly = list(log._read_rollup(HOUR, 0))
+        # 每个小时桶、每个服务器只剩一条记录
+        self.assertEqual(len(hourly), 10 * 2)
+        self.assertEqual(os.path.getsize(log.raw_path), 3 * 10 * 2 * updater._UPTIME_RAW.size)
+        self.assertEqual(log.uptime(now=NOW), before)
+        self.assertEqual(updater.UptimeLog(self.directory).uptime(now=NOW), before)
+
+if __name__ == '__main__':
+    unittest.main()